@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+#
+# CPU-less simulation of the CPS1 audio path: the JT51/JT6295/mixer gateware of CPS1MusicboxSoC
+# fed by the VGC sequencer from on-chip memories, no VexRiscv, BIOS, SDRAM model or serial boot.
+#
+
+import argparse
+import os
+import shutil
+
+from migen import *
+
+from litex.build.generic_platform import *
+from litex.build.io import CRG
+from litex.build.sim import SimPlatform
+from litex.build.sim.config import SimConfig
+from litex.build.sim.verilator import verilator_build_args, verilator_build_argdict
+from litex.soc.interconnect import wishbone
+
+from gateware.audio import add_cps1_audio, audio_init_paths, jt6295_rom_bus
+from gateware.daodump import DaoDump
+from gateware.sequencer.sequencer import VGCSequencer
+from vgmtools.adpcm import ROM_SIZE
+from vgmtools.vgc import VGC_NO_LOOP, compile_vgm, parse_vgc, word_wait
+from vgmtools.vgm import load_vgm
+
+# IOs ----------------------------------------------------------------------------------------------
+
+_io = [
+    # Clk / Rst.
+    ("sys_clk", 0, Pins(1)),
+    ("sys_rst", 0, Pins(1)),
+
+    # Audio (wavsink sim module).
+    ("audio", 0,
+        Subsignal("sample", Pins(1)),
+        Subsignal("en",     Pins(1)),
+        Subsignal("left",   Pins(16)),
+        Subsignal("right",  Pins(16)),
+    ),
+]
+
+# Platform -----------------------------------------------------------------------------------------
+
+class Platform(SimPlatform):
+    def __init__(self):
+        SimPlatform.__init__(self, "SIM", _io)
+
+# Stimulus -----------------------------------------------------------------------------------------
+
+def vgc_stimulus(vgc_data, loop=False):
+    """(command words, little endian ROM words, loop index) from a VGC stream
+
+    ROM blocks are preloaded, the sequencer skips the ROM control words. That's only exact when
+    all blocks come before the first wait, as in the bundled tracks.
+    """
+    header, words, blocks = parse_vgc(vgc_data)
+    rom = bytearray(ROM_SIZE)
+    waited = False
+    for word in words:
+        waited |= word_wait(word) != 0
+        if word >> 30 == 3 and (word >> 24) & 0x3f == 1 and waited:
+            print("audio_sim: OKIM6295 ROM block loaded mid-song, preloading it at start")
+    for rom_start_address, data in blocks:
+        rom[rom_start_address:rom_start_address + len(data)] = data
+    rom_words = [int.from_bytes(rom[i:i + 4], "little") for i in range(0, ROM_SIZE, 4)]
+    loop_index = header["loop_index"] if loop else VGC_NO_LOOP
+    return list(words), rom_words, loop_index
+
+# Audio core ---------------------------------------------------------------------------------------
+
+class AudioCoreSim(Module):
+    def __init__(self, platform, clk_freq, vgc_data, loop=False, max_samples=0, jt6295_rom_lines=4,
+                 serial_mixer=False, audio_mode="wav", audio_file=None):
+        words, rom_words, loop_index = vgc_stimulus(vgc_data, loop)
+
+        # CRG --------------------------------------------------------------------------------------
+        self.submodules.crg = CRG(platform.request("sys_clk"))
+        self.comb += platform.trace.eq(1)
+
+        # Audio path, the same wrappers as CPS1MusicboxSoC -----------------------------------------
+        rom_bus = jt6295_rom_bus(32, jt6295_rom_lines)
+        add_cps1_audio(self, platform, clk_freq, rom_buses=[rom_bus], rom_lines=jt6295_rom_lines,
+            serial_mixer=serial_mixer)
+        if jt6295_rom_lines:
+            rom_init = rom_words
+        else:
+            rom_init = [(w >> (8 * i)) & 0xff for w in rom_words for i in range(4)]
+        self.submodules.jt6295_rom = wishbone.SRAM(ROM_SIZE, read_only=True, init=rom_init, bus=rom_bus)
+
+        # Stimulus: VGC command words played by the sequencer --------------------------------------
+        cmd_bus = wishbone.Interface(data_width=32, adr_width=30)
+        self.submodules.vgc_sequencer = VGCSequencer(bus=cmd_bus, clk_freq=clk_freq)
+        self.submodules.vgc_commands = wishbone.SRAM(4 * len(words), read_only=True, init=words,
+                                                     bus=cmd_bus)
+        self.comb += [
+            self.vgc_sequencer.ym2151.connect(self.jt51.sink),
+            self.vgc_sequencer.okim6295.connect(self.jt6295.sink),
+        ]
+
+        # DAO --------------------------------------------------------------------------------------
+        if audio_mode == "raw":
+            self.submodules.dao_dump = DaoDump(platform, dump_file_name=audio_file or "cps1.raw")
+        else:
+            self.submodules.dao_dump = DaoDump(platform, pads=platform.request("audio"))
+        self.comb += [
+            self.dao_dump.sample.eq(self.jt51.sample),
+            self.dao_dump.left.eq(self.mixer.o_mixed_left),
+            self.dao_dump.right.eq(self.mixer.o_mixed_right)
+        ]
+
+        # No CPU nor CSR bus: CSR fields are driven with the values vgmplay writes -----------------
+        self.comb += [
+            self.jt51._control.fields.reset.eq(0),
+            self.jt51._control.fields.cs_n.eq(1),
+            self.jt51._control.fields.wr_n.eq(1),
+            self.jt51._control.fields.a0.eq(1),
+            self.jt6295._control.fields.reset.eq(0),
+            self.jt6295._control.fields.wr_n.eq(1),
+            self.jt6295._control.fields.enable_filter.eq(1),
+            self.jt6295_rom_dma._base.storage.eq(0),
+            self.mixer._control.fields.enable_fm.eq(1),
+            self.mixer._control.fields.enable_pcm.eq(1),
+            self.mixer._control.fields.pcm_level.eq(2),
+            self.vgc_sequencer._base.storage.eq(0),
+            self.vgc_sequencer._loop.storage.eq(loop_index),
+            self.vgc_sequencer._control.fields.enable.eq(1),
+            self.dao_dump._control.fields.en.eq(1),
+        ]
+
+        # End of simulation ------------------------------------------------------------------------
+        done = Signal()
+        self.comb += done.eq(self.vgc_sequencer._status.fields.done)
+        if max_samples:
+            self.comb += If(self.vgc_sequencer._sample.status >= max_samples, done.eq(1))
+        self.sync += If(done, Finish())
+
+# Build --------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU-less CPS1 audio core simulation")
+    verilator_build_args(parser)
+    parser.add_argument("input",                                   help="Input .vgm, .vgz or .vgc file.")
+    parser.add_argument("--output-dir",       default="build/audio_sim", help="Build directory.")
+    parser.add_argument("--loop",             action="store_true", help="Follow the song loop (stop with --samples).")
+    parser.add_argument("--samples",          default=0, type=int, help="Stop after this many 44.1kHz samples (0: end of song).")
+    parser.add_argument("--jt6295-rom-lines", default=4, type=int, help="JT6295 ROM reader line buffer lines (0 to disable).")
+    parser.add_argument("--serial-mixer",     action="store_true", help="Mix both sides with one shared multiplier (see sim.py).")
+    parser.add_argument("--audio-mode",       default="wav",       help="Audio output: raw, wav or pipe (see sim.py).", choices=["raw", "wav", "pipe"])
+    parser.add_argument("--audio-file",       default=None,        help="Audio output file or named pipe (default: cps1.raw/cps1.wav/cps1.pipe in the build directory).")
+    parser.add_argument("--no-compile",       action="store_true", help="Only generate the simulation files.")
+    args = parser.parse_args()
+
+    if args.input.endswith(".vgc"):
+        with open(args.input, "rb") as f:
+            vgc_data = f.read()
+    else:
+        vgc_data = compile_vgm(load_vgm(args.input))
+
+    # same notional clock as sim.py so the JT51/JT6295 clock enables and rates are identical
+    sys_clk_freq = int(24e6)
+    sim_config = SimConfig()
+    sim_config.add_clocker("sys_clk", freq_hz=int(1e6))
+
+    audio_file = None if args.audio_file is None else os.path.abspath(args.audio_file)
+    platform = Platform()
+    top = AudioCoreSim(platform, sys_clk_freq, vgc_data,
+        loop             = args.loop,
+        max_samples      = args.samples,
+        jt6295_rom_lines = args.jt6295_rom_lines,
+        serial_mixer     = args.serial_mixer,
+        audio_mode       = args.audio_mode,
+        audio_file       = audio_file)
+
+    extra_mods = []
+    if args.audio_mode != "raw":
+        sim_config.add_module("wavsink", "audio", args={
+            "filename" : audio_file or "cps1.{}".format("wav" if args.audio_mode == "wav" else "pipe"),
+            "rate"     : round(top.jt51.sample_rate),
+            "mode"     : args.audio_mode,
+        })
+        extra_mods.append("wavsink")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for f in audio_init_paths():
+        shutil.copy(f, args.output_dir)
+
+    platform.build(top,
+        build_dir       = args.output_dir,
+        sim_config      = sim_config,
+        interactive     = False,
+        run             = not args.no_compile,
+        extra_mods      = extra_mods,
+        extra_mods_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "gateware", "sim", "modules"),
+        **verilator_build_argdict(args))
+
+if __name__ == "__main__":
+    main()
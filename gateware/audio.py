@@ -0,0 +1,97 @@
+from migen import *
+
+from litex.soc.interconnect import wishbone
+
+from gateware.jt51.jt51 import JT51
+from gateware.jt6295.jt6295 import JT6295RomBRAM, JT6295RomWishboneDMAReader, JT6295
+from gateware.jtframe.sound.mixer import CPS1StereoMixer
+from gateware.jtframe.sound.uprate2_fir import Uprate2Fir
+
+JT6295_ROM_SIZE = 256 * 1024
+
+
+def jt6295_rom_bus(address_width, rom_lines):
+    """Wishbone master for the JT6295 ROM reader, address_width is the byte address width"""
+    if rom_lines:
+        # burst line buffer on a 32-bit bus
+        return wishbone.Interface(data_width=32, adr_width=address_width - 2)
+    return wishbone.Interface(data_width=8, adr_width=address_width)
+
+
+def jt6295_rom_bram_bus(size):
+    """Write window of a JT6295 BRAM ROM of size bytes"""
+    return wishbone.Interface(data_width=32, adr_width=log2_int(size) - 2)
+
+
+def chip_name(name, chip):
+    """Submodule (and CSR bank) name of a chip: jt51, jt51_1, jt51_2..."""
+    return name if chip == 0 else f"{name}_{chip}"
+
+
+def add_cps1_audio(module, platform, clk_freq, rom_buses, rom_base=0, rom_size=JT6295_ROM_SIZE,
+                   rom_lines=4, rom_line_words=4, serial_mixer=False, rom_bram_size=0):
+    """CPS1 audio path: JT51 and JT6295 (ROM read over rom_buses) into the stereo mixer
+
+    Adds one JT51/JT6295 pair per ROM bus: the jt51, jt6295_rom_dma, jt6295 and
+    jtframe_uprate2_fir submodules for the first one, jt51_1, jt6295_rom_dma_1... for the next
+    ones, each ROM reader starting at its own rom_size window of rom_base. Then the mixer
+    submodule, with the FM and PCM outputs of every pair. The SoC and the CPU-less audio core
+    simulation (audio_sim.py) share the same wrappers and CSR names. serial_mixer mixes both sides
+    with one shared multiplier (SerialMixer) instead of two jtframe_mixer cores, needed past two
+    pairs. With rom_bram_size the ROMs are on-chip instead (jt6295_rom_bram, jt6295_rom_bram_1...
+    submodules, no ROM reader) and rom_buses their write windows.
+    """
+    outputs = []
+    rom_name = "jt6295_rom_bram" if rom_bram_size else "jt6295_rom_dma"
+    for i, rom_bus in enumerate(rom_buses):
+        jt51 = JT51(platform, clk_freq)
+        if rom_bram_size:
+            rom = JT6295RomBRAM(bus=rom_bus, size=rom_bram_size)
+        else:
+            rom = JT6295RomWishboneDMAReader(
+                bus=rom_bus,
+                base_address=rom_base + i * rom_size,
+                with_csr=True,
+                n_lines=rom_lines,
+                line_words=rom_line_words
+            )
+        jt6295 = JT6295(
+            platform=platform,
+            clk_freq=clk_freq
+        )
+        uprate2_fir = Uprate2Fir(platform)
+        setattr(module.submodules, chip_name("jt51", i), jt51)
+        setattr(module.submodules, chip_name(rom_name, i), rom)
+        setattr(module.submodules, chip_name("jt6295", i), jt6295)
+        setattr(module.submodules, chip_name("jtframe_uprate2_fir", i), uprate2_fir)
+
+        module.comb += [
+            rom.i_rom_addr.eq(jt6295.o_rom_addr),
+            jt6295.i_rom_data.eq(rom.o_rom_data),
+            jt6295.i_rom_ok.eq(rom.o_rom_ok),
+        ]
+
+        jt6295_sound_upsampled = Signal(16)
+        module.comb += [
+            uprate2_fir.i_sample.eq(jt6295.sample),
+            uprate2_fir.l_in.eq(Cat(Signal(2), jt6295.sound)),
+            uprate2_fir.r_in.eq(0),
+            jt6295_sound_upsampled.eq(uprate2_fir.l_out)
+        ]
+
+        outputs.append((jt51, jt6295_sound_upsampled))
+
+    module.submodules.mixer = mixer = CPS1StereoMixer(platform, serial=serial_mixer,
+                                                      n_chips=len(outputs))
+    for i, (jt51, pcm) in enumerate(outputs):
+        module.comb += [
+            mixer.i_fm_left[i].eq(jt51.xleft),
+            mixer.i_fm_right[i].eq(jt51.xright),
+            mixer.i_pcm_left[i].eq(pcm),
+            mixer.i_pcm_right[i].eq(pcm),
+        ]
+
+
+def audio_init_paths():
+    """FIR coefficient files the simulation/synthesis has to find in the build directory"""
+    return JT6295.fir_init_paths() + Uprate2Fir.fir_init_paths()
@@ -0,0 +1,106 @@
+import glob
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+# Banners of the generated files hold the generation date
+DATE_RE = re.compile(rb"^\s*(//|#).*\d{4}-\d\d-\d\d \d\d:\d\d:\d\d.*$", re.M)
+
+
+def sim_build_files(build_name):
+    """Verilator harness files generated next to the Verilog, outputs to cache"""
+    inputs = ["sim_init.cpp", "sim_core.h", "variables.mak", f"build_{build_name}.sh"]
+    outputs = ["obj_dir/V" + build_name, "modules/*.so"]
+    return inputs, outputs
+
+
+def trellis_build_files(build_name):
+    """yosys/nextpnr scripts and constraints generated next to the Verilog, outputs to cache"""
+    inputs = [f"{build_name}.ys", f"{build_name}.lpf", f"build_{build_name}.sh"]
+    outputs = [f"{build_name}.bit", f"{build_name}.svf"]
+    return inputs, outputs
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(DATE_RE.sub(b"", f.read())).hexdigest()
+
+
+def _tool_version(cmd):
+    try:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    except OSError:
+        return b""
+
+
+def build_key(platform, gateware_dir, inputs, with_init_files, tools=(), source_dirs=()):
+    """(key, [(hash, file)]) of a generated design
+
+    Hashes the RTL sources of the platform (the generated Verilog included, it holds the SoC
+    parameters and everything the Python code elaborated), the toolchain input files of
+    gateware_dir, the files of source_dirs and the version output of the tools. Init files
+    (memory contents, FIR coefficients) are only hashed with_init_files: a Verilator model reads
+    them when it starts, a bitstream holds them.
+    """
+    files = [f for f, *_ in platform.sources]
+    files += [os.path.join(gateware_dir, f) for f in inputs]
+    if with_init_files:
+        files += glob.glob(os.path.join(gateware_dir, "*.init"))
+        files += glob.glob(os.path.join(gateware_dir, "*.hex"))
+    for d in source_dirs:
+        files += [f for f in glob.glob(os.path.join(d, "**"), recursive=True) if os.path.isfile(f)]
+    init_suffixes = (".init", ".hex")
+    hashes = []
+    for f in sorted(set(os.path.abspath(f) for f in files)):
+        if not with_init_files and f.endswith(init_suffixes):
+            continue
+        name = os.path.relpath(f, gateware_dir) if f.startswith(os.path.abspath(gateware_dir)) else f
+        hashes.append((_file_hash(f), name))
+    for cmd in tools:
+        hashes.append((hashlib.sha256(_tool_version(cmd)).hexdigest(), " ".join(cmd)))
+
+    key = hashlib.sha256("".join(f"{h} {name}\n" for h, name in hashes).encode()).hexdigest()
+    return key, hashes
+
+
+def cached_build(cache_dir, platform, gateware_dir, build_name, inputs, outputs, with_init_files,
+                 tools=(), source_dirs=()):
+    """Runs the build script of gateware_dir, unless cache_dir holds its outputs for the same key
+
+    outputs are glob patterns relative to gateware_dir. Returns True on a cache hit.
+    """
+    key, hashes = build_key(platform, gateware_dir, inputs, with_init_files, tools, source_dirs)
+    entry = os.path.join(os.path.abspath(cache_dir), key)
+
+    if os.path.isdir(entry):
+        for pattern in outputs:
+            for f in glob.glob(os.path.join(entry, pattern)):
+                dst = os.path.join(gateware_dir, os.path.relpath(f, entry))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copy2(f, dst)
+        print(f"build cache hit ({key[:16]}), {build_name} build skipped")
+        return True
+
+    print(f"build cache miss ({key[:16]}), building {build_name}")
+    subprocess.run(["bash", f"build_{build_name}.sh"], cwd=gateware_dir, check=True)
+
+    # store through a temporary directory, an interrupted store is never a hit
+    tmp = entry + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for pattern in outputs:
+        for f in glob.glob(os.path.join(gateware_dir, pattern)):
+            dst = os.path.join(tmp, os.path.relpath(f, gateware_dir))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(f, dst)
+    # what went in the key, to diff two entries when the cache misses unexpectedly
+    with open(os.path.join(tmp, "inputs.txt"), "w") as f:
+        f.writelines(f"{h} {name}\n" for h, name in hashes)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # stored meanwhile by another build
+        shutil.rmtree(tmp, ignore_errors=True)
+    return False
@@ -0,0 +1,81 @@
+from migen import *
+from litex.soc.cores.dma import WishboneDMAWriter
+from litex.soc.interconnect import stream, wishbone
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus
+
+
+class AudioCapture(Module, AutoCSR):
+    """Audio capture to memory
+
+    Latches the 16-bit channels at every sample strobe and writes them, two channels per 32-bit
+    word (the first one in the low half, like interleaved 16-bit WAV frames), to a memory ring
+    buffer with a WishboneDMAWriter. The CPU isn't involved: the writer CSRs (dma_base,
+    dma_length in bytes, dma_loop, dma_enable) are set over the bridge (vgmtools/capture.py), a
+    rising edge of dma_enable restarts the capture at dma_base. A FIFO absorbs the memory latency,
+    a sample that doesn't fit is dropped (and counted) as a whole.
+    """
+    def __init__(self, bus, channels, fifo_depth=64, default_base=0, default_length=0):
+        assert isinstance(bus, wishbone.Interface) and bus.data_width == 32
+        self.sample = Signal()
+
+        self._count = CSRStatus(32, description="Words written since the capture was enabled")
+        self._dropped = CSRStatus(32, description="Samples dropped since the capture was enabled (FIFO full)")
+
+        # # #
+
+        channels = channels + [Signal(16)] * (len(channels) % 2)
+        words = [Cat(channels[i], channels[i + 1]) for i in range(0, len(channels), 2)]
+        self.n_words = n_words = len(words)
+        assert fifo_depth >= n_words
+
+        # "big": words go to the bus as they are, LiteX "little" swaps their bytes
+        self.submodules.dma = dma = WishboneDMAWriter(bus, endianness="big")
+        dma.add_csr(default_base=default_base, default_length=default_length, default_loop=1)
+        enable = Signal()
+        enable_d = Signal()
+        self.comb += enable.eq(dma._enable.storage)
+        self.sync += enable_d.eq(enable)
+
+        # words of a stopped capture are flushed, the next one starts on a sample
+        self.submodules.fifo = fifo = ResetInserter()(stream.SyncFIFO([("data", 32)], fifo_depth))
+        self.comb += [
+            fifo.reset.eq(~enable),
+            fifo.source.connect(dma.sink),
+        ]
+
+        sample_d = Signal()
+        sample_edge = Signal()
+        self.sync += sample_d.eq(self.sample)
+        self.comb += sample_edge.eq(self.sample & ~sample_d)
+
+        latched = Signal(32 * n_words)
+        word = Signal(max=n_words + 1)
+        count = Signal(32)
+        dropped = Signal(32)
+        self.comb += [
+            self._count.status.eq(count),
+            self._dropped.status.eq(dropped),
+            fifo.sink.valid.eq(word != n_words),
+            fifo.sink.data.eq(Array(latched[32 * i:32 * (i + 1)] for i in range(n_words))[word]),
+        ]
+        self.sync += [
+            If(~enable,
+                word.eq(n_words)
+            ).Else(
+                If(fifo.sink.valid & fifo.sink.ready, word.eq(word + 1)),
+                If(sample_edge,
+                    If((word == n_words) & (fifo.level <= fifo_depth - n_words),
+                        latched.eq(Cat(*words)),
+                        word.eq(0)
+                    ).Elif(~dma._done.status,
+                        dropped.eq(dropped + 1)
+                    )
+                )
+            ),
+            If(enable & ~enable_d,
+                count.eq(0),
+                dropped.eq(0)
+            ).Elif(dma.sink.valid & dma.sink.ready,
+                count.eq(count + 1)
+            )
+        ]
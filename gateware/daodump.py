@@ -3,8 +3,15 @@ import os
 from litex.soc.interconnect.csr import *
 
 class DaoDump(Module, AutoCSR):
-    def __init__(self, platform, dump_file_name="dao.raw"):
+    """Audio output dump for simulation
+
+    Without pads every sample is written by dao_dump.v with $fwrite to a headerless raw file.
+    With pads (sample, en, left, right) the samples are handed to a simulation module instead, see
+    gateware/sim/modules/wavsink.
+    """
+    def __init__(self, platform, dump_file_name="dao.raw", pads=None):
         self.platform = platform
+        self.pads = pads
 
         self.sample = Signal()
         self.left = Signal(16)
@@ -17,6 +24,15 @@ class DaoDump(Module, AutoCSR):
         en = Signal()
         self.comb += en.eq(self._control.fields.en)
 
+        if pads is not None:
+            self.comb += [
+                pads.sample.eq(self.sample),
+                pads.en.eq(en),
+                pads.left.eq(self.left),
+                pads.right.eq(self.right)
+            ]
+            return
+
         self.dao_dump_params = dict(
             p_DUMPFILE=dump_file_name,
             i_sample=self.sample,
@@ -33,4 +49,5 @@ class DaoDump(Module, AutoCSR):
         platform.add_source(os.path.join(vdir, "dao_dump.v"))
 
     def do_finalize(self):
-        self.specials += Instance("dao_dump", **self.dao_dump_params)
\ No newline at end of file
+        if self.pads is None:
+            self.specials += Instance("dao_dump", **self.dao_dump_params)
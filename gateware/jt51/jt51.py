@@ -2,6 +2,7 @@ import logging
 import os
 
 from migen import *
+from litex.soc.interconnect import stream
 from litex.soc.interconnect.csr_eventmanager import EventManager, EventSourceLevel
 from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
 
@@ -20,9 +21,10 @@ class CenJT51(Module):
 YM2151_FREQ = 3570000
 
 class JT51(Module, AutoCSR):
-    def __init__(self, platform, clk_freq, with_irq=False):
+    def __init__(self, platform, clk_freq, with_irq=False, cmd_fifo_depth=64):
         assert(clk_freq > YM2151_FREQ)
         self.platform = platform
+        self.cmd_fifo_depth = cmd_fifo_depth
 
         self.ct1 = Signal()
         self.ct2 = Signal()
@@ -41,37 +43,119 @@ class JT51(Module, AutoCSR):
             CSRField('cs_n', reset=1, size=1, description='Chip select'),
             CSRField('wr_n', reset=1, size=1, description='Write'),
             CSRField('a0', reset=1, size=1, description='A0'),
+            CSRField('clear_overflow', size=1, pulse=True, description='Clear cmd FIFO overflow flag'),
         ])
         reset = Signal()
         cs_n = Signal()
         wr_n = Signal()
         a0 = Signal()
-        self.comb += [
-            reset.eq(self._control.fields.reset),
-            cs_n.eq(self._control.fields.cs_n),
-            wr_n.eq(self._control.fields.wr_n),
-            a0.eq(self._control.fields.a0)
-        ]
 
         self._din = CSRStorage(8, reset_less=True, description="Data in")
         self._dout = CSRStatus(8, description="Data out")
         din = Signal(8)
         dout = Signal(8)
-        self.comb += [
-            din.eq(self._din.storage),
-            self._dout.status.eq(dout)
-        ]
+        self.comb += self._dout.status.eq(dout)
 
         self.logger = logging.getLogger("JT51")
         self.logger.info(f'JT51 clock {YM2151_FREQ}Hz from {clk_freq}Hz')
         cen = Signal()
         cen_p1 = Signal()
-        self.submodules.clock_enable = CenJT51(tuning_word=int((YM2151_FREQ / clk_freq) * 2 ** 32))
+        tuning_word = int((YM2151_FREQ / clk_freq) * 2 ** 32)
+        self.submodules.clock_enable = CenJT51(tuning_word=tuning_word)
+        # one output sample every 64 cen
+        self.sample_rate = tuning_word * clk_freq / 2 ** 32 / 64
         self.comb += [
             cen.eq(self.clock_enable.cen),
             cen_p1.eq(self.clock_enable.cen_p1),
         ]
 
+        # Register writes: {addr, data} in a single CSR write, queued in a FIFO
+        self._cmd = CSRStorage(description="Register write", fields=[
+            CSRField('data', size=8, description='Register value'),
+            CSRField('addr', size=8, description='Register address'),
+        ])
+        self._cmd_status = CSRStatus(description="Register write FIFO status", fields=[
+            CSRField('level', size=bits_for(cmd_fifo_depth), description='Queued writes'),
+            CSRField('overflow', size=1, description='A write was dropped because the FIFO was full'),
+        ])
+        self.submodules.cmd_fifo = cmd_fifo = stream.SyncFIFO([("addr", 8), ("data", 8)], cmd_fifo_depth)
+        overflow = Signal()
+        self.comb += [
+            cmd_fifo.sink.valid.eq(self._cmd.re),
+            cmd_fifo.sink.addr.eq(self._cmd.fields.addr),
+            cmd_fifo.sink.data.eq(self._cmd.fields.data),
+            self._cmd_status.fields.level.eq(cmd_fifo.level),
+            self._cmd_status.fields.overflow.eq(overflow),
+        ]
+        self.sync += If(self._control.fields.clear_overflow,
+            overflow.eq(0)
+        ).Elif(self._cmd.re & ~cmd_fifo.sink.ready,
+            overflow.eq(1)
+        )
+
+        # Hardware register write port: sequences cs_n/a0/wr_n and waits on the busy flag, the
+        # control/din CSRs drive the chip while it's idle. Queued CSR writes go first.
+        self.sink = sink = stream.Endpoint([("addr", 8), ("data", 8)])
+        busy = Signal()
+        settle = Signal(2)
+        addr = Signal(8)
+        data = Signal(8)
+        self.comb += busy.eq(dout[7])
+
+        # Set while the last CPU poll (read of dout or cmd_status) said to wait: busy flag, full
+        # FIFO. Performance counters count the cycles the CPU loses on it
+        self.cpu_wait = Signal()
+        self.sync += If(self._dout.we,
+            self.cpu_wait.eq(busy)
+        ).Elif(self._cmd_status.we,
+            self.cpu_wait.eq(~cmd_fifo.sink.ready)
+        )
+
+        self.submodules.write_fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+                If(~busy,
+                   If(cmd_fifo.source.valid,
+                      cmd_fifo.source.ready.eq(1),
+                      NextValue(addr, cmd_fifo.source.addr),
+                      NextValue(data, cmd_fifo.source.data),
+                      NextState("ADDR")
+                   ).Elif(sink.valid,
+                      sink.ready.eq(1),
+                      NextValue(addr, sink.addr),
+                      NextValue(data, sink.data),
+                      NextState("ADDR")))
+        )
+        fsm.act("ADDR",
+                cs_n.eq(0), wr_n.eq(0), a0.eq(0), din.eq(addr),
+                If(cen, NextState("ADDR-RELEASE"))
+        )
+        fsm.act("ADDR-RELEASE",
+                cs_n.eq(1), wr_n.eq(0), a0.eq(1), din.eq(data),
+                NextState("DATA")
+        )
+        fsm.act("DATA",
+                cs_n.eq(0), wr_n.eq(0), a0.eq(1), din.eq(data),
+                If(cen,
+                   NextValue(settle, 0),
+                   NextState("SETTLE"))
+        )
+        # give the chip a few cycles to raise busy before looking at it again
+        fsm.act("SETTLE",
+                cs_n.eq(1), wr_n.eq(1), a0.eq(1),
+                If(cen,
+                   NextValue(settle, settle + 1),
+                   If(settle == 3, NextState("IDLE")))
+        )
+        self.comb += [
+            reset.eq(self._control.fields.reset),
+            If(fsm.ongoing("IDLE"),
+               cs_n.eq(self._control.fields.cs_n),
+               wr_n.eq(self._control.fields.wr_n),
+               a0.eq(self._control.fields.a0),
+               din.eq(self._din.storage)
+            )
+        ]
+
         self.jt51_params = dict(
             i_rst=ResetSignal() | reset,
             i_clk=ClockSignal(),
@@ -2,7 +2,7 @@ import logging
 
 from migen import *
 from litex.soc.cores.dma import WishboneDMAReader
-from litex.soc.interconnect import wishbone
+from litex.soc.interconnect import stream, wishbone
 from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
 
 from gateware.jtframe.sound.pole import Pole
@@ -20,57 +20,271 @@ MSM6295_FREQ = 1e6
 class JT6295RomWishboneDMAReader(Module, AutoCSR):
     """ROM DMA
 
+    Without line buffer (n_lines=0) every change of i_rom_addr is a single byte read on an 8-bit
+    bus. With n_lines > 0 the bus must be 32-bit or wider: a miss fetches line_words consecutive
+    words in an incrementing burst into one of n_lines fully associative lines (round robin
+    replacement) and sequential ADPCM reads of the 4 voices are served from them in one cycle.
+    invalidate (the control CSR pulse, base CSR writes) drops the buffered data once the ROM has
+    been rewritten, the current address is read again.
     """
-    def __init__(self, bus, base_address=0, with_csr=False):
+    def __init__(self, bus, base_address=0, with_csr=False, n_lines=0, line_words=4):
         assert isinstance(bus, wishbone.Interface)
-        assert bus.data_width == 8
         self.bus = bus
+        self.n_lines = n_lines
 
         self.i_rom_addr = Signal(18)
         self.o_rom_data = Signal(8)
         self.o_rom_ok = Signal()
+        self.invalidate = Signal()
+
+        # byte address
+        self.address_width = bus.adr_width + log2_int(bus.data_width // 8)
+        self.base_address = Signal(self.address_width, reset=base_address)
+
+        current_address = Signal(self.address_width)
+        self.comb += current_address.eq(self.i_rom_addr + self.base_address)
+
+        if n_lines:
+            self.add_line_buffer(current_address, n_lines, line_words)
+        else:
+            self.add_byte_reader(current_address)
 
-        self.base_address = Signal(bus.adr_width, reset=base_address)
+        if with_csr:
+            self.add_csr(default_base=base_address)
+
+    def add_byte_reader(self, current_address):
+        bus = self.bus
+        assert bus.data_width == 8
 
         # Submodules
         self.submodules.dma = WishboneDMAReader(bus)
 
+        # address being read, o_rom_ok is only set once its byte is in and while it matches
+        # i_rom_addr. After an invalidate it's read again
+        address = Signal(self.address_width)
         data_valid = Signal()
         new_address = Signal()
-        current_address = Signal(bus.adr_width)
-        prev_address = Signal(bus.adr_width)
-
-        self.sync += [
-            prev_address.eq(current_address),
-            If(self.dma.source.valid, data_valid.eq(1))
-        ]
+        refetch = Signal(reset=1)
         self.comb += [
-            new_address.eq(current_address != prev_address),
-            current_address.eq(self.i_rom_addr + self.base_address),
-            self.dma.sink.address.eq(current_address)
+            new_address.eq((current_address != address) | refetch),
+            self.dma.sink.address.eq(address)
         ]
 
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        self.sync += If(self.invalidate, refetch.eq(1)).Elif(fsm.ongoing("IDLE") & new_address, refetch.eq(0))
         fsm.act("IDLE",
-                self.o_rom_ok.eq(data_valid),
-                If(new_address, self.o_rom_ok.eq(0), NextState("CMD"))
+                self.o_rom_ok.eq(data_valid & ~new_address),
+                If(new_address,
+                    NextValue(address, current_address),
+                    NextValue(data_valid, 0),
+                    NextState("CMD")
+                )
         )
+        # the DMA takes the address back when it hands out the byte
         fsm.act("CMD",
-                self.dma.source.ready.eq(1),
                 self.dma.sink.valid.eq(1),
                 self.dma.sink.last.eq(1),
-                If(self.dma.sink.valid & self.dma.sink.ready, NextState("IDLE"))
+                self.dma.source.ready.eq(1),
+                If(self.dma.source.valid,
+                    NextValue(self.o_rom_data, self.dma.source.data),
+                    NextValue(data_valid, 1),
+                    NextState("IDLE")
+                )
         )
 
-        self.sync += If(self.dma.source.valid & self.dma.source.ready, self.o_rom_data.eq(self.dma.source.data))
+    def add_line_buffer(self, current_address, n_lines, line_words):
+        bus = self.bus
+        assert bus.data_width >= 32
+        dw = bus.data_width
+        word_shift = log2_int(dw // 8)
+        line_shift = word_shift + log2_int(line_words)
+        line_bytes = 2 ** line_shift
+
+        self.hits = Signal(32)
+        self.misses = Signal(32)
+
+        lines = [Signal(dw * line_words) for i in range(n_lines)]
+        tags = [Signal(self.address_width - line_shift) for i in range(n_lines)]
+        valids = [Signal() for i in range(n_lines)]
+
+        # address being served, o_rom_ok is only set while it matches i_rom_addr. After an
+        # invalidate it's read again and the line being filled isn't kept
+        address = Signal(self.address_width)
+        data_ok = Signal()
+        new_address = Signal()
+        refetch = Signal()
+        self.comb += new_address.eq((current_address != address) | refetch)
+
+        hit = Signal()
+        hit_line = Signal(max=max(n_lines, 2))
+        for i in range(n_lines):
+            self.comb += If(valids[i] & (tags[i] == current_address[line_shift:]), hit.eq(1), hit_line.eq(i))
+
+        fill_line = Signal(max=max(n_lines, 2))
+        victim = Signal(max=max(n_lines, 2))
+        word = Signal(max=max(line_words, 2))
+        last = Signal()
+        self.comb += last.eq(word == line_words - 1)
+
+        line_sel = Signal(max=max(n_lines, 2))
+        line_data = Signal(dw * line_words)
+        rom_data = Signal(8)
+        self.comb += [
+            line_data.eq(Array(lines)[line_sel]),
+            rom_data.eq(Array(line_data[8 * i:8 * (i + 1)] for i in range(line_bytes))[current_address[:line_shift]]),
+        ]
+
+        start_fill = Signal()
+        fill_ack = Signal()
 
-        if with_csr:
-            self.add_csr(default_base=base_address)
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+                self.o_rom_ok.eq(data_ok & ~new_address),
+                line_sel.eq(hit_line),
+                If(new_address,
+                   NextValue(address, current_address),
+                   If(hit,
+                      NextValue(self.hits, self.hits + 1),
+                      NextValue(self.o_rom_data, rom_data),
+                      NextValue(data_ok, 1)
+                   ).Else(
+                      start_fill.eq(1),
+                      NextValue(self.misses, self.misses + 1),
+                      NextValue(data_ok, 0),
+                      NextValue(fill_line, victim),
+                      NextValue(victim, Mux(victim == n_lines - 1, 0, victim + 1)),
+                      NextValue(word, 0),
+                      NextState("FILL")))
+        )
+        fsm.act("FILL",
+                bus.cyc.eq(1),
+                bus.stb.eq(1),
+                bus.we.eq(0),
+                bus.sel.eq(2 ** (dw // 8) - 1),
+                bus.adr.eq(Cat(word[:log2_int(line_words)], address[line_shift:])),
+                bus.cti.eq(Mux(last, 0b111, 0b010)),  # incrementing burst
+                bus.bte.eq(0b00),
+                fill_ack.eq(bus.ack),
+                If(bus.ack,
+                   NextValue(word, word + 1),
+                   If(last, NextState("SERVE")))
+        )
+        fsm.act("SERVE",
+                line_sel.eq(fill_line),
+                NextValue(self.o_rom_data, rom_data),
+                NextValue(data_ok, 1),
+                NextState("IDLE")
+        )
+
+        for i in range(n_lines):
+            for w in range(line_words):
+                self.sync += If(fill_ack & (fill_line == i) & (word == w),
+                                lines[i][dw * w:dw * (w + 1)].eq(bus.dat_r))
+            self.sync += If(self.invalidate | (start_fill & (victim == i)),
+                valids[i].eq(0)
+            ).Elif(fill_ack & last & (fill_line == i) & ~refetch,
+                valids[i].eq(1),
+                tags[i].eq(address[line_shift:])
+            )
+        self.sync += If(self.invalidate,
+            refetch.eq(1)
+        ).Elif(start_fill,
+            refetch.eq(0)
+        )
 
     def add_csr(self, default_base=0):
-        self._base = CSRStorage(self.bus.adr_width, reset=default_base)
+        self._base = CSRStorage(self.address_width, reset=default_base)
+
+        self._control = CSRStorage(description="ROM DMA control", fields=[
+            CSRField('invalidate', size=1, pulse=True, description='Drop the buffered ROM data (ROM rewritten)'),
+        ])
+
+        self.comb += [
+            self.base_address.eq(self._base.storage),
+            self.invalidate.eq(self._control.fields.invalidate | self._base.re),
+        ]
+
+        if self.n_lines:
+            self._hits = CSRStatus(32, description="Line buffer hits")
+            self._misses = CSRStatus(32, description="Line buffer misses")
+            self.comb += [
+                self._hits.status.eq(self.hits),
+                self._misses.status.eq(self.misses),
+            ]
 
-        self.comb += self.base_address.eq(self._base.storage)
+
+class JT6295RomLiteDRAMReader(Module):
+    """ROM reader bursts to a LiteDRAM native read port
+
+    Connects the line buffer bus of a JT6295RomWishboneDMAReader to a dedicated port of the
+    LiteDRAM crossbar, out of the main Wishbone interconnect and L2 cache. On the first beat of a
+    burst the commands of all its burst_words words are issued back to back, the words are acked
+    as the port returns them. Only the read bursts of the line buffer are supported: aligned,
+    burst_words long, data accepted on every cycle.
+    """
+    def __init__(self, bus, port, base_address=0, burst_words=4):
+        assert isinstance(bus, wishbone.Interface)
+        assert port.data_width == bus.data_width
+        offset = base_address >> log2_int(port.data_width // 8)
+
+        active = Signal()
+        adr = Signal(len(bus.adr))
+        cmd_count = Signal(max=burst_words + 1)
+        data_count = Signal(max=max(burst_words, 2))
+
+        self.comb += [
+            port.cmd.valid.eq(active & (cmd_count != burst_words)),
+            port.cmd.we.eq(0),
+            port.cmd.last.eq(cmd_count == burst_words - 1),
+            port.cmd.addr.eq(adr + cmd_count - offset),
+            port.rdata.ready.eq(1),
+            bus.ack.eq(bus.cyc & bus.stb & active & port.rdata.valid),
+            bus.dat_r.eq(port.rdata.data),
+        ]
+        self.sync += If(~active,
+            If(bus.cyc & bus.stb,
+                active.eq(1),
+                adr.eq(bus.adr),
+                cmd_count.eq(0),
+                data_count.eq(0)
+            )
+        ).Else(
+            If(port.cmd.valid & port.cmd.ready, cmd_count.eq(cmd_count + 1)),
+            If(port.rdata.valid,
+                data_count.eq(data_count + 1),
+                If(data_count == burst_words - 1, active.eq(0))
+            )
+        )
+
+
+class JT6295RomBRAM(Module):
+    """On-chip ROM
+
+    A dual port block RAM of size bytes: the read port serves i_rom_addr with a fixed one cycle
+    latency, the 32-bit Wishbone bus (write window, byte enables, also readable) fills it. ROM
+    addresses past size wrap around.
+    """
+    def __init__(self, bus, size):
+        assert isinstance(bus, wishbone.Interface) and bus.data_width == 32
+        assert 4 <= size <= 2 ** 18
+        self.bus = bus
+
+        self.i_rom_addr = Signal(18)
+        self.o_rom_data = Signal(8)
+        self.o_rom_ok = Signal()
+
+        mem = Memory(32, size // 4)
+        self.submodules.sram = wishbone.SRAM(mem, bus=bus)
+        self.specials.read_port = read_port = mem.get_port()
+
+        # o_rom_ok once the word of the current address has been read
+        address = Signal(18)
+        self.sync += address.eq(self.i_rom_addr)
+        self.comb += [
+            read_port.adr.eq(self.i_rom_addr[2:log2_int(size)]),
+            self.o_rom_data.eq(Array(read_port.dat_r[8 * i:8 * (i + 1)] for i in range(4))[address[:2]]),
+            self.o_rom_ok.eq(address == self.i_rom_addr),
+        ]
 
 
 class JT6295(Module, AutoCSR):
@@ -103,7 +317,6 @@ class JT6295(Module, AutoCSR):
         self.comb += [
             reset.eq(self._control.fields.reset),
             self.ss.eq(self._control.fields.ss),
-            wr_n.eq(self._control.fields.wr_n),
             enable_filter.eq(self._control.fields.enable_filter)
         ]
 
@@ -111,10 +324,7 @@ class JT6295(Module, AutoCSR):
         self._dout = CSRStatus(8, description="Data out")
         din = Signal(8)
         dout = Signal(8)
-        self.comb += [
-            din.eq(self._din.storage),
-            self._dout.status.eq(dout)
-        ]
+        self.comb += self._dout.status.eq(dout)
 
         self.logger = logging.getLogger("JT6295")
         self.logger.info(f'JT6295 clock {MSM6295_FREQ}Hz from {clk_freq}Hz')
@@ -122,6 +332,28 @@ class JT6295(Module, AutoCSR):
         self.submodules.clock_enable = CenJT6295(tuning_word=int((MSM6295_FREQ / clk_freq) * 2 ** 32))
         self.comb += cen.eq(self.clock_enable.cen)
 
+        # Hardware command write port: holds wr_n low for a whole cen period, the control/din
+        # CSRs drive the chip while it's idle
+        self.sink = sink = stream.Endpoint([("data", 8)])
+        self.submodules.write_fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+                If(sink.valid, NextState("WRITE"))
+        )
+        fsm.act("WRITE",
+                wr_n.eq(0), din.eq(sink.data),
+                If(cen, NextState("RELEASE"))
+        )
+        fsm.act("RELEASE",
+                wr_n.eq(1), din.eq(sink.data),
+                If(cen,
+                   sink.ready.eq(1),
+                   NextState("IDLE"))
+        )
+        self.comb += If(fsm.ongoing("IDLE"),
+            wr_n.eq(self._control.fields.wr_n),
+            din.eq(self._din.storage)
+        )
+
         sound_raw = Signal(len(self.sound))
         self.jt6295_params = dict(
             p_INTERPOL=interpol,
@@ -53,14 +53,118 @@ class Mixer(Module):
     def do_finalize(self):
         self.specials += Instance("jtframe_mixer", **self.jtframe_mixer_params)
 
+class SerialMixer(Module):
+    """Time-multiplexed mixer: one multiplier shared by all the channels of all the outputs
+
+    Each output is the sum of its n_channels inputs times their gains, with the jtframe_mixer
+    arithmetic: inputs left aligned to 16 bits, 4.4 fixed point gains (0x10 is unity), the sum is
+    saturated to 16 bits (o_peak is set while an output clips) and its top wout bits are output.
+    gains (one per channel, the same for every output) makes them constants, else i_gain is driven
+    by the user.
+
+    The products are accumulated one per clock cycle, output after output, so each output is
+    refreshed every n_outputs * n_channels cycles (3 cycles of latency): audio only changes at the
+    sample rate, a few hundred times slower than the system clock.
+    """
+    def __init__(self, n_channels=2, n_outputs=2, w=16, wout=16, gains=None):
+        assert w <= 16 and wout <= 16
+        self.i_ch = [[Signal((w, True)) for c in range(n_channels)] for o in range(n_outputs)]
+        self.i_gain = [[Signal(8) for c in range(n_channels)] for o in range(n_outputs)]
+        self.o_mixed = [Signal((wout, True)) for o in range(n_outputs)]
+        self.o_peak = Signal()
+
+        if gains is not None:
+            assert len(gains) == n_channels
+            self.comb += [self.i_gain[o][c].eq(gains[c]) for o in range(n_outputs) for c in range(n_channels)]
+
+        # # #
+
+        # sequencer: output o, channel c
+        o = Signal(max=max(n_outputs, 2))
+        c = Signal(max=max(n_channels, 2))
+        self.sync += [
+            If(c == n_channels - 1,
+                c.eq(0),
+                If(o == n_outputs - 1,
+                    o.eq(0)
+                ).Else(
+                    o.eq(o + 1)
+                )
+            ).Else(
+                c.eq(c + 1)
+            )
+        ]
+
+        # stage 1: select the channel, left aligned to 16 bits
+        ch = Array(Array(x if w == 16 else Cat(Replicate(0, 16 - w), x) for x in row) for row in self.i_ch)
+        gain = Array(Array(row) for row in self.i_gain)
+        a = Signal((16, True))
+        b = Signal((9, True))
+        o1 = Signal.like(o)
+        first1 = Signal()
+        last1 = Signal()
+        self.sync += [
+            a.eq(ch[o][c]),
+            b.eq(gain[o][c]),
+            o1.eq(o),
+            first1.eq(c == 0),
+            last1.eq(c == n_channels - 1),
+        ]
+
+        # stage 2: the shared multiplier
+        product = Signal((25, True))
+        o2 = Signal.like(o)
+        first2 = Signal()
+        last2 = Signal()
+        self.sync += [
+            product.eq(a * b),
+            o2.eq(o1),
+            first2.eq(first1),
+            last2.eq(last1),
+        ]
+
+        # stage 3: accumulate, saturate and output at the last channel
+        acc = Signal((25 + bits_for(n_channels), True))
+        total = Signal.like(acc)
+        scaled = Signal.like(acc)
+        clip = Signal()
+        mixed = Signal((16, True))
+        peak = Array(Signal() for i in range(n_outputs))
+        self.comb += [
+            total.eq(Mux(first2, 0, acc) + product),
+            scaled.eq(total >> 4),
+            If(scaled > 0x7fff,
+                mixed.eq(0x7fff),
+                clip.eq(1)
+            ).Elif(scaled < -0x8000,
+                mixed.eq(-0x8000),
+                clip.eq(1)
+            ).Else(
+                mixed.eq(scaled)
+            ),
+            self.o_peak.eq(Cat(*peak) != 0),
+        ]
+        out = Array(self.o_mixed)
+        self.sync += [
+            acc.eq(total),
+            If(last2,
+                out[o2].eq(mixed[16 - wout:]),
+                peak[o2].eq(clip)
+            )
+        ]
+
 class CPS1StereoMixer(Module, AutoCSR):
-    """"
+    """FM and PCM stereo mix of n_chips JT51/JT6295 pairs, the levels set by the control CSR
+
+    The inputs are lists, one entry per pair. The two jtframe_mixer cores (4 channels per side)
+    take up to two pairs, serial (or more pairs) uses a SerialMixer with one multiplier for every
+    channel of both sides instead.
     """
-    def __init__(self, platform, win=16, wout=16, fmgain_value=6):
-        self.i_fm_left = Signal(win)
-        self.i_fm_right = Signal(win)
-        self.i_pcm_left = Signal(win)
-        self.i_pcm_right = Signal(win)
+    def __init__(self, platform, win=16, wout=16, fmgain_value=6, serial=False, n_chips=1):
+        self.i_fm_left = [Signal(win) for i in range(n_chips)]
+        self.i_fm_right = [Signal(win) for i in range(n_chips)]
+        self.i_pcm_left = [Signal(win) for i in range(n_chips)]
+        self.i_pcm_right = [Signal(win) for i in range(n_chips)]
 
         self.o_mixed_left = Signal(wout)
         self.o_mixed_right = Signal(wout)
@@ -98,17 +202,37 @@ class CPS1StereoMixer(Module, AutoCSR):
             )
         ]
 
+        # FM and PCM of each pair, left and right
+        channels = [[c for i in range(n_chips) for c in (self.i_fm_left[i], self.i_pcm_left[i])],
+                    [c for i in range(n_chips) for c in (self.i_fm_right[i], self.i_pcm_right[i])]]
+        gains = [fm_gain, pcm_gain] * n_chips
+
+        if serial or n_chips > 2:
+            self.submodules.serial_mixer = serial_mixer = SerialMixer(2 * n_chips, 2, win, wout)
+            self.comb += [
+                [serial_mixer.i_ch[o][c].eq(channels[o][c]) for o in range(2) for c in range(2 * n_chips)],
+                [serial_mixer.i_gain[o][c].eq(gains[c]) for o in range(2) for c in range(2 * n_chips)],
+                self.o_mixed_left.eq(serial_mixer.o_mixed[0]),
+                self.o_mixed_right.eq(serial_mixer.o_mixed[1]),
+                peak_left.eq(serial_mixer.o_peak),
+            ]
+            return
+
+        # unused channels tied to zero
+        channels = [side + [0] * (4 - len(side)) for side in channels]
+        gains = gains + [0] * (4 - len(gains))
+
         self.submodules.mixer_left = mixer_left = Mixer(platform, (win,) * 4, wout)
         self.comb += [
             mixer_left.i_cen.eq(1),
-            mixer_left.i_ch0.eq(self.i_fm_left),
-            mixer_left.i_ch1.eq(self.i_pcm_left),
-            mixer_left.i_ch2.eq(0),
-            mixer_left.i_ch3.eq(0),
-            mixer_left.i_gain0.eq(fm_gain),
-            mixer_left.i_gain1.eq(pcm_gain),
-            mixer_left.i_gain2.eq(0),
-            mixer_left.i_gain3.eq(0),
+            mixer_left.i_ch0.eq(channels[0][0]),
+            mixer_left.i_ch1.eq(channels[0][1]),
+            mixer_left.i_ch2.eq(channels[0][2]),
+            mixer_left.i_ch3.eq(channels[0][3]),
+            mixer_left.i_gain0.eq(gains[0]),
+            mixer_left.i_gain1.eq(gains[1]),
+            mixer_left.i_gain2.eq(gains[2]),
+            mixer_left.i_gain3.eq(gains[3]),
             self.o_mixed_left.eq(mixer_left.o_mixed),
             peak_left.eq(mixer_left.o_peak)
         ]
@@ -116,14 +240,14 @@ class CPS1StereoMixer(Module, AutoCSR):
         self.submodules.mixer_right = mixer_right = Mixer(platform, (win,) * 4, wout)
         self.comb += [
             mixer_right.i_cen.eq(1),
-            mixer_right.i_ch0.eq(self.i_fm_right),
-            mixer_right.i_ch1.eq(self.i_pcm_right),
-            mixer_right.i_ch2.eq(0),
-            mixer_right.i_ch3.eq(0),
-            mixer_right.i_gain0.eq(fm_gain),
-            mixer_right.i_gain1.eq(pcm_gain),
-            mixer_right.i_gain2.eq(0),
-            mixer_right.i_gain3.eq(0),
+            mixer_right.i_ch0.eq(channels[1][0]),
+            mixer_right.i_ch1.eq(channels[1][1]),
+            mixer_right.i_ch2.eq(channels[1][2]),
+            mixer_right.i_ch3.eq(channels[1][3]),
+            mixer_right.i_gain0.eq(gains[0]),
+            mixer_right.i_gain1.eq(gains[1]),
+            mixer_right.i_gain2.eq(gains[2]),
+            mixer_right.i_gain3.eq(gains[3]),
             self.o_mixed_right.eq(mixer_right.o_mixed),
             peak_right.eq(mixer_right.o_peak)
         ]
@@ -0,0 +1,124 @@
+import os
+
+from migen import *
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
+
+
+class PerfCounters(Module, AutoCSR):
+    """Playback hot path performance counters
+
+    Tells CPU overload from memory latency when the audio glitches:
+    - jt51_wait: cycles the CPU spends polling a JT51 that isn't ready (busy flag, or full write
+      FIFO), set by jt51_wait
+    - ticks, late_ticks: playback timer expiries (rising edges of tick), and the ones that came
+      while the previous one was still pending or the firmware timer handler still running (isr
+      CSR, written by vgmplay): late or missed ticks
+    - rom_latency_<i>: histogram of the JT6295 ROM fetch latency, cycles from a change of rom_addr
+      to rom_ok, bin 0 for 1 cycle, bin i for [2^i, 2^(i+1)) cycles, the last bin for anything
+      longer. rom_latency_total is the sum of the latencies
+    - rom_stall: cycles a ROM reader Wishbone master waits for an ack (cyc & stb & ~ack)
+
+    Counters run from the last reset, their CSRs hold the values of the last snapshot so they are
+    read together.
+    """
+    def __init__(self, n_latency_bins=8):
+        self.jt51_wait = Signal()
+        self.tick = Signal()
+        self.tick_pending = Signal()
+        self.rom_addr = Signal(18)
+        self.rom_ok = Signal()
+        self.rom_stall = Signal()
+
+        self._control = CSRStorage(description="performance counters control", fields=[
+            CSRField('snapshot', size=1, pulse=True, description='Copy the counters to the CSRs'),
+            CSRField('reset', size=1, pulse=True, description='Clear the counters'),
+        ])
+        self._isr = CSRStorage(1, description="Set by the firmware while its timer interrupt handler runs")
+
+        # name, description: running counters, snapshot to CSRStatus of the same name
+        self.counters = []
+
+        def counter(name, description):
+            value = Signal(32, name=name)
+            csr = CSRStatus(32, name=name, description=description)
+            setattr(self, "_" + name, csr)
+            self.counters.append((name, value))
+            self.sync += If(self._control.fields.snapshot, csr.status.eq(value))
+            return value
+
+        cycles = counter("cycles", "System clock cycles")
+        jt51_wait = counter("jt51_wait", "Cycles the CPU polled a JT51 that wasn't ready")
+        ticks = counter("ticks", "Playback timer expiries")
+        late_ticks = counter("late_ticks", "Playback timer expiries while the previous one was pending or handled")
+        rom_stall = counter("rom_stall", "Cycles a JT6295 ROM reader waited for a Wishbone ack")
+        rom_latency_total = counter("rom_latency_total", "Sum of the JT6295 ROM fetch latencies (cycles)")
+        rom_latency = [counter(f"rom_latency_{i}", f"JT6295 ROM fetches of {2 ** i} cycles or more" +
+                               (f", less than {2 ** (i + 1)}" if i < n_latency_bins - 1 else ""))
+                       for i in range(n_latency_bins)]
+
+        # # #
+
+        tick_d = Signal()
+        tick_edge = Signal()
+        self.sync += tick_d.eq(self.tick)
+        self.comb += tick_edge.eq(self.tick & ~tick_d)
+
+        # cycles since the ROM address change, saturates in the last bin
+        prev_addr = Signal(len(self.rom_addr))
+        fetching = Signal()
+        latency = Signal(max=2 ** n_latency_bins + 1)
+        latency_bin = Signal(max=n_latency_bins)
+        self.sync += prev_addr.eq(self.rom_addr)
+        self.comb += [latency_bin.eq(0)] + [
+            If(latency >= 2 ** i, latency_bin.eq(i)) for i in range(1, n_latency_bins)
+        ]
+
+        self.sync += If(self._control.fields.reset,
+            [value.eq(0) for name, value in self.counters],
+            fetching.eq(0)
+        ).Else(
+            cycles.eq(cycles + 1),
+            If(self.jt51_wait, jt51_wait.eq(jt51_wait + 1)),
+            If(tick_edge,
+                ticks.eq(ticks + 1),
+                If(self.tick_pending | self._isr.storage, late_ticks.eq(late_ticks + 1))
+            ),
+            If(self.rom_stall, rom_stall.eq(rom_stall + 1)),
+            If(self.rom_addr != prev_addr,
+                fetching.eq(1),
+                latency.eq(1)
+            ).Elif(fetching,
+                If(self.rom_ok,
+                    fetching.eq(0),
+                    rom_latency_total.eq(rom_latency_total + latency),
+                    Case(latency_bin, {i: rom_latency[i].eq(rom_latency[i] + 1) for i in range(n_latency_bins)})
+                ).Elif(latency != 2 ** n_latency_bins,
+                    latency.eq(latency + 1)
+                )
+            )
+        )
+
+
+class PerfCSVDump(Module):
+    """Performance counters dump for simulation
+
+    perf_dump.v writes the running counters of perf (PerfCounters) to a CSV file every period
+    cycles, with a header line of the counter names.
+    """
+    def __init__(self, platform, perf, dump_file_name="perf.csv", period=240000):
+        names = [name for name, value in perf.counters]
+        self.specials += Instance("perf_dump",
+            p_DUMPFILE=dump_file_name,
+            p_PERIOD=period,
+            p_N=len(names),
+            p_HEADER=",".join(names),
+            i_clk=ClockSignal(),
+            i_counters=Cat(*[value for name, value in perf.counters])
+        )
+
+        self.add_sources(platform)
+
+    @staticmethod
+    def add_sources(platform):
+        vdir = "gateware/rtl"
+        platform.add_source(os.path.join(vdir, "perf_dump.v"))
@@ -0,0 +1,30 @@
+module perf_dump #(
+    parameter DUMPFILE = "perf.csv",
+    parameter PERIOD = 240000,
+    parameter N = 1,
+    parameter HEADER = "counter"
+) (
+    input  clk,
+    input  [32*N-1:0] counters
+);
+
+integer fcsv;
+integer count;
+integer i;
+initial begin
+    fcsv=$fopen(DUMPFILE,"w");
+    $fwrite(fcsv,"%0s\n", HEADER);
+    count=0;
+end
+
+always @(posedge clk) begin
+    if (count == PERIOD - 1) begin
+        count <= 0;
+        for (i = 0; i < N; i = i + 1)
+            $fwrite(fcsv,"%0d%s", counters[32*i +: 32], i == N - 1 ? "\n" : ",");
+        $fflush(fcsv);
+    end else
+        count <= count + 1;
+end
+
+endmodule
@@ -0,0 +1,87 @@
+from migen import *
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
+from litex.soc.interconnect.csr_eventmanager import EventManager, EventSourcePulse
+
+VGM_SAMPLE_RATE = 44100
+
+
+class CenFraction(Module):
+    """Clock enable at exactly rate Hz from clk_freq Hz
+
+    The remainder of clk_freq / rate is carried from a period to the next, so the enables never
+    drift: every clk_freq cycles there are exactly rate of them.
+    """
+    def __init__(self, clk_freq, rate):
+        self.ce = Signal(reset_less=True)
+
+        clk_freq = int(clk_freq)
+        phase = Signal(max=clk_freq + rate)
+        self.sync += If(phase + rate >= clk_freq,
+            phase.eq(phase + rate - clk_freq),
+            self.ce.eq(1)
+        ).Else(
+            phase.eq(phase + rate),
+            self.ce.eq(0)
+        )
+
+
+class SampleScheduler(Module, AutoCSR):
+    """Tickless VGM sample timer: one interrupt when a programmed wait expires
+
+    Counts VGM samples (CenFraction, drift-free) while enabled. Writing wait moves the deadline
+    wait samples past the previous one, not past the time of the write, so a late interrupt
+    handler doesn't shift what comes next: the interrupt fires as soon as the sample count reaches
+    the deadline, right away if it's already past. Firmware programs each wait once instead of
+    counting it down at every sample.
+    """
+    def __init__(self, clk_freq, sample_rate=VGM_SAMPLE_RATE):
+        self.tick = Signal()
+
+        self._control = CSRStorage(description="scheduler control", fields=[
+            CSRField('enable', reset=0, size=1, description='Count samples (0 holds the count and the deadline)'),
+            CSRField('reset', size=1, pulse=True, description='Clear the sample count and the deadline, disarm'),
+        ])
+        self._wait = CSRStorage(32, description="Samples from the previous deadline to the next one, arms the interrupt")
+        self._sample = CSRStatus(32, description="Samples counted since the last reset")
+        self._deadline = CSRStatus(32, description="Sample the interrupt fires at")
+
+        self.submodules.ev = EventManager()
+        self.ev.expired = EventSourcePulse(description="The sample count reached the deadline")
+        self.ev.finalize()
+
+        # # #
+
+        self.submodules.sample_tick = CenFraction(clk_freq, sample_rate)
+        enable = Signal()
+        self.comb += [
+            enable.eq(self._control.fields.enable),
+            self.tick.eq(self.sample_tick.ce & enable),
+        ]
+
+        sample = Signal(32)
+        deadline = Signal(32)
+        armed = Signal()
+        # wraps with the count: reached once sample - deadline is positive
+        reached = Signal()
+        self.comb += [
+            reached.eq(~(sample - deadline)[31]),
+            self._sample.status.eq(sample),
+            self._deadline.status.eq(deadline),
+        ]
+
+        self.sync += [
+            If(self._control.fields.reset,
+                sample.eq(0),
+                deadline.eq(0),
+                armed.eq(0)
+            ).Else(
+                If(self.tick, sample.eq(sample + 1)),
+                If(self._wait.re,
+                    deadline.eq(deadline + self._wait.storage),
+                    armed.eq(1)
+                ).Elif(armed & enable & reached,
+                    armed.eq(0)
+                )
+            )
+        ]
+        self.comb += self.ev.expired.trigger.eq(armed & enable & reached & ~self._wait.re & ~self._control.fields.reset)
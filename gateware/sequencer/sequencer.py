@@ -0,0 +1,143 @@
+from migen import *
+from litex.soc.interconnect import stream, wishbone
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
+
+VGM_SAMPLE_RATE = 44100
+
+VGC_NO_LOOP = 0xffffffff
+VGC_OP_WAIT = 0
+VGC_OP_YM2151 = 1
+VGC_OP_OKIM6295 = 2
+VGC_OP_CONTROL = 3
+VGC_CONTROL_END = 0
+
+
+class CenSample(Module):
+    def __init__(self, tuning_word):
+        self.cen = Signal()
+
+        phase = Signal(32, reset_less=True)
+        self.sync += Cat(phase, self.cen).eq(phase + tuning_word)
+
+
+class VGCSequencer(Module, AutoCSR):
+    """Plays a VGC command stream (see vgmtools/vgc.py) from main RAM without the CPU
+
+    Command words are fetched over its own Wishbone master, waits are counted in VGM samples and
+    register writes go straight to the YM2151/OKIM6295 write ports. Each wait moves the deadline
+    of the next command past the previous deadline, not past the end of the write: fetches and
+    write port stalls don't add up over the song. OKIM6295 ROM blocks are not
+    copied: firmware loads them before enabling the sequencer.
+    """
+    def __init__(self, bus, clk_freq, sample_rate=VGM_SAMPLE_RATE):
+        assert isinstance(bus, wishbone.Interface)
+        assert bus.data_width == 32
+        self.bus = bus
+
+        self.ym2151 = ym2151 = stream.Endpoint([("addr", 8), ("data", 8)])
+        self.okim6295 = okim6295 = stream.Endpoint([("data", 8)])
+
+        self._base = CSRStorage(32, description="Address of the first command word")
+        self._loop = CSRStorage(32, reset=VGC_NO_LOOP, description="Loop command index")
+        self._control = CSRStorage(description="sequencer control", fields=[
+            CSRField('enable', reset=0, size=1, description='Start (1) / stop and rewind (0) playback'),
+            CSRField('pause', reset=0, size=1, description='Hold playback at the next wait'),
+        ])
+        self._status = CSRStatus(description="sequencer status", fields=[
+            CSRField('running', size=1, description='Playing'),
+            CSRField('done', size=1, description='End of sound data reached, song does not loop'),
+        ])
+        self._sample = CSRStatus(32, description="Samples played since start")
+        self._offset = CSRStatus(32, description="Index of the next command word")
+
+        enable = Signal()
+        pause = Signal()
+        self.comb += [
+            enable.eq(self._control.fields.enable),
+            pause.eq(self._control.fields.pause),
+        ]
+
+        self.submodules.sample_tick = CenSample(tuning_word=int((sample_rate / clk_freq) * 2 ** 32))
+        tick = Signal()
+        self.comb += tick.eq(self.sample_tick.cen & ~pause)
+
+        offset = Signal(32)
+        sample = Signal(32)
+        cmd = Signal(32)
+        deadline = Signal(32)
+        op = Signal(2)
+        write_wait = Signal(14)
+        # wraps with the count: reached once sample - deadline is positive
+        reached = Signal()
+        self.comb += [
+            reached.eq(~(sample - deadline)[31]),
+            op.eq(cmd[30:32]),
+            write_wait.eq(cmd[16:30]),
+            self._offset.status.eq(offset),
+            self._sample.status.eq(sample),
+            ym2151.addr.eq(cmd[8:16]),
+            ym2151.data.eq(cmd[0:8]),
+            okim6295.data.eq(cmd[0:8]),
+        ]
+
+        fsm = FSM(reset_state="IDLE")
+        fsm = ResetInserter()(fsm)
+        self.submodules.fsm = fsm
+        self.comb += [
+            fsm.reset.eq(~enable),
+            self._status.fields.running.eq(enable & ~fsm.ongoing("DONE")),
+            self._status.fields.done.eq(fsm.ongoing("DONE")),
+        ]
+        self.sync += If(~enable,
+            sample.eq(0)
+        ).Elif(tick & ~fsm.ongoing("DONE"),
+            sample.eq(sample + 1)
+        )
+
+        fsm.act("IDLE",
+                NextValue(offset, 0),
+                NextState("FETCH")
+        )
+        fsm.act("FETCH",
+                bus.stb.eq(1),
+                bus.cyc.eq(1),
+                bus.we.eq(0),
+                bus.sel.eq(0xf),
+                bus.adr.eq((self._base.storage >> 2) + offset),
+                If(bus.ack,
+                   NextValue(cmd, bus.dat_r),
+                   NextValue(offset, offset + 1),
+                   NextState("EXEC"))
+        )
+        fsm.act("EXEC",
+                Case(op, {
+                    VGC_OP_WAIT: [
+                        NextValue(deadline, deadline + cmd[0:30]),
+                        NextState("WAIT")
+                    ],
+                    VGC_OP_YM2151: [
+                        ym2151.valid.eq(1),
+                        If(ym2151.ready, NextValue(deadline, deadline + write_wait), NextState("WAIT"))
+                    ],
+                    VGC_OP_OKIM6295: [
+                        okim6295.valid.eq(1),
+                        If(okim6295.ready, NextValue(deadline, deadline + write_wait), NextState("WAIT"))
+                    ],
+                    VGC_OP_CONTROL: [
+                        If(cmd[24:30] == VGC_CONTROL_END,
+                           If(self._loop.storage == VGC_NO_LOOP,
+                              NextState("DONE")
+                           ).Else(
+                              NextValue(offset, self._loop.storage),
+                              NextState("FETCH"))
+                        ).Else(
+                           NextState("FETCH"))
+                    ]
+                })
+        )
+        # next command is due once the sample count reaches the deadline
+        fsm.act("WAIT",
+                If(reached & ~pause,
+                   NextState("FETCH"))
+        )
+        fsm.act("DONE")
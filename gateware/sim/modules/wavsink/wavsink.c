@@ -0,0 +1,313 @@
+/* LiteX simulation module: writes the mixer output as a WAV file or named pipe
+ *
+ * Samples are buffered in blocks and the WAV header is patched after each block, so the file is
+ * always playable even if the simulation is interrupted. In pipe mode the header advertises an
+ * unbounded stream and the simulation waits until a reader opens the pipe.
+ *
+ * On exit the number of samples and the wall clock time between the first and the last one are
+ * printed, vgmtools/bench.py reads that line.
+ */
+
+#include <errno.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <time.h>
+#include <json-c/json.h>
+
+#include "error.h"
+#include "modules.h"
+
+#define WAVSINK_DEFAULT_BLOCK 65536
+
+struct session_s {
+  char *sys_clk;
+  char *sample;
+  char *en;
+  uint16_t *left;
+  uint16_t *right;
+  clk_edge_state_t edge;
+  char last_sample;
+
+  FILE *out;
+  int pipe;
+  uint32_t rate;
+  int16_t *buffer;
+  size_t block;
+  size_t count;
+  uint32_t data_bytes;
+  uint64_t n_samples;
+  struct timespec first;
+  struct timespec last;
+};
+
+static struct session_s *sessions[8];
+static int n_sessions;
+
+static int litex_sim_module_pads_get(struct pad_s *pads, char *name, void **signal)
+{
+  int ret = RC_OK;
+  void *sig = NULL;
+  int i;
+
+  if(!pads || !name || !signal) {
+    ret = RC_INVARG;
+    goto out;
+  }
+
+  i = 0;
+  while(pads[i].name) {
+    if(!strcmp(pads[i].name, name)) {
+      sig = (void*)pads[i].signal;
+      break;
+    }
+    i++;
+  }
+
+out:
+  *signal = sig;
+  return ret;
+}
+
+static void put_le32(uint8_t *p, uint32_t v)
+{
+  p[0] = v; p[1] = v >> 8; p[2] = v >> 16; p[3] = v >> 24;
+}
+
+static void put_le16(uint8_t *p, uint16_t v)
+{
+  p[0] = v; p[1] = v >> 8;
+}
+
+static void write_header(struct session_s *s)
+{
+  uint8_t h[44];
+  uint32_t data_bytes = s->pipe ? 0xffffffff - 36 : s->data_bytes;
+
+  memcpy(h, "RIFF", 4);
+  put_le32(h + 4, 36 + data_bytes);
+  memcpy(h + 8, "WAVEfmt ", 8);
+  put_le32(h + 16, 16);
+  put_le16(h + 20, 1);            /* PCM */
+  put_le16(h + 22, 2);            /* stereo */
+  put_le32(h + 24, s->rate);
+  put_le32(h + 28, s->rate * 4);  /* byte rate */
+  put_le16(h + 32, 4);            /* block align */
+  put_le16(h + 34, 16);           /* bits per sample */
+  memcpy(h + 36, "data", 4);
+  put_le32(h + 40, data_bytes);
+
+  if(!s->pipe)
+    fseek(s->out, 0, SEEK_SET);
+  fwrite(h, 1, sizeof(h), s->out);
+  if(!s->pipe)
+    fseek(s->out, 0, SEEK_END);
+}
+
+static void flush_block(struct session_s *s)
+{
+  size_t bytes = s->count * 2 * sizeof(int16_t);
+
+  if(!s->out || !s->count)
+    return;
+
+  if(fwrite(s->buffer, 1, bytes, s->out) != bytes && s->pipe) {
+    fprintf(stderr, "[wavsink] pipe reader went away, stopping output\n");
+    fclose(s->out);
+    s->out = NULL;
+    return;
+  }
+  s->data_bytes += bytes;
+  s->count = 0;
+
+  if(!s->pipe)
+    write_header(s);
+  fflush(s->out);
+}
+
+static void wavsink_atexit(void)
+{
+  struct session_s *s;
+  double wall, audio;
+  int i;
+
+  for(i = 0; i < n_sessions; i++) {
+    s = sessions[i];
+    flush_block(s);
+    if(s->out)
+      fclose(s->out);
+
+    wall = (s->last.tv_sec - s->first.tv_sec) + (s->last.tv_nsec - s->first.tv_nsec) / 1e9;
+    audio = (double)s->n_samples / s->rate;
+    printf("\n[wavsink] %llu samples, %.3f s of audio in %.3f s, %.4fx realtime\n",
+           (unsigned long long)s->n_samples, audio, wall, wall > 0 ? audio / wall : 0.0);
+  }
+}
+
+static int wavsink_start(void *b)
+{
+  printf("[wavsink] loaded\n");
+  return RC_OK;
+}
+
+static int wavsink_parse_args(struct session_s *s, const char *args, char **filename)
+{
+  int ret = RC_OK;
+  json_object *args_json = NULL;
+  json_object *value = NULL;
+
+  args_json = json_tokener_parse(args);
+  if(!args_json) {
+    ret = RC_JSERROR;
+    fprintf(stderr, "[wavsink] Could not parse args: %s\n", args);
+    goto out;
+  }
+
+  if(!json_object_object_get_ex(args_json, "filename", &value) ||
+     !json_object_object_get_ex(args_json, "rate", NULL)) {
+    ret = RC_JSERROR;
+    fprintf(stderr, "[wavsink] \"filename\" and \"rate\" are required: %s\n", args);
+    goto out;
+  }
+  *filename = strdup(json_object_get_string(value));
+
+  json_object_object_get_ex(args_json, "rate", &value);
+  s->rate = json_object_get_int64(value);
+
+  s->block = WAVSINK_DEFAULT_BLOCK;
+  if(json_object_object_get_ex(args_json, "block", &value))
+    s->block = json_object_get_int64(value);
+
+  if(json_object_object_get_ex(args_json, "mode", &value))
+    s->pipe = !strcmp(json_object_get_string(value), "pipe");
+
+out:
+  if(args_json) json_object_put(args_json);
+  return ret;
+}
+
+static int wavsink_new(void **sess, char *args)
+{
+  int ret = RC_OK;
+  char *filename = NULL;
+  struct session_s *s = NULL;
+
+  if(!sess) {
+    ret = RC_INVARG;
+    goto out;
+  }
+
+  s = (struct session_s*) malloc(sizeof(struct session_s));
+  if(!s) {
+    ret = RC_NOENMEM;
+    goto out;
+  }
+  memset(s, 0, sizeof(struct session_s));
+
+  ret = wavsink_parse_args(s, args, &filename);
+  if(ret != RC_OK)
+    goto out;
+
+  s->buffer = (int16_t*) malloc(s->block * 2 * sizeof(int16_t));
+  if(!s->buffer) {
+    ret = RC_NOENMEM;
+    goto out;
+  }
+
+  if(s->pipe) {
+    signal(SIGPIPE, SIG_IGN);
+    if(mkfifo(filename, 0644) && errno != EEXIST) {
+      fprintf(stderr, "[wavsink] can't create pipe %s: %s\n", filename, strerror(errno));
+      ret = RC_ERROR;
+      goto out;
+    }
+    printf("[wavsink] waiting for a reader on %s\n", filename);
+  }
+  s->out = fopen(filename, "wb");
+  if(!s->out) {
+    fprintf(stderr, "[wavsink] can't open %s: %s\n", filename, strerror(errno));
+    ret = RC_ERROR;
+    goto out;
+  }
+  printf("[wavsink] writing %u Hz stereo to %s\n", s->rate, filename);
+  write_header(s);
+
+  if(n_sessions == 0)
+    atexit(wavsink_atexit);
+  if(n_sessions < sizeof(sessions) / sizeof(sessions[0]))
+    sessions[n_sessions++] = s;
+
+out:
+  free(filename);
+  *sess = (void*) s;
+  return ret;
+}
+
+static int wavsink_add_pads(void *sess, struct pad_list_s *plist)
+{
+  int ret = RC_OK;
+  struct session_s *s = (struct session_s*) sess;
+  struct pad_s *pads;
+
+  if(!sess || !plist) {
+    ret = RC_INVARG;
+    goto out;
+  }
+  pads = plist->pads;
+  if(!strcmp(plist->name, "audio")) {
+    litex_sim_module_pads_get(pads, "sample", (void**)&s->sample);
+    litex_sim_module_pads_get(pads, "en", (void**)&s->en);
+    litex_sim_module_pads_get(pads, "left", (void**)&s->left);
+    litex_sim_module_pads_get(pads, "right", (void**)&s->right);
+  }
+
+  if(!strcmp(plist->name, "sys_clk"))
+    litex_sim_module_pads_get(pads, "sys_clk", (void**) &s->sys_clk);
+
+out:
+  return ret;
+}
+
+static int wavsink_tick(void *sess, uint64_t time_ps)
+{
+  struct session_s *s = (struct session_s*)sess;
+  char rising;
+
+  if(!clk_pos_edge(&s->edge, *s->sys_clk))
+    return RC_OK;
+
+  rising = *s->sample && !s->last_sample;
+  s->last_sample = *s->sample;
+  if(!rising || !*s->en || !s->out)
+    return RC_OK;
+
+  clock_gettime(CLOCK_MONOTONIC, s->n_samples ? &s->last : &s->first);
+  s->n_samples++;
+
+  s->buffer[2 * s->count] = (int16_t)*s->left;
+  s->buffer[2 * s->count + 1] = (int16_t)*s->right;
+  if(++s->count == s->block)
+    flush_block(s);
+
+  return RC_OK;
+}
+
+static struct ext_module_s ext_mod = {
+  "wavsink",
+  wavsink_start,
+  wavsink_new,
+  wavsink_add_pads,
+  NULL,
+  wavsink_tick
+};
+
+int litex_sim_ext_module_init(int (*register_module)(struct ext_module_s *))
+{
+  int ret = RC_OK;
+  ret = register_module(&ext_mod);
+  return ret;
+}
@@ -1,63 +1,154 @@
 import shutil
+from functools import reduce
+from operator import or_
 
+from litex.soc.integration.soc import SoCRegion
 from litex.soc.integration.soc_core import SoCCore
 from litex.soc.interconnect import wishbone
 from litex.soc.interconnect.csr import *
 
-from gateware.jt51.jt51 import JT51
-from gateware.jt6295.jt6295 import JT6295RomWishboneDMAReader, JT6295
-from gateware.jtframe.sound.mixer import CPS1StereoMixer
-from gateware.jtframe.sound.uprate2_fir import Uprate2Fir
+from gateware.audio import (JT6295_ROM_SIZE, add_cps1_audio, audio_init_paths, chip_name, jt6295_rom_bram_bus,
+                            jt6295_rom_bus)
+from gateware.capture import AudioCapture
+from gateware.jt6295.jt6295 import JT6295RomLiteDRAMReader
+from gateware.perfcounters import PerfCounters
+from gateware.samplescheduler import SampleScheduler
+from gateware.sequencer.sequencer import VGCSequencer
 
 
 class CPS1MusicboxSoC(SoCCore):
-    def __init__(self, platform, clk_freq, **kwargs):
+    def __init__(self, platform, clk_freq, with_sequencer=False, jt6295_rom_lines=4,
+                 jt6295_rom_line_words=4, serial_mixer=False, n_chips=1,
+                 with_sample_scheduler=False, with_perf_counters=False, with_audio_capture=False,
+                 audio_capture_sources=False, audio_capture_size=0x00800000,
+                 jt6295_rom_native=False, jt6295_rom_bram_size=0, device_bram_size=None, **kwargs):
         SoCCore.__init__(self, platform, clk_freq, **kwargs)
 
-        # JT51
-        self.submodules.jt51 = JT51(platform, clk_freq)
-
-        # JT6295
-        self.add_constant("JT6295_ROM_SIZE", 256 * 1024)
+        # JT51, JT6295 and mixer: n_chips pairs, each with its own ROM reader and CSR banks
+        # (vgmplay drives up to 4)
+        assert 1 <= n_chips <= 4
         base = self.mem_map.get("jt6295_rom", 0x40c00000)
-        bus = wishbone.Interface(data_width=8, adr_width=self.bus.address_width)
-        self.add_wb_master(bus)
-
-        self.submodules.jt6295_rom_dma = JT6295RomWishboneDMAReader(
-            bus=bus,
-            base_address=base,
-            with_csr=True
-        )
-        self.submodules.jt6295 = JT6295(
-            platform=platform,
-            clk_freq=clk_freq
+        # jt6295_rom_bram_size: on-chip ROMs of that many bytes instead, each with a write window in
+        # the bus map (jt6295_rom_bram, jt6295_rom_bram_1...). Back to the SDRAM readers when they
+        # don't fit in the device_bram_size bytes of block RAM next to the integrated memories
+        if jt6295_rom_bram_size and device_bram_size is not None:
+            used = (self.integrated_rom_size + self.integrated_sram_size +
+                    self.integrated_main_ram_size + kwargs.get("l2_size", 8192))
+            if used + n_chips * jt6295_rom_bram_size > device_bram_size:
+                self.logger.warning(f"JT6295 ROMs ({n_chips} x {jt6295_rom_bram_size} bytes) don't fit in "
+                                    f"block RAM ({device_bram_size - used} bytes free), using SDRAM.")
+                jt6295_rom_bram_size = 0
+        # jt6295_rom_native: the readers get their own LiteDRAM ports when the SDRAM is added
+        # (add_sdram), out of the main interconnect and L2. Without SDRAM they stay Wishbone masters
+        jt6295_rom_native = jt6295_rom_native and not jt6295_rom_bram_size
+        assert not jt6295_rom_native or jt6295_rom_lines, "The native ROM port needs the line buffer"
+        self.jt6295_rom_buses = []
+        self.jt6295_rom_line_words = jt6295_rom_line_words
+        self.jt6295_rom_native = jt6295_rom_native
+        self.jt6295_rom_ports = []
+        if jt6295_rom_bram_size:
+            rom_buses = [jt6295_rom_bram_bus(jt6295_rom_bram_size) for i in range(n_chips)]
+            for i, rom_bus in enumerate(rom_buses):
+                name = chip_name("jt6295_rom_bram", i)
+                origin = self.mem_map.get(name, 0x20000000 + i * JT6295_ROM_SIZE)
+                self.bus.add_slave(name, rom_bus, SoCRegion(origin=origin, size=jt6295_rom_bram_size))
+        else:
+            rom_buses = [jt6295_rom_bus(self.bus.address_width, jt6295_rom_lines) for i in range(n_chips)]
+            self.jt6295_rom_buses = rom_buses
+            if not jt6295_rom_native:
+                for rom_bus in rom_buses:
+                    self.add_wb_master(rom_bus)
+        add_cps1_audio(self, platform, clk_freq,
+            rom_buses=rom_buses,
+            rom_base=base,
+            rom_lines=jt6295_rom_lines,
+            rom_line_words=jt6295_rom_line_words,
+            serial_mixer=serial_mixer,
+            rom_bram_size=jt6295_rom_bram_size
         )
-        self.comb += [
-            self.jt6295_rom_dma.i_rom_addr.eq(self.jt6295.o_rom_addr),
-            self.jt6295.i_rom_data.eq(self.jt6295_rom_dma.o_rom_data),
-            self.jt6295.i_rom_ok.eq(self.jt6295_rom_dma.o_rom_ok),
-        ]
-
-        jt6295_sound_upsampled = Signal(16)
-        self.submodules.jtframe_uprate2_fir = Uprate2Fir(platform)
-        self.comb += [
-            self.jtframe_uprate2_fir.i_sample.eq(self.jt6295.sample),
-            self.jtframe_uprate2_fir.l_in.eq(Cat(Signal(2), self.jt6295.sound)),
-            self.jtframe_uprate2_fir.r_in.eq(0),
-            jt6295_sound_upsampled.eq(self.jtframe_uprate2_fir.l_out)
-        ]
-
-        self.submodules.mixer = mixer = CPS1StereoMixer(platform)
-        self.comb += [
-            mixer.i_fm_left.eq(self.jt51.xleft),
-            mixer.i_fm_right.eq(self.jt51.xright),
-            mixer.i_pcm_left.eq(jt6295_sound_upsampled),
-            mixer.i_pcm_right.eq(jt6295_sound_upsampled),
-        ]
+        self.add_constant("CPS1_N_CHIPS", n_chips)
+        self.add_constant("JT51_CMD_FIFO_DEPTH", self.jt51.cmd_fifo_depth)
+        self.add_constant("JT6295_ROM_SIZE", JT6295_ROM_SIZE)
+
+        # VGC sequencer, drives the first pair
+        if with_sequencer:
+            bus = wishbone.Interface(data_width=32, adr_width=self.bus.address_width - 2)
+            self.add_wb_master(bus)
+            self.submodules.vgc_sequencer = VGCSequencer(bus=bus, clk_freq=clk_freq)
+            self.comb += [
+                self.vgc_sequencer.ym2151.connect(self.jt51.sink),
+                self.vgc_sequencer.okim6295.connect(self.jt6295.sink),
+            ]
+
+        # Sample scheduler: exact VGM sample rate, vgmplay uses it instead of timer0
+        if with_sample_scheduler:
+            self.submodules.sample_scheduler = SampleScheduler(clk_freq)
+            if hasattr(self.cpu, "interrupt"):
+                self.irq.add("sample_scheduler", use_loc_if_exists=True)
+
+        # Performance counters: JT51 polling of every pair, ROM stalls of every reader (none with the
+        # BRAM ROMs), playback timer (the sample scheduler when there's one) and ROM fetch latency
+        # of the first pair
+        if with_perf_counters:
+            self.submodules.perf = perf = PerfCounters()
+            jt51s = [getattr(self, chip_name("jt51", i)) for i in range(n_chips)]
+            self.comb += [
+                perf.jt51_wait.eq(reduce(or_, [jt51.cpu_wait for jt51 in jt51s])),
+                perf.rom_stall.eq(reduce(or_, [bus.cyc & bus.stb & ~bus.ack
+                                               for bus in self.jt6295_rom_buses], 0)),
+                perf.rom_addr.eq(self.jt6295.o_rom_addr),
+                perf.rom_ok.eq(self.jt6295.i_rom_ok),
+            ]
+            if with_sample_scheduler:
+                self.comb += [
+                    perf.tick.eq(self.sample_scheduler.ev.expired.trigger),
+                    perf.tick_pending.eq(self.sample_scheduler.ev.expired.pending),
+                ]
+            elif hasattr(self, "timer0"):
+                self.comb += [
+                    perf.tick.eq(self.timer0.ev.zero.trigger),
+                    perf.tick_pending.eq(self.timer0.ev.zero.pending),
+                ]
+
+        # Audio capture: mixer output (and with audio_capture_sources the FM/PCM inputs of every
+        # pair) to a memory ring buffer, set up and read back over the bridge by vgmtools/capture.py
+        if with_audio_capture:
+            channels = [self.mixer.o_mixed_left, self.mixer.o_mixed_right]
+            if audio_capture_sources:
+                for i in range(n_chips):
+                    channels += [self.mixer.i_fm_left[i], self.mixer.i_fm_right[i],
+                                 self.mixer.i_pcm_left[i], self.mixer.i_pcm_right[i]]
+            bus = wishbone.Interface(data_width=32, adr_width=self.bus.address_width - 2)
+            self.add_wb_master(bus)
+            self.submodules.audio_capture = AudioCapture(bus, channels,
+                default_base   = self.mem_map.get("audio_capture", 0x41000000),
+                default_length = audio_capture_size)
+            self.comb += self.audio_capture.sample.eq(self.jt51.sample)
+            self.add_constant("AUDIO_CAPTURE_CHANNELS", len(channels))
+            self.add_constant("AUDIO_CAPTURE_RATE", round(self.jt51.sample_rate))
+
+    def add_sdram(self, name="sdram", *args, **kwargs):
+        super().add_sdram(name, *args, **kwargs)
+        if self.jt6295_rom_native:
+            for i, rom_bus in enumerate(self.jt6295_rom_buses):
+                port = self.sdram.crossbar.get_port(mode="read", data_width=rom_bus.data_width)
+                rom_port = JT6295RomLiteDRAMReader(rom_bus, port,
+                    base_address = self.bus.regions["main_ram"].origin,
+                    burst_words  = self.jt6295_rom_line_words)
+                setattr(self.submodules, chip_name("jt6295_rom_port", i), rom_port)
+                self.jt6295_rom_ports.append(rom_port)
+            # the ports read the SDRAM behind L2: vgmplay flushes L2 after writing the ROMs
+            self.add_constant("JT6295_ROM_NATIVE")
+
+    def finalize(self):
+        if not self.finalized and self.jt6295_rom_native and not self.jt6295_rom_ports:
+            self.logger.warning("No SDRAM for the native JT6295 ROM ports, using the main bus.")
+            for rom_bus in self.jt6295_rom_buses:
+                self.add_wb_master(rom_bus)
+        super().finalize()
 
     def build(self, build_dir, *args, **kwargs):
-        init_paths = JT6295.fir_init_paths() + Uprate2Fir.fir_init_paths()
-        for f in init_paths:
+        for f in audio_init_paths():
             shutil.copy(f, build_dir)
         return super().build(build_dir=build_dir, *args, **kwargs)
 
@@ -0,0 +1,56 @@
+import os
+
+from migen import *
+
+VGM_SAMPLE_RATE = 44100
+
+
+class VGMSampleTraceWindow(Module):
+    """Simulation trace enable for a window of VGM samples
+
+    Samples are counted while playing (vgmplay enables the DAO dump on play and disables it on
+    stop) with the timer0 period of vgmplay, int(clk_freq / 44100) cycles, or on tick (the sample
+    scheduler's) when vgmplay plays with it, so the count follows timer_ctx.current_sample. The
+    trace is on for samples [start, end), end=None traces until the end of the simulation.
+    """
+    def __init__(self, trace, playing, clk_freq, start=0, end=None, tick=None):
+        self.sample = Signal(32)
+
+        if tick is not None:
+            self.sync += If(playing & tick, self.sample.eq(self.sample + 1))
+        else:
+            ticks = int(clk_freq / VGM_SAMPLE_RATE)
+            count = Signal(max=ticks)
+            self.sync += If(playing,
+                If(count == ticks - 1,
+                   count.eq(0),
+                   self.sample.eq(self.sample + 1)
+                ).Else(
+                   count.eq(count + 1)
+                )
+            )
+
+        in_window = Signal()
+        self.comb += in_window.eq(self.sample >= start)
+        if end is not None:
+            self.comb += If(self.sample >= end, in_window.eq(0))
+        self.comb += trace.eq(in_window)
+
+
+def trace_scope_config(path, scopes):
+    """Write a Verilator configuration file that only traces the given hierarchies
+
+    Migen flattens the SoC in the sim module, so its submodules are matched by signal name prefix
+    (sim.jt6295_rom_dma_*), Verilog instances (sim.jt6295.*) by scope. sys_clk is always traced.
+    Needs a Verilator with tracing_on/tracing_off -scope support.
+    """
+    lines = [
+        "`verilator_config",
+        "tracing_off -scope \"*\"",
+        "tracing_on -scope \"*.sim.sys_clk\"",
+    ]
+    for scope in scopes:
+        lines.append(f"tracing_on -scope \"*.sim.{scope}*\"")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return os.path.abspath(path)
@@ -28,6 +28,7 @@ from litedram.phy import GENSDRPHY, HalfRateGENSDRPHY
 
 from gateware.soc import CPS1MusicboxSoC
 from gateware.dacpwm import DacPWM
+from gateware.buildcache import cached_build, trellis_build_files
 
 # CRG ----------------------------------------------------------------------------------------------
 
@@ -67,6 +68,14 @@ class _CRG(Module):
 
 # BaseSoC ------------------------------------------------------------------------------------------
 
+# Block RAM of the ECP5 devices: 18 Kbit EBRs, 2 KiB of bytes each
+ECP5_BRAM_SIZE = {
+    "LFE5U-12F":  32 * 2048,
+    "LFE5U-25F":  56 * 2048,
+    "LFE5U-45F": 108 * 2048,
+    "LFE5U-85F": 208 * 2048,
+}
+
 class BaseSoC(CPS1MusicboxSoC):
     def __init__(self, device="LFE5U-45F", revision="2.0", toolchain="trellis",
         sys_clk_freq=int(50e6), sdram_module_cls="MT48LC16M16", sdram_rate="1:1",
@@ -82,7 +91,8 @@ class BaseSoC(CPS1MusicboxSoC):
 
         # SoCCore ----------------------------------------------------------------------------------
         CPS1MusicboxSoC.__init__(self, platform, sys_clk_freq,
-            ident = "LiteX SoC on ULX3S",
+            ident            = "LiteX SoC on ULX3S",
+            device_bram_size = ECP5_BRAM_SIZE.get(device),
             **kwargs)
 
         # CRG --------------------------------------------------------------------------------------
@@ -139,6 +149,17 @@ def main():
     sdopts.add_argument("--with-sdcard",     action="store_true",   help="Enable SDCard support.")
     parser.add_argument("--with-oled",       action="store_true",   help="Enable SDD1331 OLED support.")
     parser.add_argument("--sdram-rate",      default="1:1",         help="SDRAM Rate (1:1 Full Rate or 1:2 Half Rate).")
+    parser.add_argument("--with-sequencer",  action="store_true",   help="Enable hardware VGC sequencer.")
+    parser.add_argument("--jt6295-rom-lines", default=4,            help="JT6295 ROM reader line buffer lines (0 to disable).")
+    parser.add_argument("--jt6295-rom-native", action="store_true", help="Read the JT6295 ROM on dedicated LiteDRAM ports, bypassing the main bus and L2.")
+    parser.add_argument("--jt6295-rom-bram-size", default=0, type=lambda x: int(x, 0), help="JT6295 ROM in block RAM of this size (bytes, power of 2, up to 0x40000) instead of SDRAM, if the device has room.")
+    parser.add_argument("--serial-mixer",    action="store_true",   help="Mix both sides with one shared multiplier instead of two jtframe_mixer cores.")
+    parser.add_argument("--n-chips",         default=1, type=int,   help="JT51/JT6295 pairs (1 to 4), mixed together.")
+    parser.add_argument("--with-sample-scheduler", action="store_true", help="Play with the tickless sample scheduler (exact sample rate) instead of timer0.")
+    parser.add_argument("--with-perf-counters", action="store_true", help="Add the playback performance counters (vgmplay prints them when it stops).")
+    parser.add_argument("--with-audio-capture", action="store_true", help="Capture the mixer output to an SDRAM ring buffer (vgmtools/capture.py, needs a UART bridge).")
+    parser.add_argument("--audio-capture-sources", action="store_true", help="Also capture the FM/PCM mixer inputs.")
+    parser.add_argument("--build-cache",     default=None, nargs="?", const="build/cache", help="Reuse the bitstream of an unchanged design from this cache directory (default: build/cache, trellis only, use with --no-ident-version).")
     builder_args(parser)
     soc_core_args(parser)
     trellis_args(parser)
@@ -152,6 +173,16 @@ def main():
         sdram_module_cls       = args.sdram_module,
         sdram_rate             = args.sdram_rate,
         with_spi_flash         = args.with_spi_flash,
+        with_sequencer         = args.with_sequencer,
+        jt6295_rom_lines       = int(args.jt6295_rom_lines),
+        jt6295_rom_native      = args.jt6295_rom_native,
+        jt6295_rom_bram_size   = args.jt6295_rom_bram_size,
+        serial_mixer           = args.serial_mixer,
+        n_chips                = args.n_chips,
+        with_sample_scheduler  = args.with_sample_scheduler,
+        with_perf_counters     = args.with_perf_counters,
+        with_audio_capture     = args.with_audio_capture,
+        audio_capture_sources  = args.audio_capture_sources,
         **soc_core_argdict(args))
     if args.with_spi_sdcard:
         soc.add_spi_sdcard()
@@ -162,7 +193,14 @@ def main():
 
     builder = Builder(soc, **builder_argdict(args))
     builder_kargs = trellis_argdict(args) if args.toolchain == "trellis" else {}
-    builder.build(**builder_kargs, run=args.build)
+    # with the build cache, only generate the files here, yosys/nextpnr run on cache misses only
+    build_cache = args.build_cache and args.build and args.toolchain == "trellis"
+    builder.build(**builder_kargs, run=args.build and not build_cache)
+    if build_cache:
+        inputs, outputs = trellis_build_files(soc.build_name)
+        cached_build(args.build_cache, soc.platform, builder.gateware_dir, soc.build_name, inputs, outputs,
+            with_init_files = True,
+            tools           = [["yosys", "-V"], ["nextpnr-ecp5", "--version"]])
 
     if args.load:
         prog = soc.platform.create_programmer()
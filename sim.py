@@ -8,10 +8,16 @@
 # Copyright (c) 2017 Pierre-Olivier Vauboin <po@lambdaconcept>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import json
+import os
+import subprocess
+import sys
+
 from litex.build.generic_platform import *
 from litex.build.sim import SimPlatform
+from litex.build.sim.platform import SimMarker, SimFinish
 from litex.build.sim.config import SimConfig
-from litex.build.sim.verilator import verilator_build_args, verilator_build_argdict
+from litex.build.sim.verilator import verilator_build_args, verilator_build_argdict, core_directory
 
 from litex.soc.integration.soc_core import *
 from litex.soc.integration.builder import *
@@ -20,12 +26,15 @@ from litex.soc.cores.cpu import CPUS
 from litedram import modules as litedram_modules
 from litedram.modules import parse_spd_hexdump
 from litedram.phy.model import sdram_module_nphases
-from litedram.phy.model import SDRAMPHYModel
+from litedram.phy.model import SDRAMPHYModel, BankModel
 
 from litescope import LiteScopeAnalyzer
 
 from gateware.soc import CPS1MusicboxSoC
 from gateware.daodump import DaoDump
+from gateware.perfcounters import PerfCSVDump
+from gateware.tracewindow import VGMSampleTraceWindow, trace_scope_config
+from gateware.buildcache import cached_build, sim_build_files
 
 # IOs ----------------------------------------------------------------------------------------------
 
@@ -43,7 +52,15 @@ _io = [
         Subsignal("sink_valid",   Pins(1)),
         Subsignal("sink_ready",   Pins(1)),
         Subsignal("sink_data",    Pins(8)),
-    )
+    ),
+
+    # Audio (wavsink sim module).
+    ("audio", 0,
+        Subsignal("sample", Pins(1)),
+        Subsignal("en",     Pins(1)),
+        Subsignal("left",   Pins(16)),
+        Subsignal("right",  Pins(16)),
+    ),
 ]
 
 # Platform -----------------------------------------------------------------------------------------
@@ -55,7 +72,7 @@ class Platform(SimPlatform):
 # Simulation SoC -----------------------------------------------------------------------------------
 
 class SimSoC(CPS1MusicboxSoC):
-    mem_map = {**SoCCore.mem_map, **{"spiflash": 0x80000000}}
+    mem_map = {**SoCCore.mem_map, **{"spiflash": 0x80000000, "song": 0x30000000}}
     def __init__(self,
         with_sdram            = False,
         with_analyzer         = False,
@@ -64,10 +81,17 @@ class SimSoC(CPS1MusicboxSoC):
         sdram_data_width      = 32,
         sdram_spd_data        = None,
         sdram_verbosity       = 0,
+        sdram_runtime_init    = False,
         with_spi_flash        = False,
         spi_flash_init        = [],
         sim_debug             = False,
         trace_reset_on        = False,
+        audio_mode            = "raw",
+        audio_file            = None,
+        trace_window          = None,
+        song_slot_size        = 0,
+        perf_csv              = None,
+        perf_csv_period       = 10,
         **kwargs):
         platform     = Platform()
         sys_clk_freq = int(24e6)
@@ -89,12 +113,27 @@ class SimSoC(CPS1MusicboxSoC):
                 sdram_module     = sdram_module_cls(sdram_clk_freq, sdram_rate)
             else:
                 sdram_module = litedram_modules.SDRAMModule.from_spd_data(sdram_spd_data, sdram_clk_freq)
+            # runtime init: every bank memory gets an .init file, rewritten by vgmtools/simload.py
+            # before the simulation starts
             self.submodules.sdrphy = SDRAMPHYModel(
                 module     = sdram_module,
                 data_width = sdram_data_width,
                 clk_freq   = sdram_clk_freq,
                 verbosity  = sdram_verbosity,
-                init       = sdram_init)
+                init       = sdram_init or ([0] if sdram_runtime_init else []))
+            if sdram_runtime_init:
+                settings = self.sdrphy.settings
+                self.sdram_image = dict(
+                    nbanks          = 2**sdram_module.geom_settings.bankbits,
+                    nrows           = 2**sdram_module.geom_settings.rowbits,
+                    ncols           = 2**sdram_module.geom_settings.colbits,
+                    databits        = settings.databits,
+                    data_width      = settings.dfi_databits*settings.nphases,
+                    address_mapping = "ROW_BANK_COL",
+                )
+                banks = [m for _, m in self.sdrphy._submodules if isinstance(m, BankModel)]
+                self.sdram_memories = [next(s for s in bank._fragment.specials if isinstance(s, Memory))
+                                       for bank in banks]
             self.add_sdram("sdram",
                 phy                     = self.sdrphy,
                 module                  = sdram_module,
@@ -104,7 +143,7 @@ class SimSoC(CPS1MusicboxSoC):
                 l2_cache_min_data_width = kwargs.get("min_l2_data_width", 128),
                 l2_cache_reverse        = False
             )
-            if sdram_init != []:
+            if sdram_init != [] or sdram_runtime_init:
                 # Skip SDRAM test to avoid corrupting pre-initialized contents.
                 self.add_constant("SDRAM_TEST_DISABLE")
             else:
@@ -124,18 +163,43 @@ class SimSoC(CPS1MusicboxSoC):
             self.submodules.spiflash_phy = LiteSPIPHYModel(spiflash_module, init=spi_flash_init)
             self.add_spi_flash(phy=self.spiflash_phy, mode="4x", module=spiflash_module, with_master=True)
 
-        # DAO
-        self.submodules.dao_dump = DaoDump(platform, dump_file_name="cps1.raw")
+        # DAO: raw $fwrite dump or samples handed to the wavsink sim module
+        if audio_mode == "raw":
+            self.submodules.dao_dump = DaoDump(platform, dump_file_name=audio_file or "cps1.raw")
+        else:
+            self.submodules.dao_dump = DaoDump(platform, pads=platform.request("audio"))
         self.comb += [
             self.dao_dump.sample.eq(self.jt51.sample),
             self.dao_dump.left.eq(self.mixer.o_mixed_left),
             self.dao_dump.right.eq(self.mixer.o_mixed_right)
         ]
 
+        # Performance counters: CSV dump every perf_csv_period ms
+        if perf_csv is not None:
+            self.submodules.perf_dump = PerfCSVDump(platform, self.perf,
+                dump_file_name = perf_csv,
+                period         = int(sys_clk_freq * perf_csv_period / 1000))
+
         self.add_sdcard("sdcard", mode="read", use_emulator=True)
 
+        # Song slot: read-only memory loaded from its .init file when the simulation starts, so
+        # vgmtools/batch.py renders many songs through one Verilator build
+        if song_slot_size:
+            self.add_rom("song", self.mem_map["song"], song_slot_size, contents=[0], mode="r")
+
         # Simulation debugging ----------------------------------------------------------------------
-        if sim_debug:
+        if trace_window is not None:
+            # trace only a (start, end) window of VGM samples instead of following sim_trace
+            self.submodules.trace_window = VGMSampleTraceWindow(platform.trace,
+                playing  = self.dao_dump._control.fields.en,
+                clk_freq = sys_clk_freq,
+                tick     = self.sample_scheduler.tick if hasattr(self, "sample_scheduler") else None,
+                start    = trace_window[0],
+                end      = trace_window[1])
+            if sim_debug:
+                self.submodules.sim_marker = SimMarker()
+                self.submodules.sim_finish = SimFinish()
+        elif sim_debug:
             platform.add_debug(self, reset=1 if trace_reset_on else 0)
         else:
             self.comb += platform.trace.eq(1)
@@ -169,7 +233,55 @@ class SimSoC(CPS1MusicboxSoC):
 
 # Build --------------------------------------------------------------------------------------------
 
-def generate_gtkw_savefile(builder, vns, trace_fst):
+def audio_groups(soc):
+    """(group name, signals) of the audio path, group names are the submodule names"""
+    groups = []
+    if hasattr(soc, "vgc_sequencer"):
+        seq = soc.vgc_sequencer
+        groups.append(("vgc_sequencer", [s for s, _ in seq.bus.iter_flat()] +
+                       [s for s, _ in seq.ym2151.iter_flat()] + [s for s, _ in seq.okim6295.iter_flat()]))
+    groups.append(("jt51", [soc.jt51.sample, soc.jt51.xleft, soc.jt51.xright, soc.jt51.cmd_fifo.level] +
+                   [s for s, _ in soc.jt51.sink.iter_flat()]))
+    groups.append(("jt6295", [soc.jt6295.sample, soc.jt6295.sound, soc.jt6295.ss, soc.jt6295.o_rom_addr,
+                              soc.jt6295.i_rom_data, soc.jt6295.i_rom_ok] +
+                   [s for s, _ in soc.jt6295.sink.iter_flat()]))
+    if hasattr(soc, "jt6295_rom_bram"):
+        rom = soc.jt6295_rom_bram
+        groups.append(("jt6295_rom_bram", [rom.i_rom_addr, rom.o_rom_data, rom.o_rom_ok] +
+                       [s for s, _ in rom.bus.iter_flat()]))
+    else:
+        rom_dma = soc.jt6295_rom_dma
+        groups.append(("jt6295_rom_dma", [rom_dma.i_rom_addr, rom_dma.o_rom_data, rom_dma.o_rom_ok] +
+                       ([rom_dma.hits, rom_dma.misses] if rom_dma.n_lines else []) +
+                       [s for s, _ in rom_dma.bus.iter_flat()]))
+    groups.append(("mixer", soc.mixer.i_fm_left + soc.mixer.i_pcm_left + [soc.mixer.o_mixed_left,
+                             soc.mixer.o_mixed_right, soc.mixer.o_peak]))
+    if hasattr(soc, "trace_window"):
+        groups.append(("trace_window", [soc.trace_window.sample]))
+    return groups
+
+def write_sdram_image_config(soc, gateware_dir, vns, endianness):
+    """sdram_image.json: SDRAM model geometry and bank .init files, for vgmtools/simload.py"""
+    config = dict(soc.sdram_image,
+        endianness = endianness,
+        files      = ["{}_{}.init".format(soc.build_name, vns.get_name(mem)) for mem in soc.sdram_memories])
+    with open(os.path.join(gateware_dir, "sdram_image.json"), "w") as f:
+        json.dump(config, f, indent=4)
+
+def run_sim(gateware_dir, build_name, interactive):
+    """Runs the Verilator model of gateware_dir like the LiteX toolchain does after its build, the
+    terminal settings the serial console changes restored"""
+    termios_settings = None
+    if interactive and sys.platform != "win32":
+        import termios
+        termios_settings = termios.tcgetattr(sys.stdin.fileno())
+    try:
+        subprocess.call([os.path.join("obj_dir", "V" + build_name)], cwd=gateware_dir)
+    finally:
+        if termios_settings is not None:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSAFLUSH, termios_settings)
+
+def generate_gtkw_savefile(builder, vns, trace_fst, trace_scopes=None):
     from litex.build.sim import gtkwave as gtkw
     dumpfile = os.path.join(builder.gateware_dir, "sim.{}".format("fst" if trace_fst else "vcd"))
     savefile = os.path.join(builder.gateware_dir, "sim.gtkw")
@@ -178,6 +290,12 @@ def generate_gtkw_savefile(builder, vns, trace_fst):
     with gtkw.GTKWSave(vns, savefile=savefile, dumpfile=dumpfile) as save:
         save.clocks()
         save.fsm_states(soc)
+
+        # audio path, only the traced hierarchies with --trace-scope
+        for name, signals in audio_groups(soc):
+            if not trace_scopes or any(name.startswith(scope) for scope in trace_scopes):
+                save.group(signals, group_name=name, closed=False)
+
         if "main_ram" in soc.bus.slaves.keys():
             save.add(soc.bus.slaves["main_ram"], mappers=[gtkw.wishbone_sorter(), gtkw.wishbone_colorer()])
 
@@ -217,6 +335,7 @@ def sim_args(parser):
     parser.add_argument("--sdram-module",         default="MT48LC16M16",   help="Select SDRAM chip.")
     parser.add_argument("--sdram-data-width",     default=32,              help="Set SDRAM chip data width.")
     parser.add_argument("--sdram-init",           default=None,            help="SDRAM init file (.bin or .json).")
+    parser.add_argument("--sdram-runtime-init",   action="store_true",     help="Load the SDRAM contents when the simulation starts (vgmtools/simload.py), one build for any firmware.")
     parser.add_argument("--sdram-from-spd-dump",  default=None,            help="Generate SDRAM module based on data from SPD EEPROM dump.")
     parser.add_argument("--sdram-verbosity",      default=0,               help="Set SDRAM checker verbosity.")
     parser.add_argument("--with-analyzer",        action="store_true",     help="Enable Analyzer support.")
@@ -225,7 +344,27 @@ def sim_args(parser):
     parser.add_argument("--with-spi-flash",       action="store_true",     help="Enable SPI Flash (MMAPed).")
     parser.add_argument("--spi_flash-init",       default=None,            help="SPI Flash init file.")
     parser.add_argument("--with-gpio",            action="store_true",     help="Enable Tristate GPIO (32 pins).")
+    parser.add_argument("--with-sequencer",       action="store_true",     help="Enable hardware VGC sequencer.")
+    parser.add_argument("--jt6295-rom-lines",     default=4,               help="JT6295 ROM reader line buffer lines (0 to disable).")
+    parser.add_argument("--jt6295-rom-native",    action="store_true",     help="Read the JT6295 ROM on dedicated LiteDRAM ports, bypassing the main bus and L2 (needs --with-sdram).")
+    parser.add_argument("--jt6295-rom-bram-size", default=0, type=lambda x: int(x, 0), help="JT6295 ROM in block RAM of this size (bytes, power of 2, up to 0x40000) instead of SDRAM.")
+    parser.add_argument("--serial-mixer",         action="store_true",     help="Mix both sides with one shared multiplier instead of two jtframe_mixer cores.")
+    parser.add_argument("--n-chips",              default=1, type=int,     help="JT51/JT6295 pairs (1 to 4), mixed together.")
+    parser.add_argument("--with-sample-scheduler", action="store_true",    help="Play with the tickless sample scheduler (exact sample rate) instead of timer0.")
+    parser.add_argument("--with-perf-counters",   action="store_true",     help="Add the playback performance counters (vgmplay prints them when it stops).")
+    parser.add_argument("--perf-csv",             default=None,            help="Dump the performance counters to this CSV file, implies --with-perf-counters.")
+    parser.add_argument("--perf-csv-period",      default=10, type=float,  help="Performance counters CSV dump period (ms of simulated time).")
+    parser.add_argument("--with-audio-capture",   action="store_true",     help="Capture the mixer output to an SDRAM ring buffer (vgmtools/capture.py, needs a UART bridge).")
+    parser.add_argument("--audio-capture-sources", action="store_true",    help="Also capture the FM/PCM mixer inputs.")
+    parser.add_argument("--audio-mode",           default="raw",           help="Audio output: raw ($fwrite, headerless), wav (buffered WAV file) or pipe (WAV stream to a named pipe).", choices=["raw", "wav", "pipe"])
+    parser.add_argument("--audio-file",           default=None,            help="Audio output file or named pipe (default: cps1.raw/cps1.wav/cps1.pipe in the gateware directory).")
+    parser.add_argument("--song-slot-size",       default=0, type=int,     help="Add a song slot of this size (bytes) for vgmtools/batch.py.")
+    parser.add_argument("--uart-tcp-port",        default=0, type=int,     help="Serve the UART on this TCP port instead of the console (vgmtools/uartstream.py).")
+    parser.add_argument("--build-cache",          default=None, nargs="?", const="build/cache", help="Reuse the Verilator build of an unchanged design from this cache directory (default: build/cache), Verilator doesn't run on a hit.")
     parser.add_argument("--sim-debug",            action="store_true",     help="Add simulation debugging modules.")
+    parser.add_argument("--trace-start-sample",   default=None, type=int,  help="Trace from this VGM sample (44.1kHz, counted while playing), implies --trace.")
+    parser.add_argument("--trace-end-sample",     default=None, type=int,  help="Stop tracing at this VGM sample, implies --trace.")
+    parser.add_argument("--trace-scope",          action="append",         help="Only trace this submodule hierarchy (e.g. jt6295, jt6295_rom_dma), can be repeated, implies --trace.")
     parser.add_argument("--gtkwave-savefile",     action="store_true",     help="Generate GTKWave savefile.")
     parser.add_argument("--non-interactive",      action="store_true",     help="Run simulation without user input.")
 
@@ -249,7 +388,10 @@ def main():
     # UART.
     if soc_kwargs["uart_name"] == "serial":
         soc_kwargs["uart_name"] = "sim"
-        sim_config.add_module("serial2console", "serial")
+        if args.uart_tcp_port:
+            sim_config.add_module("serial2tcp", "serial", args={"port": args.uart_tcp_port})
+        else:
+            sim_config.add_module("serial2console", "serial")
 
     # ROM.
     if args.rom_init:
@@ -265,9 +407,17 @@ def main():
         soc_kwargs["sdram_module"]     = args.sdram_module
         soc_kwargs["sdram_data_width"] = int(args.sdram_data_width)
         soc_kwargs["sdram_verbosity"]  = int(args.sdram_verbosity)
+        soc_kwargs["sdram_runtime_init"] = args.sdram_runtime_init
         if args.sdram_from_spd_dump:
             soc_kwargs["sdram_spd_data"] = parse_spd_hexdump(args.sdram_from_spd_dump)
 
+    # Trace window/scopes.
+    trace_window = None
+    if args.trace_start_sample is not None or args.trace_end_sample is not None:
+        trace_window = (args.trace_start_sample or 0, args.trace_end_sample)
+    if trace_window is not None or args.trace_scope:
+        verilator_build_kwargs["trace"] = True
+
     # SoC ------------------------------------------------------------------------------------------
     soc = SimSoC(
         with_sdram         = args.with_sdram,
@@ -276,27 +426,78 @@ def main():
         with_sdcard        = args.with_sdcard,
         with_spi_flash     = args.with_spi_flash,
         with_gpio          = args.with_gpio,
+        with_sequencer     = args.with_sequencer,
+        jt6295_rom_lines   = int(args.jt6295_rom_lines),
+        jt6295_rom_native  = args.jt6295_rom_native,
+        jt6295_rom_bram_size = args.jt6295_rom_bram_size,
+        serial_mixer       = args.serial_mixer,
+        n_chips            = args.n_chips,
+        with_sample_scheduler = args.with_sample_scheduler,
+        with_perf_counters = args.with_perf_counters or args.perf_csv is not None,
+        with_audio_capture = args.with_audio_capture,
+        audio_capture_sources = args.audio_capture_sources,
         sim_debug          = args.sim_debug,
         trace_reset_on     = int(float(args.trace_start)) > 0 or int(float(args.trace_end)) > 0,
+        audio_mode         = args.audio_mode,
+        audio_file         = None if args.audio_file is None else os.path.abspath(args.audio_file),
+        trace_window       = trace_window,
+        song_slot_size     = args.song_slot_size,
+        perf_csv           = None if args.perf_csv is None else os.path.abspath(args.perf_csv),
+        perf_csv_period    = args.perf_csv_period,
         sdram_init         = []   if args.sdram_init     is None else get_mem_data(args.sdram_init,     endianness=cpu.endianness),
         spi_flash_init     = None if args.spi_flash_init is None else get_mem_data(args.spi_flash_init, endianness="big"),
         **soc_kwargs)
-    if args.ram_init is not None or args.sdram_init is not None:
+    if args.ram_init is not None or args.sdram_init is not None or args.sdram_runtime_init:
         soc.add_constant("ROM_BOOT_ADDRESS", soc.mem_map["main_ram"])
 
+    # Audio.
+    extra_mods = []
+    if args.audio_mode != "raw":
+        audio_file = args.audio_file or "cps1.{}".format("wav" if args.audio_mode == "wav" else "pipe")
+        sim_config.add_module("wavsink", "audio", args={
+            "filename" : os.path.abspath(audio_file) if args.audio_file else audio_file,
+            "rate"     : round(soc.jt51.sample_rate),
+            "mode"     : args.audio_mode,
+        })
+        extra_mods.append("wavsink")
+
     # Build/Run ------------------------------------------------------------------------------------
     def pre_run_callback(vns):
-        if args.trace:
-            generate_gtkw_savefile(builder, vns, args.trace_fst)
+        if hasattr(soc, "sdram_image"):
+            write_sdram_image_config(soc, builder.gateware_dir, vns, cpu.endianness)
+        if verilator_build_kwargs["trace"]:
+            generate_gtkw_savefile(builder, vns, args.trace_fst, args.trace_scope)
 
     builder_kwargs["csr_csv"] = "csr.csv"
     builder = Builder(soc, **builder_kwargs)
-    builder.build(
+    if args.trace_scope:
+        os.makedirs(builder.gateware_dir, exist_ok=True)
+        soc.platform.add_source(trace_scope_config(os.path.join(builder.gateware_dir, "trace_scope.vlt"),
+                                                   args.trace_scope))
+    extra_mods_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), "gateware", "sim", "modules")
+    # with the build cache, only generate the files here: Verilator runs on cache misses only, a hit
+    # takes the model from the cache and runs it without Verilator
+    build_cache = args.build_cache and builder.compile_gateware
+    if build_cache:
+        verilator_build_kwargs["run"] = False
+    vns = builder.build(
         sim_config       = sim_config,
         interactive      = not args.non_interactive,
         pre_run_callback = pre_run_callback,
+        extra_mods       = extra_mods,
+        extra_mods_path  = extra_mods_path,
         **verilator_build_kwargs,
     )
+    if hasattr(soc, "sdram_image") and vns is not None:
+        write_sdram_image_config(soc, builder.gateware_dir, vns, cpu.endianness)
+    if build_cache:
+        inputs, outputs = sim_build_files(soc.build_name)
+        cached_build(args.build_cache, soc.platform, builder.gateware_dir, soc.build_name, inputs, outputs,
+            with_init_files = False,
+            tools           = [["verilator", "--version"]],
+            source_dirs     = [core_directory] + [os.path.join(extra_mods_path, m) for m in extra_mods])
+        pre_run_callback(vns)
+        run_sim(builder.gateware_dir, soc.build_name, interactive=not args.non_interactive)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,15 @@
+#pragma once
+#include <generated/csr.h>
+#include <generated/soc.h>
+
+// JT51/JT6295 pairs of the SoC (CPS1MusicboxSoC n_chips, up to 4). Chip 0 has the jt51, jt6295
+// and jt6295_rom_dma CSR banks, chip i the jt51_<i>, jt6295_<i> and jt6295_rom_dma_<i> ones, with
+// the same layout: their registers are reached from the chip 0 register addresses
+#ifndef CPS1_N_CHIPS
+#define CPS1_N_CHIPS 1
+#endif
+
+// address of the register at csr_addr of the chip 0 bank at bank_base, in the bank at chip_base
+#define CHIP_CSR_ADDR(chip_base, bank_base, csr_addr) ((chip_base) + ((csr_addr) - (bank_base)))
+// value of a field of a register read with csr_read_simple
+#define CHIP_CSR_FIELD(value, offset, size) (((value) >> (offset)) & ((1 << (size)) - 1))
@@ -0,0 +1,305 @@
+#include "inflate.h"
+#include <stdio.h>
+
+// follows RFC 1951 (DEFLATE) and RFC 1952 (gzip), canonical Huffman decoding as in zlib's puff.c
+
+#define MAX_BITS 15
+#define MAX_LCODES 286
+#define MAX_DCODES 30
+#define FIXED_LCODES 288
+
+static const uint16_t length_base[29] = {
+    3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31,
+    35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258};
+static const uint8_t length_extra[29] = {
+    0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2,
+    3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0};
+static const uint16_t dist_base[30] = {
+    1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193,
+    257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145, 8193, 12289, 16385, 24577};
+static const uint8_t dist_extra[30] = {
+    0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6,
+    7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13};
+static const uint8_t code_length_order[19] = {
+    16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15};
+
+// n bits, LSB first. Running out of input is an error: the whole stream is in memory
+static uint32_t bits(struct inflate *z, uint32_t n) {
+    while (z->bit_count < n) {
+        if (z->in_pos >= z->in_size) {
+            z->state = INFLATE_ERROR;
+            return 0;
+        }
+        z->bit_buf |= (uint32_t)z->in[z->in_pos++] << z->bit_count;
+        z->bit_count += 8;
+    }
+
+    uint32_t value = z->bit_buf & ((1u << n) - 1);
+    z->bit_buf >>= n;
+    z->bit_count -= n;
+    return value;
+}
+
+static int decode(struct inflate *z, const struct huffman *h) {
+    int code = 0;  // len bits being decoded
+    int first = 0; // first code of length len
+    int index = 0; // index of the first code of length len in symbol
+
+    for (int len = 1; len <= MAX_BITS; len++) {
+        code |= bits(z, 1);
+        int count = h->count[len];
+        if (code - count < first) return h->symbol[index + (code - first)];
+        index += count;
+        first = (first + count) << 1;
+        code <<= 1;
+    }
+
+    z->state = INFLATE_ERROR; // ran out of codes
+    return 0;
+}
+
+// Huffman table from code lengths, false when over-subscribed (incomplete codes are accepted)
+static bool construct(struct huffman *h, const uint8_t *length, int n) {
+    uint16_t offs[MAX_BITS + 1];
+
+    for (int len = 0; len <= MAX_BITS; len++) h->count[len] = 0;
+    for (int symbol = 0; symbol < n; symbol++) h->count[length[symbol]]++;
+    if (h->count[0] == n) return true;
+
+    int left = 1;
+    for (int len = 1; len <= MAX_BITS; len++) {
+        left = (left << 1) - h->count[len];
+        if (left < 0) return false;
+    }
+
+    offs[1] = 0;
+    for (int len = 1; len < MAX_BITS; len++) offs[len + 1] = offs[len] + h->count[len];
+    for (int symbol = 0; symbol < n; symbol++) {
+        if (length[symbol]) h->symbol[offs[length[symbol]]++] = symbol;
+    }
+    return true;
+}
+
+static void fixed_tables(struct inflate *z) {
+    uint8_t length[FIXED_LCODES];
+    int symbol = 0;
+
+    for (; symbol < 144; symbol++) length[symbol] = 8;
+    for (; symbol < 256; symbol++) length[symbol] = 9;
+    for (; symbol < 280; symbol++) length[symbol] = 7;
+    for (; symbol < FIXED_LCODES; symbol++) length[symbol] = 8;
+    construct(&z->lencode, length, FIXED_LCODES);
+
+    for (symbol = 0; symbol < MAX_DCODES; symbol++) length[symbol] = 5;
+    construct(&z->distcode, length, MAX_DCODES);
+}
+
+static bool dynamic_tables(struct inflate *z) {
+    uint8_t length[MAX_LCODES + MAX_DCODES];
+
+    int nlen = bits(z, 5) + 257;
+    int ndist = bits(z, 5) + 1;
+    int ncode = bits(z, 4) + 4;
+    if (nlen > MAX_LCODES || ndist > MAX_DCODES) return false;
+
+    // code length code lengths, then the literal/length and distance code lengths
+    int index = 0;
+    for (; index < ncode; index++) length[code_length_order[index]] = bits(z, 3);
+    for (; index < 19; index++) length[code_length_order[index]] = 0;
+    if (!construct(&z->lencode, length, 19)) return false;
+
+    index = 0;
+    while (index < nlen + ndist) {
+        int symbol = decode(z, &z->lencode);
+        if (z->state == INFLATE_ERROR) return false;
+        if (symbol < 16) {
+            length[index++] = symbol;
+            continue;
+        }
+
+        int len = 0;
+        int repeat;
+        if (symbol == 16) {
+            if (index == 0) return false;
+            len = length[index - 1];
+            repeat = 3 + bits(z, 2);
+        } else if (symbol == 17) {
+            repeat = 3 + bits(z, 3);
+        } else {
+            repeat = 11 + bits(z, 7);
+        }
+        if (index + repeat > nlen + ndist) return false;
+        while (repeat--) length[index++] = len;
+    }
+
+    // the end of block code is required
+    if (length[256] == 0) return false;
+    return construct(&z->lencode, length, nlen) && construct(&z->distcode, length + nlen, ndist);
+}
+
+static void block_header(struct inflate *z) {
+    z->last = bits(z, 1);
+    uint32_t type = bits(z, 2);
+    if (z->state == INFLATE_ERROR) return;
+
+    switch (type) {
+        // stored: byte aligned LEN, NLEN
+        case 0: {
+            z->bit_buf = 0;
+            z->bit_count = 0;
+            if (z->in_pos + 4 > z->in_size) {
+                z->state = INFLATE_ERROR;
+                return;
+            }
+            const uint8_t *p = z->in + z->in_pos;
+            z->stored_left = p[0] | (p[1] << 8);
+            if ((p[2] | (p[3] << 8)) != (~z->stored_left & 0xffff)) {
+                z->state = INFLATE_ERROR;
+                return;
+            }
+            z->in_pos += 4;
+            z->state = INFLATE_STORED;
+            break;
+        }
+
+        case 1:
+            fixed_tables(z);
+            z->state = INFLATE_HUFFMAN;
+            break;
+
+        case 2:
+            if (dynamic_tables(z) && z->state != INFLATE_ERROR)
+                z->state = INFLATE_HUFFMAN;
+            else
+                z->state = INFLATE_ERROR;
+            break;
+
+        default:
+            z->state = INFLATE_ERROR;
+            break;
+    }
+}
+
+static inline uint8_t put(struct inflate *z, uint8_t value) {
+    z->window[z->out_pos++ & (INFLATE_WINDOW_SIZE - 1)] = value;
+    return value;
+}
+
+bool is_gzip(const uint8_t *data, const size_t data_size) {
+    return data_size >= 18 && data[0] == 0x1f && data[1] == 0x8b && data[2] == 8;
+}
+
+// Sets z up to inflate a gzip member, out_size is the uncompressed size from the trailer
+bool inflate_gzip_init(struct inflate *z, const uint8_t *data, const size_t data_size, uint32_t *out_size) {
+    if (!is_gzip(data, data_size)) {
+        fprintf(stderr, "Invalid gzip file\n");
+        return false;
+    }
+
+    // 10 bytes header, then the optional fields flagged in FLG
+    uint8_t flags = data[3];
+    size_t offset = 10;
+    if (flags & 0x04) offset += 2 + (data[offset] | (data[offset + 1] << 8)); // FEXTRA
+    if (flags & 0x08) while (offset < data_size && data[offset++]);          // FNAME
+    if (flags & 0x10) while (offset < data_size && data[offset++]);          // FCOMMENT
+    if (flags & 0x02) offset += 2;                                            // FHCRC
+    if (offset + 8 > data_size) {
+        fprintf(stderr, "Invalid gzip file\n");
+        return false;
+    }
+
+    // trailer: CRC32, ISIZE
+    const uint8_t *trailer = data + data_size - 4;
+    *out_size = trailer[0] | (trailer[1] << 8) | (trailer[2] << 16) | ((uint32_t)trailer[3] << 24);
+
+    z->in = data + offset;
+    z->in_size = data_size - 8 - offset;
+    z->in_pos = 0;
+    z->bit_buf = 0;
+    z->bit_count = 0;
+    z->state = INFLATE_HEADER;
+    z->last = false;
+    z->stored_left = 0;
+    z->match_len = 0;
+    z->out_pos = 0;
+    return true;
+}
+
+// Inflates up to n bytes to dst (skipped when dst is null), returns the number of bytes produced:
+// less than n at the end of the stream or on errors (state INFLATE_ERROR)
+uint32_t inflate_read(struct inflate *z, uint8_t *dst, uint32_t n) {
+    uint32_t produced = 0;
+
+    while (produced < n) {
+        if (z->match_len) {
+            uint8_t value = put(z, z->window[(z->out_pos - z->match_dist) & (INFLATE_WINDOW_SIZE - 1)]);
+            if (dst) dst[produced] = value;
+            produced++;
+            z->match_len--;
+            continue;
+        }
+
+        switch (z->state) {
+            case INFLATE_HEADER:
+                block_header(z);
+                break;
+
+            case INFLATE_STORED:
+                if (z->stored_left == 0) {
+                    z->state = z->last ? INFLATE_DONE : INFLATE_HEADER;
+                    break;
+                }
+                if (z->in_pos >= z->in_size) {
+                    z->state = INFLATE_ERROR;
+                    break;
+                }
+                {
+                    uint8_t value = put(z, z->in[z->in_pos++]);
+                    if (dst) dst[produced] = value;
+                    produced++;
+                    z->stored_left--;
+                }
+                break;
+
+            case INFLATE_HUFFMAN: {
+                int symbol = decode(z, &z->lencode);
+                if (z->state == INFLATE_ERROR) break;
+
+                if (symbol < 256) {
+                    uint8_t value = put(z, symbol);
+                    if (dst) dst[produced] = value;
+                    produced++;
+                } else if (symbol == 256) {
+                    z->state = z->last ? INFLATE_DONE : INFLATE_HEADER;
+                } else {
+                    symbol -= 257;
+                    if (symbol >= 29) {
+                        z->state = INFLATE_ERROR;
+                        break;
+                    }
+                    uint32_t len = length_base[symbol] + bits(z, length_extra[symbol]);
+                    symbol = decode(z, &z->distcode);
+                    if (z->state == INFLATE_ERROR) break;
+                    if (symbol >= 30) {
+                        z->state = INFLATE_ERROR;
+                        break;
+                    }
+                    uint32_t dist = dist_base[symbol] + bits(z, dist_extra[symbol]);
+                    if (dist > z->out_pos || dist > INFLATE_WINDOW_SIZE) {
+                        z->state = INFLATE_ERROR;
+                        break;
+                    }
+                    z->match_len = len;
+                    z->match_dist = dist;
+                }
+                break;
+            }
+
+            default:
+                // INFLATE_DONE, INFLATE_ERROR
+                return produced;
+        }
+    }
+
+    return produced;
+}
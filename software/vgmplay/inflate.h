@@ -0,0 +1,43 @@
+#pragma once
+#include <stdint.h>
+#include <stddef.h>
+#include <stdbool.h>
+
+// Streaming DEFLATE (RFC 1951) decoder for gzip compressed (.vgz) files in memory: the output is
+// produced on demand, only the last 32KiB are kept for back references
+
+#define INFLATE_WINDOW_SIZE 32768
+
+#define INFLATE_HEADER 0
+#define INFLATE_STORED 1
+#define INFLATE_HUFFMAN 2
+#define INFLATE_DONE 3
+#define INFLATE_ERROR 4
+
+struct huffman {
+    uint16_t count[16];   // number of codes of each length
+    uint16_t symbol[288]; // symbols ordered by code
+};
+
+struct inflate {
+    const uint8_t *in;
+    uint32_t in_size;
+    uint32_t in_pos;
+    uint32_t bit_buf;
+    uint32_t bit_count;
+
+    uint8_t state;
+    bool last;            // current block is the last one
+    uint32_t stored_left; // bytes left in a stored block
+    uint32_t match_len;   // bytes left to copy from match_dist back
+    uint32_t match_dist;
+    struct huffman lencode;
+    struct huffman distcode;
+
+    uint32_t out_pos;     // bytes produced so far
+    uint8_t window[INFLATE_WINDOW_SIZE];
+};
+
+bool is_gzip(const uint8_t *data, const size_t data_size);
+bool inflate_gzip_init(struct inflate *z, const uint8_t *data, const size_t data_size, uint32_t *out_size);
+uint32_t inflate_read(struct inflate *z, uint8_t *dst, uint32_t n);
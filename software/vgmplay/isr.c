@@ -5,6 +5,7 @@
 
 void isr(void);
 void timer0_isr(void);
+void sample_scheduler_isr(void);
 
 #ifdef CONFIG_CPU_HAS_INTERRUPT
 
@@ -17,7 +18,11 @@ void isr(void) {
     if (irqs & (1 << UART_INTERRUPT)) uart_isr();
 #endif
 
+#ifdef CSR_SAMPLE_SCHEDULER_BASE
+    if (irqs & (1 << SAMPLE_SCHEDULER_INTERRUPT)) sample_scheduler_isr();
+#else
     if (irqs & (1 << TIMER0_INTERRUPT)) timer0_isr();
+#endif
 }
 
 #else
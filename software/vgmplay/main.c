@@ -9,10 +9,16 @@
 #include <libbase/console.h>
 #include <liblitedram/sdram.h>
 #include <generated/csr.h>
+#include <generated/mem.h>
 
 #include "ym2151.h"
 #include "msm6295.h"
+#include "chips.h"
 #include "timer.h"
+#include "perf.h"
+#include "sequencer.h"
+#include "stream.h"
+#include "uartstream.h"
 #include "vgm.h"
 
 const uint32_t vgm_sample_rate = 44100;
@@ -27,30 +33,91 @@ const uint32_t timer0_ticks = (uint32_t)(CONFIG_CLOCK_FREQUENCY / vgm_sample_rat
 extern const uint8_t vgm_data[];
 extern const uint32_t vgm_data_size;
 
+#ifdef VGM_INDEX_FILE
+// seek index of VGM_DATA_FILE (vgmtools/vgi.py)
+extern const uint8_t vgm_index[];
+extern const uint32_t vgm_index_size;
+#endif
+
+#ifdef VGM_DATA_FILE_2
+// played at the same time as VGM_DATA_FILE, on the next chip pair(s)
+extern const uint8_t vgm_data_2[];
+extern const uint32_t vgm_data_2_size;
+#endif
+
+#ifdef SONG_BASE
+// Song slot: read-only memory the batch renderer (vgmtools/batch.py) fills for each simulation
+// run. A valid slot replaces the built-in song and is played right away without looping.
+#define SONG_SLOT_MAGIC 0x534d4756 // "VGMS"
+
+struct song_slot {
+    uint32_t magic;
+    uint32_t max_samples; // stop after that many samples, 0 to play until the end of sound data
+    uint32_t size;
+    uint32_t reserved;
+    uint8_t data[];
+};
+#endif
+
+// .vgz or SD card file, too big for the integrated SRAM
+static struct stream vgm_stream __attribute__ ((section (".main_ram_bss")));
+static bool streaming = false;
+
+#ifdef INFLATE_BENCH
 /*-----------------------------------------------------------------------*/
-/* Uart                                                                  */
+/* Inflate benchmark                                                     */
 /*-----------------------------------------------------------------------*/
 
-static bool read_newline_nonblock(void)
+// Inflates the whole song with timer0 counting cycles: decoder cost per second of audio
+static void inflate_bench(const uint8_t *data, uint32_t data_size, uint32_t n_samples)
 {
-	char c;
+    static struct inflate z __attribute__ ((section (".main_ram_bss")));
+    static uint8_t buffer[STREAM_BLOCK_SIZE] __attribute__ ((section (".main_ram_bss")));
+    uint32_t size, n, total = 0;
 
-	if(readchar_nonblock()) {
-		c = getchar();
-        if (c == '\r' || c == '\n') return true;
-	}
+    if (!inflate_gzip_init(&z, data, data_size, &size) || n_samples == 0) return;
+
+    timer0_en_write(0);
+    timer0_reload_write(0);
+    timer0_load_write(0xffffffff);
+    timer0_en_write(1);
+    while ((n = inflate_read(&z, buffer, sizeof(buffer))) > 0) total += n;
+    timer0_update_value_write(1);
+    uint32_t cycles = 0xffffffff - timer0_value_read();
+    timer0_en_write(0);
+
+    uint32_t per_second = (uint64_t)cycles * VGM_SAMPLE_RATE / n_samples;
+    uint32_t cpu_per_10000 = (uint64_t)per_second * 10000 / CONFIG_CLOCK_FREQUENCY;
+    printf("inflate: %lu -> %lu bytes in %lu cycles (%lu cycles/byte), %lu cycles per second of audio (%lu.%02lu%% CPU)\n",
+           (unsigned long)data_size, (unsigned long)total, (unsigned long)cycles,
+           (unsigned long)(total ? cycles / total : 0), (unsigned long)per_second,
+           (unsigned long)(cpu_per_10000 / 100), (unsigned long)(cpu_per_10000 % 100));
+}
+#endif
+
+/*-----------------------------------------------------------------------*/
+/* Uart                                                                  */
+/*-----------------------------------------------------------------------*/
+
+static char read_key_nonblock(void)
+{
+	if(readchar_nonblock()) return getchar();
 
-	return false;
+	return 0;
 }
 
 /*-----------------------------------------------------------------------*/
 /* Help                                                                  */
 /*-----------------------------------------------------------------------*/
 
-static void help(void)
+static void help(bool seek)
 {
 	puts("\nLiteX vgmplay "__DATE__" "__TIME__"\n");
 	puts("Enter to play/stop");
+    if (seek) puts("0-9 to jump to 0-90%, < and > to seek 10s back/forward");
+#ifdef CSR_PERF_BASE
+    puts("p to print the performance counters");
+#endif
 }
 
 
@@ -60,18 +127,166 @@ static void enable_output(bool enable) {
 #endif
 }
 
+static bool use_sequencer = false;
+
 static void play_cmd(void)
 {
     enable_output(true);
+    perf_reset();
+#ifdef CSR_VGC_SEQUENCER_BASE
+    if (use_sequencer) {
+        sequencer_enable();
+        return;
+    }
+#endif
 	timer0_enable();
 }
 
+static void print_stats(void)
+{
+#ifdef CSR_JT6295_ROM_DMA_HITS_ADDR
+    printf("\njt6295 rom: %lu hits, %lu misses\n", (unsigned long)jt6295_rom_dma_hits_read(),
+           (unsigned long)jt6295_rom_dma_misses_read());
+#endif
+    if (streaming) printf("\nstream: %lu underruns\n", (unsigned long)vgm_stream.underruns);
+#ifdef CSR_JT51_CMD_ADDR
+    for (uint8_t chip = 0; chip < CPS1_N_CHIPS; chip++) {
+        if (ym2151_cmd_overflow(chip)) printf("\nym2151 %d: register writes dropped, command FIFO full\n", chip);
+    }
+#endif
+    perf_print(true);
+}
+
 static void stop_cmd(void)
 {
     enable_output(false);
+    print_stats();
+#ifdef CSR_VGC_SEQUENCER_BASE
+    if (use_sequencer) {
+        sequencer_disable();
+        return;
+    }
+#endif
 	timer0_disable();
 }
 
+static void finish(void)
+{
+#ifdef CSR_SIM_FINISH_BASE
+    // ends the simulation (sim.py --sim-debug)
+    sim_finish_finish_write(1);
+#endif
+}
+
+static void mixer_init(void)
+{
+    mixer_control_enable_fm_write(1);
+    mixer_control_enable_pcm_write(1);
+    mixer_control_pcm_level_write(2);
+}
+
+static void seek_cmd(uint32_t sample, bool playing)
+{
+    if (playing) timer0_disable();
+    timer0_seek(sample);
+    if (playing) timer0_enable();
+}
+
+static uint32_t current_sample(const struct timer_ctx *ctx)
+{
+#ifdef CSR_VGC_SEQUENCER_BASE
+    if (use_sequencer) return sequencer_current_sample();
+#endif
+    return timer0_current_sample(ctx);
+}
+
+static bool song_finished(const struct timer_ctx *ctx)
+{
+#ifdef CSR_VGC_SEQUENCER_BASE
+    if (use_sequencer) return sequencer_done();
+#endif
+    return ctx->finished;
+}
+
+#ifdef UART_STREAM
+/*-----------------------------------------------------------------------*/
+/* UART streaming                                                        */
+/*-----------------------------------------------------------------------*/
+
+// Plays the sound data vgmtools/uartstream.py sends while playing, see uartstream.h. Never returns
+static void uart_stream_loop(void)
+{
+    static struct uartstream uart_stream __attribute__ ((section (".main_ram_bss")));
+    // the host sends the sound data only, played once
+    static struct vgm_header vgm_header;
+
+    struct timer_ctx timer_ctx = {
+        .vgm_header = &vgm_header,
+        .no_loop = true,
+        .stream = &vgm_stream
+    };
+    bool playing = false;
+    uint32_t status_sample = 0;
+
+    streaming = true;
+    stream_open_ring(&vgm_stream);
+    uartstream_init(&uart_stream);
+    ym2151_init();
+    msm6295_init();
+    timer0_init(timer0_ticks, &timer_ctx);
+    mixer_init();
+    puts("\nLiteX vgmplay "__DATE__" "__TIME__", waiting for vgmtools/uartstream.py");
+
+    while(1) {
+        bool send_status = uartstream_poll(&uart_stream, &vgm_stream);
+        if (send_status) {
+            switch (uart_stream.type) {
+                case UARTSTREAM_HELLO:
+                    if (playing) stop_cmd();
+                    playing = false;
+                    stream_open_ring(&vgm_stream);
+                    timer_ctx.current_offset = 0;
+                    timer_ctx.current_sample = 0;
+                    timer_ctx.finished = false;
+                    status_sample = 0;
+                    // the last song may have stopped with notes held
+                    for (uint8_t chip = 0; chip < CPS1_N_CHIPS; chip++) {
+                        for (uint8_t ch = 0; ch < 8; ch++) ym2151_chip_write_cmd(chip, 0x08, ch);
+                    }
+                    msm6295_init();
+                    timer0_init(timer0_ticks, &timer_ctx);
+                    break;
+
+                case UARTSTREAM_PLAY:
+                    if (!playing) play_cmd();
+                    playing = true;
+                    break;
+
+                case UARTSTREAM_STOP:
+                    if (playing) stop_cmd();
+                    playing = false;
+                    break;
+            }
+        }
+
+        if (playing && timer_ctx.finished) {
+            playing = false;
+            stop_cmd();
+            send_status = true;
+        }
+        uint32_t sample = timer0_current_sample(&timer_ctx);
+        if (playing && sample - status_sample >= UARTSTREAM_STATUS_SAMPLES)
+            send_status = true;
+
+        if (send_status) {
+            status_sample = sample;
+            uartstream_send_status(&uart_stream, &vgm_stream, sample,
+                                   (playing ? UARTSTREAM_PLAYING : 0) |
+                                   (timer_ctx.finished ? UARTSTREAM_FINISHED : 0));
+        }
+    }
+}
+#endif
 
 //-------------------------------------------------
 //  main - program entry point
@@ -79,6 +294,28 @@ static void stop_cmd(void)
 
 int main(int argc, char *argv[]) {
     struct vgm_header vgm_header;
+    struct vgc_header vgc_header;
+    const uint8_t *data = vgm_data;
+    uint32_t data_size = vgm_data_size;
+    const char *name = VGM_DATA_FILE;
+    // non-interactive runs: play right away, stop at the end of sound data or after max_samples
+    bool autoplay = false;
+    uint32_t max_samples = 0;
+
+#ifdef AUTOPLAY_SAMPLES
+    autoplay = true;
+    max_samples = AUTOPLAY_SAMPLES;
+#endif
+#ifdef SONG_BASE
+    const struct song_slot *slot = (const struct song_slot *)SONG_BASE;
+    if (slot->magic == SONG_SLOT_MAGIC && slot->size <= SONG_SIZE - sizeof(struct song_slot)) {
+        data = slot->data;
+        data_size = slot->size;
+        name = "song slot";
+        autoplay = true;
+        max_samples = slot->max_samples;
+    }
+#endif
 
 #ifdef CONFIG_CPU_HAS_INTERRUPT
     irq_setmask(0);
@@ -86,43 +323,136 @@ int main(int argc, char *argv[]) {
 #endif
     uart_init();
 
+#ifdef UART_STREAM
+    uart_stream_loop();
+#endif
+
+#if defined(WITH_SDCARD) && defined(VGM_SD_FILE)
+    // stream VGM_SD_FILE from the SD card unless a song slot is filled
+    if (data == vgm_data) {
+        streaming = stream_open_sd(&vgm_stream, VGM_SD_FILE, &vgm_header, autoplay);
+        if (streaming)
+            name = VGM_SD_FILE;
+        else
+            fprintf(stderr, "Playing %s instead\n", name);
+    }
+#endif
+    // .vgz: inflated while playing
+    if (!streaming && is_gzip(data, data_size)) {
+        if (!stream_open_gzip(&vgm_stream, data, data_size, &vgm_header, autoplay)) {
+            fprintf(stderr, "Failed to parse header on file %s\n", name);
+            return -1;
+        }
+        streaming = true;
+#ifdef INFLATE_BENCH
+        inflate_bench(data, data_size, vgm_header.n_samples);
+#endif
+    }
+    bool compiled = !streaming && is_vgc(data, data_size);
+
     // parse the header
-    if (!parse_header(vgm_data, vgm_data_size, &vgm_header)) {
-        fprintf(stderr, "Failed to parse header on file %s\n", VGM_DATA_FILE);
+    if (!streaming && (compiled ? !parse_vgc_header(data, data_size, &vgc_header)
+                                : !parse_header(data, data_size, &vgm_header))) {
+        fprintf(stderr, "Failed to parse header on file %s\n", name);
         return -1;
     }
     
+    // seek index of the built-in song, not for VGC streams
+    const uint8_t *vgi_data = 0;
+    struct vgi_header vgi_header;
+#ifdef VGM_INDEX_FILE
+    if (!compiled && data == vgm_data && (!streaming || vgm_stream.gzip) &&
+        parse_vgi_header(vgm_index, vgm_index_size, vgm_header.eof_offset, &vgi_header))
+        vgi_data = vgm_index;
+#endif
+
     struct timer_ctx timer_ctx = {
-        .current_offset = vgm_header.vgm_data_offset,
+        .current_offset = compiled ? 0 : vgm_header.vgm_data_offset,
         .current_sample = 0,
-        .vgm_buffer = vgm_data,
-        .vgm_buffer_size = vgm_data_size,
-        .vgm_header = &vgm_header
+        .vgm_buffer = streaming ? 0 : data,
+        .vgm_buffer_size = streaming ? 0 : data_size,
+        .vgm_header = compiled ? 0 : &vgm_header,
+        .vgc_header = compiled ? &vgc_header : 0,
+        .no_loop = autoplay,
+        .stream = streaming ? &vgm_stream : 0,
+        .vgi_data = vgi_data,
+        .vgi_header = vgi_data ? &vgi_header : 0
     };
 
+    if (!compiled && vgm_header.dual_chip && CPS1_N_CHIPS < 2)
+        fprintf(stderr, "Warning: dual chip song, the SoC has one chip pair: second chip not played\n");
+
     ym2151_init();
     msm6295_init();
     timer0_init(timer0_ticks, &timer_ctx);
 
-    mixer_control_enable_fm_write(1);
-    mixer_control_enable_pcm_write(1);
-    mixer_control_pcm_level_write(2);
+#ifdef VGM_DATA_FILE_2
+    // its own song, from the chip pair after the first song's (not with the hardware sequencer)
+    struct vgm_header vgm_header_2;
+    struct timer_ctx timer_ctx_2 = {
+        .vgm_buffer = vgm_data_2,
+        .vgm_buffer_size = vgm_data_2_size,
+        .vgm_header = &vgm_header_2,
+        .no_loop = autoplay,
+        .chip = (!compiled && vgm_header.dual_chip) ? 2 : 1
+    };
+    if (!parse_header(vgm_data_2, vgm_data_2_size, &vgm_header_2)) {
+        fprintf(stderr, "Failed to parse header on file %s\n", VGM_DATA_FILE_2);
+    } else if (timer_ctx_2.chip + vgm_header_2.dual_chip >= CPS1_N_CHIPS) {
+        fprintf(stderr, "Not playing %s: the SoC has %d chip pair(s)\n", VGM_DATA_FILE_2, CPS1_N_CHIPS);
+    } else {
+        timer_ctx_2.current_offset = vgm_header_2.vgm_data_offset;
+        timer0_add(&timer_ctx_2);
+    }
+#endif
 
-    help();
+#ifdef CSR_VGC_SEQUENCER_BASE
+    // VGC streams are played by the hardware sequencer when there's one
+    use_sequencer = compiled;
+    if (use_sequencer) sequencer_init(&timer_ctx);
+#endif
+
+    mixer_init();
+
+    help(vgi_data != 0);
 
     bool playing = false;
 
+    if (autoplay) {
+        playing = true;
+        play_cmd();
+    }
+
 	while(1) {
+        if (streaming) stream_fill(&vgm_stream);
         if (playing) {
-            printf("\rplaying %s %lu ms", VGM_DATA_FILE, (timer_ctx.current_sample * sample_to_ms_q0_16) >> 16);
+            printf("\rplaying %s %lu ms", name, (current_sample(&timer_ctx) * sample_to_ms_q0_16) >> 16);
+            if (autoplay && (song_finished(&timer_ctx) ||
+                             (max_samples && current_sample(&timer_ctx) >= max_samples))) {
+                playing = false;
+                stop_cmd();
+                finish();
+            }
         }
 
-        if (read_newline_nonblock()) {
+        char key = read_key_nonblock();
+        if (key == '\r' || key == '\n') {
             playing = !playing;
             if (playing)
                 play_cmd();
             else
                 stop_cmd();
+        } else if (key == 'p') {
+            perf_print(false);
+        } else if (vgi_data && key >= '0' && key <= '9') {
+            seek_cmd((uint64_t)vgm_header.n_samples * (key - '0') / 10, playing);
+        } else if (vgi_data && (key == '<' || key == '>')) {
+            uint32_t sample = current_sample(&timer_ctx);
+            if (key == '>')
+                sample += 10 * VGM_SAMPLE_RATE;
+            else
+                sample = sample > 10 * VGM_SAMPLE_RATE ? sample - 10 * VGM_SAMPLE_RATE : 0;
+            seek_cmd(sample, playing);
         }
 	}
 
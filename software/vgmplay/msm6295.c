@@ -1,26 +1,175 @@
 #include "msm6295.h"
+#include "chips.h"
 #include <generated/csr.h>
+#include <generated/mem.h>
 #include <generated/soc.h>
+#include <system.h>
+#include <irq.h>
 #include <string.h>
+#include <stdbool.h>
 
 #include <generated/csr.h>
 
-uint8_t msm6295_rom[JT6295_ROM_SIZE] __attribute__ ((section (".msm6295_rom")));
+#ifdef JT6295_ROM_BRAM_BASE
+// one on-chip ROM per chip, written through its window in the bus map. ROM addresses past its size
+// wrap around, writes there are dropped
+#define MSM6295_ROM_SIZE JT6295_ROM_BRAM_SIZE
+static uint8_t *const msm6295_rom[CPS1_N_CHIPS] = {
+    (uint8_t *)JT6295_ROM_BRAM_BASE,
+#if CPS1_N_CHIPS > 1
+    (uint8_t *)JT6295_ROM_BRAM_1_BASE,
+#endif
+#if CPS1_N_CHIPS > 2
+    (uint8_t *)JT6295_ROM_BRAM_2_BASE,
+#endif
+#if CPS1_N_CHIPS > 3
+    (uint8_t *)JT6295_ROM_BRAM_3_BASE,
+#endif
+};
+#else
+// one ROM per chip
+#define MSM6295_ROM_SIZE JT6295_ROM_SIZE
+uint8_t msm6295_rom[CPS1_N_CHIPS][JT6295_ROM_SIZE] __attribute__ ((section (".msm6295_rom")));
+#endif
+
+// a phrase select was written, the next byte selects the channels
+static bool latched[CPS1_N_CHIPS];
+// chips whose ROM was written since the last msm6295_rom_flush, one bit each
+static volatile uint32_t rom_dirty;
+
+#if CPS1_N_CHIPS > 1
+// CSR banks of the other chips
+static const unsigned long jt6295_base[CPS1_N_CHIPS] = {
+    CSR_JT6295_BASE,
+    CSR_JT6295_1_BASE,
+#if CPS1_N_CHIPS > 2
+    CSR_JT6295_2_BASE,
+#endif
+#if CPS1_N_CHIPS > 3
+    CSR_JT6295_3_BASE,
+#endif
+};
+#ifndef JT6295_ROM_BRAM_BASE
+static const unsigned long jt6295_rom_dma_base[CPS1_N_CHIPS] = {
+    CSR_JT6295_ROM_DMA_BASE,
+    CSR_JT6295_ROM_DMA_1_BASE,
+#if CPS1_N_CHIPS > 2
+    CSR_JT6295_ROM_DMA_2_BASE,
+#endif
+#if CPS1_N_CHIPS > 3
+    CSR_JT6295_ROM_DMA_3_BASE,
+#endif
+};
+
+#define JT6295_ROM_DMA_CSR(chip, csr_addr) \
+    CHIP_CSR_ADDR(jt6295_rom_dma_base[chip], CSR_JT6295_ROM_DMA_BASE, csr_addr)
+#endif
+
+#define JT6295_CSR(chip, csr_addr) CHIP_CSR_ADDR(jt6295_base[chip], CSR_JT6295_BASE, csr_addr)
+#endif
+
+// drops what the ROM reader line buffer of a chip holds
+static void rom_invalidate(uint8_t chip) {
+#ifdef CSR_JT6295_ROM_DMA_CONTROL_ADDR
+    if (chip == 0) {
+        jt6295_rom_dma_control_invalidate_write(1);
+        return;
+    }
+#if CPS1_N_CHIPS > 1
+    csr_write_simple(1 << CSR_JT6295_ROM_DMA_CONTROL_INVALIDATE_OFFSET,
+                     JT6295_ROM_DMA_CSR(chip, CSR_JT6295_ROM_DMA_CONTROL_ADDR));
+#endif
+#else
+    (void)chip;
+#endif
+}
+
+// ROM contents written: the native ROM ports read the SDRAM behind L2, it's written back out of
+// it once for the whole batch, then the ROM readers of the chips written drop what they hold
+void msm6295_rom_flush(void) {
+    // ROM writes of the interrupt handler after this are flushed by the next call
+    unsigned int ie = irq_getie();
+    irq_setie(0);
+    uint32_t dirty = rom_dirty;
+    rom_dirty = 0;
+    irq_setie(ie);
+    if (!dirty) return;
+
+#ifdef JT6295_ROM_NATIVE
+    flush_l2_cache();
+#endif
+    for (int chip = 0; chip < CPS1_N_CHIPS; chip++) {
+        if (dirty & (1 << chip)) rom_invalidate(chip);
+    }
+}
 
 void msm6295_init(void) {
-    jt6295_rom_dma_base_write((uint32_t)msm6295_rom);
+    // not part of the firmware image (NOLOAD) or block RAM
+    for (int chip = 0; chip < CPS1_N_CHIPS; chip++) {
+        memset(msm6295_rom[chip], 0, MSM6295_ROM_SIZE);
+        rom_dirty |= 1 << chip;
+    }
+    msm6295_rom_flush();
+    memset(latched, 0, sizeof(latched));
+#ifndef JT6295_ROM_BRAM_BASE
+    jt6295_rom_dma_base_write((uint32_t)msm6295_rom[0]);
+#endif
     jt6295_control_reset_write(0);
     jt6295_control_enable_filter_write(1);
+#if CPS1_N_CHIPS > 1
+    for (int chip = 1; chip < CPS1_N_CHIPS; chip++) {
+#ifndef JT6295_ROM_BRAM_BASE
+        csr_write_simple((uint32_t)msm6295_rom[chip], JT6295_ROM_DMA_CSR(chip, CSR_JT6295_ROM_DMA_BASE_ADDR));
+#endif
+        unsigned long control = JT6295_CSR(chip, CSR_JT6295_CONTROL_ADDR);
+        uint32_t value = csr_read_simple(control);
+        value &= ~(1 << CSR_JT6295_CONTROL_RESET_OFFSET);
+        value |= 1 << CSR_JT6295_CONTROL_ENABLE_FILTER_OFFSET;
+        csr_write_simple(value, control);
+    }
+#endif
 }
 
 uint8_t *msm6295_write_rom(size_t rom_addr, const uint8_t *src, size_t n) {
-    if (rom_addr > JT6295_ROM_SIZE) return 0;
-    
-    return memcpy((void *)(msm6295_rom + rom_addr), src, n);
+    return msm6295_chip_write_rom(0, rom_addr, src, n);
+}
+
+uint8_t *msm6295_chip_write_rom(uint8_t chip, size_t rom_addr, const uint8_t *src, size_t n) {
+    if (chip >= CPS1_N_CHIPS || rom_addr > MSM6295_ROM_SIZE) return 0;
+    if (n > MSM6295_ROM_SIZE - rom_addr) n = MSM6295_ROM_SIZE - rom_addr;
+
+    uint8_t *dst = memcpy((void *)(msm6295_rom[chip] + rom_addr), src, n);
+    // written from the main loop and the interrupt handler
+    unsigned int ie = irq_getie();
+    irq_setie(0);
+    rom_dirty |= 1 << chip;
+    irq_setie(ie);
+    return dst;
+}
+
+void msm6295_chip_write_cmd(uint8_t chip, uint8_t addr, uint8_t data) {
+    if (chip == 0) {
+        msm6295_write_cmd(addr, data);
+        return;
+    }
+#if CPS1_N_CHIPS > 1
+    if (chip >= CPS1_N_CHIPS) return;
+    // ROM blocks loaded by the interrupt handler since the last command: the phrase may use them
+    if (rom_dirty) msm6295_rom_flush();
+    latched[chip] = !latched[chip] && (data & 0x80);
+
+    unsigned long control = JT6295_CSR(chip, CSR_JT6295_CONTROL_ADDR);
+    uint32_t value = csr_read_simple(control);
+    csr_write_simple(value & ~(1 << CSR_JT6295_CONTROL_WR_N_OFFSET), control);
+    csr_write_simple(data, JT6295_CSR(chip, CSR_JT6295_DIN_ADDR));
+    csr_write_simple(value | (1 << CSR_JT6295_CONTROL_WR_N_OFFSET), control);
+#endif
 }
 
 void msm6295_write_cmd(uint8_t addr, uint8_t data) {
     (void)addr;
+    if (rom_dirty) msm6295_rom_flush();
+    latched[0] = !latched[0] && (data & 0x80);
     // wait ready TODO: check if there's any busy bit on dout
     // while (jt6295_dout_read() & 0x80) {
     // }
@@ -29,4 +178,20 @@ void msm6295_write_cmd(uint8_t addr, uint8_t data) {
     jt6295_control_wr_n_write(0);
     jt6295_din_write(data);
     jt6295_control_wr_n_write(1);
-}
\ No newline at end of file
+}
+
+// Stops every voice of a chip and starts the phrases of a snapshot again, from their beginning:
+// the chip can't start a phrase midway. latch: phrase select waiting for its channel byte, 0 if none
+void msm6295_restore(uint8_t chip, const uint8_t *phrase, const uint8_t *attenuation, uint8_t latch) {
+    if (chip >= CPS1_N_CHIPS) return;
+
+    // a channel byte starting no channel clears a pending phrase select
+    if (latched[chip]) msm6295_chip_write_cmd(chip, 0, 0x00);
+    msm6295_chip_write_cmd(chip, 0, 0x78);
+    for (int ch = 0; ch < 4; ch++) {
+        if (!phrase[ch]) continue;
+        msm6295_chip_write_cmd(chip, 0, 0x80 | phrase[ch]);
+        msm6295_chip_write_cmd(chip, 0, (0x10 << ch) | attenuation[ch]);
+    }
+    if (latch) msm6295_chip_write_cmd(chip, 0, latch);
+}
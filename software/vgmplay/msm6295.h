@@ -4,4 +4,13 @@
 
 void msm6295_init(void);
 uint8_t *msm6295_write_rom(size_t rom_addr, const uint8_t *src, size_t n);
-void msm6295_write_cmd(uint8_t addr, uint8_t data);
\ No newline at end of file
+// Makes the ROM writes since the last call visible to the chips (L2 flush, ROM reader invalidate),
+// once per batch of writes: the main loop calls it after its loads, a command write does it first
+// when ROM writes are still pending
+void msm6295_rom_flush(void);
+void msm6295_write_cmd(uint8_t addr, uint8_t data);
+void msm6295_restore(uint8_t chip, const uint8_t *phrase, const uint8_t *attenuation, uint8_t latch);
+// ROM and command writes to the JT6295 of a chip pair (see chips.h), chip 0 is the one above.
+// Writes to chips the SoC doesn't have are dropped
+uint8_t *msm6295_chip_write_rom(uint8_t chip, size_t rom_addr, const uint8_t *src, size_t n);
+void msm6295_chip_write_cmd(uint8_t chip, uint8_t addr, uint8_t data);
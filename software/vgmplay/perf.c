@@ -0,0 +1,57 @@
+#include <stdio.h>
+#include "perf.h"
+
+#ifdef CSR_PERF_BASE
+
+// JT6295 ROM fetch latency histogram: bin i for [2^i, 2^(i+1)) cycles, the last one open
+static uint32_t (*const rom_latency_read[])(void) = {
+    perf_rom_latency_0_read, perf_rom_latency_1_read, perf_rom_latency_2_read, perf_rom_latency_3_read,
+    perf_rom_latency_4_read, perf_rom_latency_5_read, perf_rom_latency_6_read, perf_rom_latency_7_read,
+};
+#define N_LATENCY_BINS (sizeof(rom_latency_read) / sizeof(rom_latency_read[0]))
+
+static unsigned long permille(uint32_t value, uint32_t total) {
+    return total ? (unsigned long)((uint64_t)value * 1000 / total) : 0;
+}
+
+// snapshot and reset are pulses kept in the control storage: the register is always written
+// whole, a field write would write back the other pulse and fire it again
+#define PERF_SNAPSHOT (1 << CSR_PERF_CONTROL_SNAPSHOT_OFFSET)
+#define PERF_RESET (1 << CSR_PERF_CONTROL_RESET_OFFSET)
+
+void perf_reset(void) {
+    perf_control_write(PERF_RESET);
+}
+
+void perf_print(bool reset) {
+    // in one write the snapshot takes the counters the reset clears
+    perf_control_write(PERF_SNAPSHOT | (reset ? PERF_RESET : 0));
+
+    uint32_t cycles = perf_cycles_read();
+    uint32_t jt51_wait = perf_jt51_wait_read();
+    uint32_t rom_stall = perf_rom_stall_read();
+    uint32_t fetches = 0;
+    for (unsigned i = 0; i < N_LATENCY_BINS; i++) fetches += rom_latency_read[i]();
+
+    printf("\nperf: %lu cycles, jt51 wait %lu (%lu.%lu%%), rom stall %lu (%lu.%lu%%)\n",
+           (unsigned long)cycles,
+           (unsigned long)jt51_wait, permille(jt51_wait, cycles) / 10, permille(jt51_wait, cycles) % 10,
+           (unsigned long)rom_stall, permille(rom_stall, cycles) / 10, permille(rom_stall, cycles) % 10);
+    printf("perf: %lu timer ticks, %lu late\n",
+           (unsigned long)perf_ticks_read(), (unsigned long)perf_late_ticks_read());
+    printf("perf: %lu rom fetches, %lu cycles average, latency",
+           (unsigned long)fetches, fetches ? (unsigned long)(perf_rom_latency_total_read() / fetches) : 0);
+    for (unsigned i = 0; i < N_LATENCY_BINS; i++) {
+        if (i == N_LATENCY_BINS - 1)
+            printf(" %u+: %lu\n", 1 << i, (unsigned long)rom_latency_read[i]());
+        else
+            printf(" %u-%u: %lu", 1 << i, (2 << i) - 1, (unsigned long)rom_latency_read[i]());
+    }
+}
+
+#else
+
+void perf_reset(void) {}
+void perf_print(bool reset) { (void)reset; }
+
+#endif
@@ -0,0 +1,18 @@
+#pragma once
+#include <stdbool.h>
+#include <generated/csr.h>
+
+// Playback performance counters of the SoC (--with-perf-counters), no-ops without them
+
+#ifdef CSR_PERF_BASE
+// timer interrupt handler bounds, a timer expiry in between counts as late
+static inline void perf_isr_enter(void) { perf_isr_write(1); }
+static inline void perf_isr_exit(void) { perf_isr_write(0); }
+#else
+static inline void perf_isr_enter(void) {}
+static inline void perf_isr_exit(void) {}
+#endif
+
+void perf_reset(void);
+// prints the counters since the last reset, then resets them if reset
+void perf_print(bool reset);
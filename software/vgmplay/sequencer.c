@@ -0,0 +1,34 @@
+#include "sequencer.h"
+#include <generated/csr.h>
+
+#ifdef CSR_VGC_SEQUENCER_BASE
+
+// The hardware sequencer walks the VGC command words by itself, firmware only loads the
+// OKIM6295 ROM blocks and programs where the stream is
+void sequencer_init(struct timer_ctx *ctx) {
+    vgc_sequencer_control_write(0);
+
+    vgc_load_rom_blocks(ctx->vgm_buffer, ctx->vgc_header);
+
+    vgc_sequencer_base_write((uint32_t)(ctx->vgm_buffer + ctx->vgc_header->commands_offset));
+    vgc_sequencer_loop_write(ctx->no_loop ? VGC_NO_LOOP : ctx->vgc_header->loop_index);
+}
+
+void sequencer_enable(void) {
+    vgc_sequencer_control_pause_write(0);
+    vgc_sequencer_control_enable_write(1);
+}
+
+void sequencer_disable(void) {
+    vgc_sequencer_control_pause_write(1);
+}
+
+uint32_t sequencer_current_sample(void) {
+    return vgc_sequencer_sample_read();
+}
+
+bool sequencer_done(void) {
+    return vgc_sequencer_status_done_read();
+}
+
+#endif
@@ -0,0 +1,10 @@
+#pragma once
+#include <stdint.h>
+#include <stdbool.h>
+#include "timer.h"
+
+void sequencer_init(struct timer_ctx *ctx);
+void sequencer_enable(void);
+void sequencer_disable(void);
+uint32_t sequencer_current_sample(void);
+bool sequencer_done(void);
@@ -0,0 +1,245 @@
+#include "stream.h"
+
+#include <stdio.h>
+#include <string.h>
+#ifdef WITH_SDCARD
+#include <liblitesdcard/sdcard.h>
+#include <liblitesdcard/spisdcard.h>
+#endif
+
+#include "msm6295.h"
+#include "vgc.h"
+
+static int find_block(const struct stream *s, uint32_t offset) {
+    for (int i = 0; i < 2; i++) {
+        if (s->block_size[i] && offset - s->block_offset[i] < s->block_size[i]) return i;
+    }
+    return -1;
+}
+
+// Moves the decoder to offset (block aligned), going back from the loop_block snapshot or the start
+static bool inflate_seek(struct stream *s, uint32_t offset) {
+    struct inflate *z = &s->inflate;
+
+    if (offset < z->out_pos) {
+        if (s->loop_saved && s->loop_inflate.out_pos <= offset) {
+            *z = s->loop_inflate;
+        } else {
+            uint32_t size;
+            inflate_gzip_init(z, s->gzip_data, s->gzip_size, &size);
+        }
+    }
+
+    while (1) {
+        if (z->out_pos == s->loop_block && !s->loop_saved) {
+            s->loop_inflate = *z;
+            s->loop_saved = true;
+        }
+        if (z->out_pos >= offset) return true;
+
+        // skip block by block so loop_block is not stepped over
+        uint32_t n = STREAM_BLOCK_SIZE - (z->out_pos & (STREAM_BLOCK_SIZE - 1));
+        if (n > offset - z->out_pos) n = offset - z->out_pos;
+        if (inflate_read(z, 0, n) != n) return false;
+    }
+}
+
+static bool load_block(struct stream *s, int i, uint32_t offset) {
+    uint32_t n = 0;
+
+    // timer0_isr misses this block until it's filled
+    s->block_size[i] = 0;
+    if (s->gzip) {
+        if (!inflate_seek(s, offset)) return false;
+        n = inflate_read(&s->inflate, s->block[i], STREAM_BLOCK_SIZE);
+        if (s->inflate.state == INFLATE_ERROR) return false;
+    }
+#ifdef WITH_SDCARD
+    else {
+        // sector reads are DMAed straight to the (aligned) block when offset is sector aligned
+        UINT read;
+        if (f_lseek(&s->file, offset) != FR_OK || f_read(&s->file, s->block[i], STREAM_BLOCK_SIZE, &read) != FR_OK)
+            return false;
+        n = read;
+    }
+#endif
+    s->block_offset[i] = offset;
+    s->block_size[i] = n;
+    return n > 0;
+}
+
+static void load_rom(struct stream *s) {
+    uint32_t offset = s->rom_offset;
+    uint32_t done = 0;
+
+    // bounce through the blocks: timer0_isr doesn't read the stream while rom_pending is set
+    while (done < s->rom_size) {
+        int i = find_block(s, offset);
+        if (i < 0) {
+            i = 0;
+            if (!load_block(s, i, offset & ~(STREAM_BLOCK_SIZE - 1))) {
+                fprintf(stderr, "\nstream: failed to read OKIM6295 ROM data\n");
+                break;
+            }
+        }
+        uint32_t start = offset - s->block_offset[i];
+        uint32_t n = s->block_size[i] - start;
+        if (n > s->rom_size - done) n = s->rom_size - done;
+        msm6295_chip_write_rom(s->rom_chip, s->rom_start_address + done, s->block[i] + start, n);
+        offset += n;
+        done += n;
+    }
+    msm6295_rom_flush();
+    s->rom_pending = false;
+}
+
+// Reads the VGM header from the source set up in s and buffers the start of the sound data
+static bool open_vgm(struct stream *s, struct vgm_header *vgm_header, bool no_loop) {
+    s->loop_block = STREAM_NO_BLOCK;
+    if (!load_block(s, 0, 0)) {
+        fprintf(stderr, "stream: read error\n");
+        return false;
+    }
+    if (is_vgc(s->block[0], s->block_size[0])) {
+        fprintf(stderr, "stream: VGC files are only played from memory\n");
+        return false;
+    }
+    // the header fits in the first block, size is only checked against eof_offset
+    if (!parse_header(s->block[0], s->size, vgm_header)) return false;
+
+    // sound data ends at the GD3 tag when there's one
+    uint32_t gd3_offset = parse_uint32(s->block[0], s->size, 0x14);
+    s->data_end = gd3_offset ? gd3_offset + 0x14 : vgm_header->eof_offset;
+    if (s->data_end > s->size) s->data_end = s->size;
+
+    // loop offset 0: no loop
+    if (!no_loop && vgm_header->loop_offset != 0x1C)
+        s->loop_block = vgm_header->loop_offset & ~(STREAM_BLOCK_SIZE - 1);
+
+    s->position = vgm_header->vgm_data_offset;
+    stream_fill(s);
+    return true;
+}
+
+bool stream_open_gzip(struct stream *s, const uint8_t *data, uint32_t size, struct vgm_header *vgm_header, bool no_loop) {
+    memset(s, 0, sizeof(*s));
+    s->gzip = true;
+    s->gzip_data = data;
+    s->gzip_size = size;
+    if (!inflate_gzip_init(&s->inflate, data, size, &s->size)) return false;
+    return open_vgm(s, vgm_header, no_loop);
+}
+
+#ifdef WITH_SDCARD
+bool stream_open_sd(struct stream *s, const char *path, struct vgm_header *vgm_header, bool no_loop) {
+#if defined(CSR_SPISDCARD_BASE)
+    fatfs_set_ops_spisdcard();
+#else
+    fatfs_set_ops_sdcard();
+#endif
+    memset(s, 0, sizeof(*s));
+
+    if (f_mount(&s->fs, "", 1) != FR_OK) {
+        fprintf(stderr, "stream: SD card mount failed\n");
+        return false;
+    }
+    if (f_open(&s->file, path, FA_READ) != FR_OK) {
+        fprintf(stderr, "stream: can't open %s\n", path);
+        return false;
+    }
+    s->size = f_size(&s->file);
+    return open_vgm(s, vgm_header, no_loop);
+}
+#endif
+
+void stream_open_ring(struct stream *s) {
+    memset(s, 0, sizeof(*s));
+    s->ring = true;
+    s->data_end = 0xffffffff;
+    s->loop_block = STREAM_NO_BLOCK;
+}
+
+// Bytes that can be appended without overwriting data timer0_isr hasn't read yet
+uint32_t stream_ring_space(const struct stream *s) {
+    return STREAM_RING_SIZE - (s->ring_head - s->position);
+}
+
+// Main loop side: appends whole commands, timer0_isr only sees them once they are all there
+void stream_ring_write(struct stream *s, const uint8_t *data, uint32_t n) {
+    uint32_t head = s->ring_head;
+    for (uint32_t i = 0; i < n; i++) s->ring_data[(head + i) & (STREAM_RING_SIZE - 1)] = data[i];
+    s->ring_head = head + n;
+}
+
+// Main loop side: loads pending ROM data, then the block timer0_isr reads and the one after it
+void stream_fill(struct stream *s) {
+    if (s->ring) return;
+    if (s->rom_pending) load_rom(s);
+
+    uint32_t current = s->position & ~(STREAM_BLOCK_SIZE - 1);
+    uint32_t next = current + STREAM_BLOCK_SIZE;
+    if (next >= s->data_end) next = s->loop_block;
+
+    int i = find_block(s, current);
+    if (i < 0) {
+        i = find_block(s, next) == 0 ? 1 : 0;
+        if (!load_block(s, i, current)) return;
+    }
+    if (next != STREAM_NO_BLOCK && find_block(s, next) < 0) load_block(s, !i, next);
+}
+
+// Main loop side, timer0 disabled: moves the read position, the block holding it is loaded
+// right away
+void stream_seek(struct stream *s, uint32_t offset) {
+    s->position = offset;
+    stream_fill(s);
+}
+
+// timer0_isr side: copies n bytes at offset, bytes past the sound data read as 0x66 (end of
+// sound data). Returns false, without consuming anything, if they're not buffered yet
+bool stream_read(struct stream *s, uint32_t offset, uint8_t *dst, uint32_t n) {
+    s->position = offset;
+    if (s->rom_pending) return false;
+
+    memset(dst, 0x66, n);
+    if (s->ring) {
+        uint32_t head = s->ring_head;
+        if (offset >= head) {
+            s->underruns++;
+            return false;
+        }
+        // the command at offset was received whole
+        if (n > head - offset) n = head - offset;
+        for (uint32_t i = 0; i < n; i++) dst[i] = s->ring_data[(offset + i) & (STREAM_RING_SIZE - 1)];
+        return true;
+    }
+    if (offset >= s->data_end) return true;
+    if (n > s->data_end - offset) n = s->data_end - offset;
+
+    while (n) {
+        int i = find_block(s, offset);
+        if (i < 0) {
+            s->underruns++;
+            return false;
+        }
+        uint32_t start = offset - s->block_offset[i];
+        uint32_t k = s->block_size[i] - start;
+        if (k > n) k = n;
+        memcpy(dst, s->block[i] + start, k);
+        dst += k;
+        offset += k;
+        n -= k;
+    }
+    return true;
+}
+
+// timer0_isr side: the data block is copied to msm6295_rom by the main loop, stream_read
+// returns false until then
+void stream_load_rom(struct stream *s, uint8_t chip, uint32_t rom_start_address, uint32_t offset, uint32_t size) {
+    s->rom_chip = chip;
+    s->rom_start_address = rom_start_address;
+    s->rom_offset = offset;
+    s->rom_size = size;
+    s->position = offset + size;
+    s->rom_pending = true;
+}
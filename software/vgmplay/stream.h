@@ -0,0 +1,71 @@
+#pragma once
+#include <stdint.h>
+#include <stdbool.h>
+#include <generated/csr.h>
+#include "vgm.h"
+#include "inflate.h"
+
+#if defined(CSR_SDCORE_BASE) || defined(CSR_SPISDCARD_BASE)
+#define WITH_SDCARD
+#include <libfatfs/ff.h>
+#endif
+
+// VGM file played through two blocks: the main loop (stream_fill) refills the block timer0_isr is
+// not reading (stream_read). The file is either on the SD card or gzip compressed (.vgz) in
+// memory and inflated on the fly.
+// In ring mode the sound data is received over the UART while playing (uartstream.c) and appended
+// to a ring buffer instead
+
+#define STREAM_BLOCK_SIZE 4096 // power of 2, multiple of the sector size
+#define STREAM_NO_BLOCK 0xffffffff
+#define STREAM_RING_SIZE 16384 // power of 2
+
+struct stream {
+    uint32_t size;        // uncompressed file size
+    uint32_t data_end;    // file offset after the sound data
+    uint32_t loop_block;  // block read after the one holding data_end, STREAM_NO_BLOCK if none
+
+    volatile uint32_t position; // file offset timer0_isr reads at
+    volatile uint32_t block_offset[2];
+    volatile uint32_t block_size[2]; // 0 while the block is being (re)filled
+    uint8_t block[2][STREAM_BLOCK_SIZE] __attribute__((aligned(8)));
+
+    // OKIM6295 ROM data block timer0_isr waits for, loaded by the main loop
+    volatile bool rom_pending;
+    uint8_t rom_chip;
+    uint32_t rom_start_address;
+    uint32_t rom_offset;
+    uint32_t rom_size;
+
+    volatile uint32_t underruns;
+
+    // .vgz: decoder, its state at loop_block to restart the loop from and the compressed file
+    bool gzip;
+    bool loop_saved;
+    struct inflate inflate;
+    struct inflate loop_inflate;
+    const uint8_t *gzip_data;
+    uint32_t gzip_size;
+
+    // ring mode: bytes [0, ring_head) were received, the last STREAM_RING_SIZE are kept
+    bool ring;
+    volatile uint32_t ring_head;
+    uint8_t ring_data[STREAM_RING_SIZE];
+
+#ifdef WITH_SDCARD
+    FATFS fs;
+    FIL file;
+#endif
+};
+
+bool stream_open_gzip(struct stream *s, const uint8_t *data, uint32_t size, struct vgm_header *vgm_header, bool no_loop);
+#ifdef WITH_SDCARD
+bool stream_open_sd(struct stream *s, const char *path, struct vgm_header *vgm_header, bool no_loop);
+#endif
+void stream_open_ring(struct stream *s);
+uint32_t stream_ring_space(const struct stream *s);
+void stream_ring_write(struct stream *s, const uint8_t *data, uint32_t n);
+void stream_seek(struct stream *s, uint32_t offset);
+void stream_fill(struct stream *s);
+bool stream_read(struct stream *s, uint32_t offset, uint8_t *dst, uint32_t n);
+void stream_load_rom(struct stream *s, uint8_t chip, uint32_t rom_start_address, uint32_t offset, uint32_t size);
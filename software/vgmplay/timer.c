@@ -1,14 +1,115 @@
 #include "timer.h"
 #include "ym2151.h"
 #include "msm6295.h"
+#include "chips.h"
+#include "stream.h"
+#include "perf.h"
 #include <irq.h>
 #include <generated/csr.h>
 
+// first song, the one seeking applies to, the others follow through next
 struct timer_ctx *_ctx = 0;
 
+static uint32_t advance(uint32_t elapsed);
+
+#ifdef CSR_SAMPLE_SCHEDULER_BASE
+// Tickless: the sample scheduler interrupts when the next command is due, the whole wait is
+// programmed at once. Waits are counted from the previous deadline, never from the interrupt.
+// Longest wait programmed, the deadline compare wraps past it
+#define SCHEDULER_MAX_WAIT 0x7fffffff
+
+// wait programmed, scheduler sample count at the previous deadline
+static uint32_t scheduled = 0;
+static uint32_t event_sample = 0;
+// song delays changed while disabled: restart the scheduler from them
+static bool reprogram = true;
+
+// control holds the reset pulse next to enable: it's always written whole, a field write would
+// write back the reset bit the storage keeps and clear the deadline again
+#define SCHEDULER_ENABLE (1 << CSR_SAMPLE_SCHEDULER_CONTROL_ENABLE_OFFSET)
+#define SCHEDULER_RESET (1 << CSR_SAMPLE_SCHEDULER_CONTROL_RESET_OFFSET)
+
+static uint32_t next_due(void) {
+    uint32_t next = UINT32_MAX;
+    for (struct timer_ctx *ctx = _ctx; ctx; ctx = ctx->next)
+        if (ctx->delay < next) next = ctx->delay;
+    return next < SCHEDULER_MAX_WAIT ? next : SCHEDULER_MAX_WAIT;
+}
+
+// Scheduler held: moves the songs to its sample count, the deadline isn't reached yet
+static void sync_elapsed(void) {
+    if (reprogram) return;
+    uint32_t elapsed = sample_scheduler_sample_read() - event_sample;
+    for (struct timer_ctx *ctx = _ctx; ctx; ctx = ctx->next) {
+        ctx->current_sample += elapsed;
+        ctx->delay -= elapsed;
+    }
+}
+
+void timer0_init(const uint32_t ticks, struct timer_ctx *ctx)
+{
+    (void)ticks;
+    _ctx = ctx;
+    ctx->delay = 1;
+    ctx->late = 0;
+    ctx->next = 0;
+
+    sample_scheduler_control_write(0);
+    reprogram = true;
+}
+
+void timer0_enable(void) {
+    if (reprogram) {
+        sample_scheduler_control_write(SCHEDULER_RESET);
+        event_sample = 0;
+        scheduled = next_due();
+        sample_scheduler_wait_write(scheduled);
+        reprogram = false;
+    }
+    sample_scheduler_ev_pending_write(sample_scheduler_ev_pending_read());
+    irq_setmask(irq_getmask() | (1 << SAMPLE_SCHEDULER_INTERRUPT));
+    sample_scheduler_ev_enable_write(1);
+    sample_scheduler_control_write(SCHEDULER_ENABLE);
+}
+
+void timer0_disable(void) {
+    // the sample count and the deadline are held, enabling goes on from there
+    sample_scheduler_control_write(0);
+    sample_scheduler_ev_enable_write(0);
+}
+
+void sample_scheduler_isr(void) {
+    sample_scheduler_ev_pending_write(sample_scheduler_ev_pending_read());
+
+    if (_ctx == 0) return;
+
+    perf_isr_enter();
+    event_sample += scheduled;
+    uint32_t next = advance(scheduled);
+    scheduled = next < SCHEDULER_MAX_WAIT ? next : SCHEDULER_MAX_WAIT;
+    sample_scheduler_wait_write(scheduled);
+    perf_isr_exit();
+}
+
+uint32_t timer0_current_sample(const struct timer_ctx *ctx) {
+    if (reprogram) return ctx->current_sample;
+
+    // the interrupt handler moves current_sample and event_sample together
+    unsigned int ie = irq_getie();
+    irq_setie(0);
+    uint32_t sample = ctx->current_sample + (sample_scheduler_sample_read() - event_sample);
+    irq_setie(ie);
+    return sample;
+}
+
+#else
+
 void timer0_init(const uint32_t ticks, struct timer_ctx *ctx)
 {
     _ctx = ctx;
+    ctx->delay = 1;
+    ctx->late = 0;
+    ctx->next = 0;
 
     timer0_en_write(0);
     
@@ -28,109 +129,255 @@ void timer0_disable(void) {
     timer0_en_write(0);
 }
 
+// One interrupt per sample
 void timer0_isr(void) {
-    static uint32_t delay = 0;
-
 	timer0_ev_pending_write(timer0_ev_pending_read());//clear event pending
 
     if (_ctx == 0) return;
 
+    perf_isr_enter();
+    advance(1);
+    perf_isr_exit();
+}
 
-    _ctx->current_sample++;
+uint32_t timer0_current_sample(const struct timer_ctx *ctx) {
+    return ctx->current_sample;
+}
 
-    if (delay == 0) {
-#ifdef CSR_SIM_TRACE_BASE
-        {
-            static bool trace_enabled = false;
-            static uint32_t marker = 0;
+#endif
 
-            if (!trace_enabled) sim_trace_enable_write(1);
-            sim_marker_marker_write(marker++);
-        }
+// Plays ctx at the same time as the songs already set up, on its own chips. Timer disabled
+void timer0_add(struct timer_ctx *ctx)
+{
+    struct timer_ctx **last = &_ctx;
+    while (*last) last = &(*last)->next;
+#ifdef CSR_SAMPLE_SCHEDULER_BASE
+    sync_elapsed();
+    reprogram = true;
 #endif
-        uint8_t cmd = _ctx->vgm_buffer[_ctx->current_offset++];
-        switch (cmd) {
-            // YM2151, write value dd to register aa
-            case 0x54:
-                ym2151_write_cmd(_ctx->vgm_buffer[_ctx->current_offset], _ctx->vgm_buffer[_ctx->current_offset + 1]);
-                _ctx->current_offset += 2;
-                break;
-
-            // Wait n samples, n can range from 0 to 65535 (approx 1.49 seconds)
-            case 0x61:
-                delay = _ctx->vgm_buffer[_ctx->current_offset] | (_ctx->vgm_buffer[_ctx->current_offset + 1] << 8);
-                _ctx->current_offset += 2;
-                break;
-
-            // wait 735 samples (60th of a second)
-            case 0x62:
-                delay = 735;
-                break;
-
-            // wait 882 samples (50th of a second)
-            case 0x63:
-                delay = 882;
-                break;
-
-            // end of sound data
-            case 0x66:
-                _ctx->current_offset = _ctx->vgm_header->loop_offset;
-                break;
-
-            // data block: TODO
-            case 0x67:
-                if (_ctx->vgm_buffer[_ctx->current_offset++] == 0x66) {
-                    uint8_t type = _ctx->vgm_buffer[_ctx->current_offset++];
-                    uint32_t size = parse_uint32(_ctx->vgm_buffer, _ctx->vgm_buffer_size, _ctx->current_offset);
-                    _ctx->current_offset += 4;
-                    
-                    if (type == 0x8B) {//8B = OKIM6295 ROM data
-                        uint32_t data_block_offset = _ctx->current_offset;
-
-                        uint32_t rom_size = parse_uint32(_ctx->vgm_buffer, _ctx->vgm_buffer_size, data_block_offset);
-                        (void)rom_size;
-                        data_block_offset += 4;
-                        uint32_t rom_start_address = parse_uint32(_ctx->vgm_buffer, _ctx->vgm_buffer_size, data_block_offset);
-                        data_block_offset += 4;
-                        size_t rom_block_size = size - 8;
-                        msm6295_write_rom(rom_start_address, _ctx->vgm_buffer + data_block_offset, rom_block_size);
-                    }
-
-                    _ctx->current_offset += size;
-                }
-                break;
-
-            case 0x70:
-            case 0x71:
-            case 0x72:
-            case 0x73:
-            case 0x74:
-            case 0x75:
-            case 0x76:
-            case 0x77:
-            case 0x78:
-            case 0x79:
-            case 0x7a:
-            case 0x7b:
-            case 0x7c:
-            case 0x7d:
-            case 0x7e:
-            case 0x7f:
-                delay = (cmd & 15) + 1;
-                break;
-
-            // aa dd: OKIM6295, write value dd to register aa
-            case 0xb8:
-                msm6295_write_cmd(_ctx->vgm_buffer[_ctx->current_offset], _ctx->vgm_buffer[_ctx->current_offset + 1]);
-                _ctx->current_offset += 2;
-                break;
-
-            default:
-                break;
-        }
+    *last = ctx;
+    ctx->delay = 1;
+    ctx->late = 0;
+    ctx->next = 0;
+}
 
+static void load_rom_block(struct timer_ctx *ctx, uint8_t chip, uint32_t rom_start_address,
+                           uint32_t offset, size_t size) {
+    // streamed data blocks are loaded by the main loop, the stream waits for them
+    if (ctx->stream) {
+        stream_load_rom(ctx->stream, chip, rom_start_address, offset, size);
         return;
     }
+    msm6295_chip_write_rom(chip, rom_start_address, ctx->vgm_buffer + offset, size);
+}
+
+// ROM data block command at offset, copied right away (main loop side)
+static void reload_rom_block(uint32_t offset) {
+    const uint8_t *p = _ctx->vgm_buffer + offset;
+    size_t p_size = _ctx->vgm_buffer_size - offset;
+    uint8_t window[VGM_CMD_MAX_SIZE];
+    if (_ctx->stream) {
+        stream_seek(_ctx->stream, offset);
+        if (!stream_read(_ctx->stream, offset, window, sizeof(window))) return;
+        p = window;
+        p_size = sizeof(window);
+    }
+
+    // bit 31 of the size: second chip data
+    uint32_t size = parse_uint32(p, p_size, 3);
+    load_rom_block(_ctx, _ctx->chip + (size >> 31), parse_uint32(p, p_size, 11), offset + 15,
+                   (size & 0x7fffffff) - 8);
+    if (_ctx->stream) stream_fill(_ctx->stream);
+}
+
+// Main loop side, timer0 disabled: jumps to the seek index entry of sample, the ROM data blocks
+// still live at it are copied again and its chip state restored. False without a seek index
+bool timer0_seek(uint32_t sample) {
+    if (_ctx == 0 || _ctx->vgi_header == 0) return false;
+#ifdef CSR_SAMPLE_SCHEDULER_BASE
+    sync_elapsed();
+    reprogram = true;
+#endif
+
+    const struct vgi_entry *entry = vgi_find(_ctx->vgi_data, _ctx->vgi_header, sample);
+    for (uint32_t i = 0; i < entry->n_rom_blocks; i++)
+        reload_rom_block(vgi_rom_block(_ctx->vgi_data, _ctx->vgi_header, entry->rom_blocks + i));
+    msm6295_rom_flush();
+    for (uint32_t i = 0; i < _ctx->vgi_header->n_chips; i++) {
+        const struct vgi_chip *chip = &entry->chips[i];
+        msm6295_restore(_ctx->chip + i, chip->msm6295_phrase, chip->msm6295_attenuation, chip->msm6295_latch);
+        ym2151_restore(_ctx->chip + i, chip->ym2151_regs, chip->ym2151_key, chip->ym2151_pmd);
+    }
+
+    _ctx->current_offset = entry->offset;
+    _ctx->current_sample = entry->sample;
+    _ctx->finished = false;
+    _ctx->delay = 1;
+    _ctx->late = 0;
+    if (_ctx->stream) stream_seek(_ctx->stream, entry->offset);
+    return true;
+}
+
+// Runs the command at current_offset of ctx, returns the samples until the next one is due: a
+// command takes a sample, then its wait. UINT32_MAX once the song has ended
+static uint32_t play_command(struct timer_ctx *ctx) {
+    if (ctx->vgc_header) {
+        // next command is due in wait samples, this one included
+        uint32_t wait = vgc_play(ctx);
+        return wait ? wait : UINT32_MAX;
+    }
+
+    // p: bytes at current_offset, a copy of the next VGM_CMD_MAX_SIZE when streaming
+    const uint8_t *p = ctx->vgm_buffer + ctx->current_offset;
+    size_t p_size = ctx->vgm_buffer_size - ctx->current_offset;
+    uint8_t window[VGM_CMD_MAX_SIZE];
+    if (ctx->stream) {
+        // not buffered yet: retry on the next sample
+        if (!stream_read(ctx->stream, ctx->current_offset, window, sizeof(window))) return 1;
+        p = window;
+        p_size = sizeof(window);
+    }
+
+    uint8_t cmd = p[0];
+#ifdef CSR_JT51_CMD_ADDR
+    // YM2151 command FIFO full: retry on the next sample, off the song clock
+    if ((cmd == 0x54 || cmd == 0xa4) && ym2151_cmd_space(ctx->chip + (cmd == 0xa4)) == 0) {
+        ctx->late++;
+        return 1;
+    }
+#endif
+    uint32_t wait = 0;
+    ctx->current_offset++;
+    switch (cmd) {
+        // YM2151, write value dd to register aa
+        case 0x54:
+            ym2151_chip_write_cmd(ctx->chip, p[1], p[2]);
+            ctx->current_offset += 2;
+            break;
+
+        // Wait n samples, n can range from 0 to 65535 (approx 1.49 seconds)
+        case 0x61:
+            wait = p[1] | (p[2] << 8);
+            ctx->current_offset += 2;
+            break;
+
+        // wait 735 samples (60th of a second)
+        case 0x62:
+            wait = 735;
+            break;
+
+        // wait 882 samples (50th of a second)
+        case 0x63:
+            wait = 882;
+            break;
+
+        // end of sound data
+        case 0x66:
+            if (ctx->no_loop) {
+                ctx->current_offset--;
+                ctx->finished = true;
+                return UINT32_MAX;
+            }
+            ctx->current_offset = ctx->vgm_header->loop_offset;
+            // every pass starts from the state the first one had at the loop point
+            if (ctx->vgi_header) {
+                const struct vgi_entry *entry = vgi_loop_entry(ctx->vgi_data, ctx->vgi_header);
+                for (uint32_t i = 0; entry && i < ctx->vgi_header->n_chips; i++) {
+                    const struct vgi_chip *chip = &entry->chips[i];
+                    ym2151_restore(ctx->chip + i, chip->ym2151_regs, chip->ym2151_key, chip->ym2151_pmd);
+                }
+            }
+            break;
+
+        // data block
+        case 0x67:
+            ctx->current_offset++;
+            if (p[1] == 0x66) {
+                uint8_t type = p[2];
+                uint32_t size = parse_uint32(p, p_size, 3);
+                // bit 31 of the size: second chip data
+                uint8_t chip = ctx->chip + (size >> 31);
+                size &= 0x7fffffff;
+                ctx->current_offset += 5;
+                
+                if (type == 0x8B) {//8B = OKIM6295 ROM data
+                    uint32_t rom_size = parse_uint32(p, p_size, 7);
+                    (void)rom_size;
+                    uint32_t rom_start_address = parse_uint32(p, p_size, 11);
+                    uint32_t data_block_offset = ctx->current_offset + 8;
+                    size_t rom_block_size = size - 8;
+                    load_rom_block(ctx, chip, rom_start_address, data_block_offset, rom_block_size);
+                }
+
+                ctx->current_offset += size;
+            }
+            break;
+
+        case 0x70:
+        case 0x71:
+        case 0x72:
+        case 0x73:
+        case 0x74:
+        case 0x75:
+        case 0x76:
+        case 0x77:
+        case 0x78:
+        case 0x79:
+        case 0x7a:
+        case 0x7b:
+        case 0x7c:
+        case 0x7d:
+        case 0x7e:
+        case 0x7f:
+            wait = (cmd & 15) + 1;
+            break;
+
+        // YM2151 second chip, write value dd to register aa
+        case 0xa4:
+            ym2151_chip_write_cmd(ctx->chip + 1, p[1], p[2]);
+            ctx->current_offset += 2;
+            break;
+
+        // aa dd: OKIM6295, write value dd to register aa (second chip if aa bit 7 is set)
+        case 0xb8:
+            msm6295_chip_write_cmd(ctx->chip + (p[1] >> 7), p[1] & 0x7f, p[2]);
+            ctx->current_offset += 2;
+            break;
+
+        default:
+            break;
+    }
+
+    return 1 + wait;
+}
+
+// Moves every song elapsed samples forward, running the commands falling due. Returns the
+// samples until the next one
+static uint32_t advance(uint32_t elapsed) {
+    uint32_t next = UINT32_MAX;
+    for (struct timer_ctx *ctx = _ctx; ctx; ctx = ctx->next) {
+        ctx->current_sample += elapsed;
+        ctx->delay -= elapsed;
+        if (ctx->delay == 0) {
+#ifdef CSR_SIM_TRACE_BASE
+            // one marker per command of the first song
+            if (ctx == _ctx) {
+                static bool trace_enabled = false;
+                static uint32_t marker = 0;
 
-    delay--;
-}
\ No newline at end of file
+                if (!trace_enabled) sim_trace_enable_write(1);
+                sim_marker_marker_write(marker++);
+            }
+#endif
+            ctx->delay = play_command(ctx);
+            // commands put off are caught up on the waits, the song doesn't fall behind
+            if (ctx->late && ctx->delay != UINT32_MAX) {
+                uint32_t catch_up = ctx->late < ctx->delay - 1 ? ctx->late : ctx->delay - 1;
+                ctx->delay -= catch_up;
+                ctx->late -= catch_up;
+            }
+        }
+        if (ctx->delay < next) next = ctx->delay;
+    }
+    return next;
+}
@@ -2,16 +2,38 @@
 #include <stdint.h>
 #include <stddef.h>
 #include "vgm.h"
+#include "vgc.h"
+#include "vgi.h"
+
+struct stream;
 
 struct timer_ctx {
     uint32_t current_sample;
     uint32_t current_offset;
     const struct vgm_header *vgm_header;
+    const struct vgc_header *vgc_header; // set when playing a pre-compiled VGC stream
+    bool no_loop; // stop at the end of sound data instead of looping
+    bool finished;
     const uint8_t *vgm_buffer;
     const size_t vgm_buffer_size;
+    struct stream *stream; // set when the VGM file is streamed (vgm_buffer unused), see stream.h
+    const uint8_t *vgi_data; // seek index of the VGM file, 0 if none
+    const struct vgi_header *vgi_header;
+    uint8_t chip; // chip pair the song plays on (see chips.h), dual chip songs use the next one too
+    uint32_t delay; // samples until the next command is due
+    uint32_t late; // samples commands were put off by a full YM2151 FIFO, taken off the next waits
+    struct timer_ctx *next; // next song played at the same time, see timer0_add
 };
 
+// Plays the songs with timer0 interrupting every ticks cycles (one VGM sample, truncated), or with
+// the sample scheduler when the SoC has one (--with-sample-scheduler): exact sample rate, one
+// interrupt per command, ticks unused
 void timer0_isr(void);
+void sample_scheduler_isr(void);
 void timer0_init(const uint32_t ticks, struct timer_ctx *ctx);
+void timer0_add(struct timer_ctx *ctx);
 void timer0_enable(void);
-void timer0_disable(void);
\ No newline at end of file
+void timer0_disable(void);
+bool timer0_seek(uint32_t sample);
+// samples played by ctx, the current wait included
+uint32_t timer0_current_sample(const struct timer_ctx *ctx);
\ No newline at end of file
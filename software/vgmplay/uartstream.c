@@ -0,0 +1,151 @@
+#include "uartstream.h"
+
+#include <string.h>
+#include <libbase/uart.h>
+
+#include "msm6295.h"
+
+#define STATE_SYNC0 0
+#define STATE_SYNC1 1
+#define STATE_TYPE 2
+#define STATE_LENGTH_LO 3
+#define STATE_LENGTH_HI 4
+#define STATE_PAYLOAD 5
+#define STATE_CHECK_LO 6
+#define STATE_CHECK_HI 7
+
+static inline void fletcher16(uint16_t *sum1, uint16_t *sum2, uint8_t value) {
+    *sum1 += value;
+    if (*sum1 >= 255) *sum1 -= 255;
+    *sum2 += *sum1;
+    if (*sum2 >= 255) *sum2 -= 255;
+}
+
+static uint32_t payload_uint32(const struct uartstream *u, uint32_t offset) {
+    const uint8_t *p = u->payload + offset;
+    return p[0] | (p[1] << 8) | (p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+// Applies a valid frame, false if it has to be dropped
+static bool apply(struct uartstream *u, struct stream *s) {
+    switch (u->type) {
+        case UARTSTREAM_ROM:
+            if (u->length < 4) return false;
+            // bit 31 of the address: second chip ROM
+            msm6295_chip_write_rom(payload_uint32(u, 0) >> 31, payload_uint32(u, 0) & 0x7fffffff,
+                                   u->payload + 4, u->length - 4);
+            msm6295_rom_flush();
+            u->rom_frames++;
+            return true;
+
+        case UARTSTREAM_DATA: {
+            if (u->length < 4) return false;
+            // resent or out of credit: ignored, not an error
+            uint32_t n = u->length - 4;
+            if (payload_uint32(u, 0) != s->ring_head || n > stream_ring_space(s)) return false;
+            stream_ring_write(s, u->payload + 4, n);
+            return true;
+        }
+
+        default:
+            return true;
+    }
+}
+
+void uartstream_init(struct uartstream *u) {
+    memset(u, 0, sizeof(*u));
+}
+
+// Parses the received bytes, true when a frame ended: u->type is then the type of the frame (data
+// and ROM frames are already applied), 0 if it was dropped
+bool uartstream_poll(struct uartstream *u, struct stream *s) {
+    while (uart_read_nonblock()) {
+        uint8_t value = uart_read();
+
+        switch (u->state) {
+            case STATE_SYNC0:
+                if (value == UARTSTREAM_SYNC0) u->state = STATE_SYNC1;
+                break;
+
+            case STATE_SYNC1:
+                if (value == UARTSTREAM_SYNC1)
+                    u->state = STATE_TYPE;
+                else if (value != UARTSTREAM_SYNC0)
+                    u->state = STATE_SYNC0;
+                break;
+
+            case STATE_TYPE:
+                u->type = value;
+                u->sum1 = 0;
+                u->sum2 = 0;
+                fletcher16(&u->sum1, &u->sum2, value);
+                u->state = STATE_LENGTH_LO;
+                break;
+
+            case STATE_LENGTH_LO:
+                u->length = value;
+                fletcher16(&u->sum1, &u->sum2, value);
+                u->state = STATE_LENGTH_HI;
+                break;
+
+            case STATE_LENGTH_HI:
+                u->length |= value << 8;
+                fletcher16(&u->sum1, &u->sum2, value);
+                u->count = 0;
+                if (u->length > UARTSTREAM_MAX_PAYLOAD) {
+                    u->errors++;
+                    u->type = 0;
+                    u->state = STATE_SYNC0;
+                    return true;
+                }
+                u->state = u->length ? STATE_PAYLOAD : STATE_CHECK_LO;
+                break;
+
+            case STATE_PAYLOAD:
+                u->payload[u->count++] = value;
+                fletcher16(&u->sum1, &u->sum2, value);
+                if (u->count == u->length) u->state = STATE_CHECK_LO;
+                break;
+
+            case STATE_CHECK_LO:
+                u->check = value;
+                u->state = STATE_CHECK_HI;
+                break;
+
+            case STATE_CHECK_HI:
+                u->state = STATE_SYNC0;
+                if (u->check != u->sum1 || value != u->sum2) {
+                    u->errors++;
+                    u->type = 0;
+                } else if (!apply(u, s)) {
+                    u->type = 0;
+                }
+                return true;
+        }
+    }
+
+    return false;
+}
+
+static void send(uint8_t value, uint16_t *sum1, uint16_t *sum2) {
+    uart_write(value);
+    fletcher16(sum1, sum2, value);
+}
+
+// Status frame: position, ring head, ring size, underruns, current sample, errors, flags, ROM frames
+void uartstream_send_status(struct uartstream *u, const struct stream *s, uint32_t current_sample, uint32_t flags) {
+    const uint32_t values[] = {s->position, s->ring_head, STREAM_RING_SIZE, s->underruns, current_sample,
+                               u->errors, flags, u->rom_frames};
+    uint16_t sum1 = 0, sum2 = 0;
+
+    uart_write(UARTSTREAM_SYNC0);
+    uart_write(UARTSTREAM_SYNC1);
+    send(UARTSTREAM_STATUS, &sum1, &sum2);
+    send(sizeof(values), &sum1, &sum2);
+    send(0, &sum1, &sum2);
+    for (uint32_t i = 0; i < sizeof(values) / sizeof(values[0]); i++) {
+        for (int shift = 0; shift < 32; shift += 8) send(values[i] >> shift, &sum1, &sum2);
+    }
+    uart_write(sum1);
+    uart_write(sum2);
+}
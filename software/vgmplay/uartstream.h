@@ -0,0 +1,55 @@
+#pragma once
+#include <stdint.h>
+#include <stdbool.h>
+#include "stream.h"
+
+// Framed protocol vgmtools/uartstream.py sends a song with while it plays (UART_STREAM builds):
+//
+//   0xa5 0x5a type length(16) payload fletcher16(type, length, payload)
+//
+// Host to device frames:
+//   'H' hello: stop and reset the player, the next sound data is at offset 0
+//   'R' OKIM6295 ROM data: ROM address(32, bit 31 set for the second chip), data
+//   'D' sound data: offset(32), whole commands. Dropped unless offset is the ring head and the
+//       commands fit: the host keeps offset + size <= position + ring size (its credit)
+//   'P' play, 'S' stop
+// The device answers every frame with a status frame ('I'), an empty 'D' frame only asks for it.
+// ROM frames aren't covered by the ring head: the host sends them one at a time, again until the
+// status count of applied ROM frames goes up.
+// Status frames are also sent every UARTSTREAM_STATUS_SAMPLES while playing. Integers are little
+// endian, bytes outside frames are console output.
+
+#define UARTSTREAM_SYNC0 0xa5
+#define UARTSTREAM_SYNC1 0x5a
+#define UARTSTREAM_MAX_PAYLOAD (4 + 1024)
+
+#define UARTSTREAM_HELLO 'H'
+#define UARTSTREAM_ROM 'R'
+#define UARTSTREAM_DATA 'D'
+#define UARTSTREAM_PLAY 'P'
+#define UARTSTREAM_STOP 'S'
+#define UARTSTREAM_STATUS 'I'
+
+#define UARTSTREAM_STATUS_SAMPLES 4410 // 100ms
+
+// status flags
+#define UARTSTREAM_PLAYING 0x1
+#define UARTSTREAM_FINISHED 0x2
+
+struct uartstream {
+    uint8_t state;
+    uint8_t type;    // type of the last frame, 0 if it was dropped
+    uint16_t length;
+    uint16_t count;
+    uint16_t sum1;
+    uint16_t sum2;
+    uint8_t check;
+    uint8_t payload[UARTSTREAM_MAX_PAYLOAD];
+
+    uint32_t errors; // frames dropped on bad checksums or lengths: the host sends again from the head
+    uint32_t rom_frames; // ROM frames applied
+};
+
+void uartstream_init(struct uartstream *u);
+bool uartstream_poll(struct uartstream *u, struct stream *s);
+void uartstream_send_status(struct uartstream *u, const struct stream *s, uint32_t current_sample, uint32_t flags);
@@ -0,0 +1,90 @@
+#include "vgc.h"
+#include "timer.h"
+#include "ym2151.h"
+#include "msm6295.h"
+#include <stdio.h>
+
+bool is_vgc(const uint8_t *data, const size_t data_size) {
+    return data_size >= sizeof(struct vgc_header) && data[0] == 'V' && data[1] == 'g' &&
+           data[2] == 'c' && data[3] == ' ';
+}
+
+bool parse_vgc_header(const uint8_t *data, const size_t data_size, struct vgc_header *vgc_header) {
+    if (!is_vgc(data, data_size) || ((uintptr_t)data & 3)) {
+        fprintf(stderr, "Invalid VGC file\n");
+        return false;
+    }
+
+    *vgc_header = *(const struct vgc_header *)data;
+
+    if (vgc_header->commands_offset + 4 * vgc_header->n_commands > data_size ||
+        vgc_header->blocks_offset + sizeof(struct vgc_block) * vgc_header->n_blocks > data_size) {
+        fprintf(stderr, "Total size for file is too small; file may be truncated\n");
+        return false;
+    }
+
+    return true;
+}
+
+// Copies every OKIM6295 ROM block up front, for players that skip VGC_CONTROL_ROM commands
+void vgc_load_rom_blocks(const uint8_t *data, const struct vgc_header *vgc_header) {
+    const struct vgc_block *blocks = (const struct vgc_block *)(data + vgc_header->blocks_offset);
+
+    for (uint32_t i = 0; i < vgc_header->n_blocks; i++)
+        msm6295_write_rom(blocks[i].rom_start_address, data + blocks[i].offset, blocks[i].size);
+    msm6295_rom_flush();
+}
+
+// Runs every command due at the current sample, returns the number of samples until the next
+// one or 0 when the song has ended
+uint32_t vgc_play(struct timer_ctx *ctx) {
+    const struct vgc_header *header = ctx->vgc_header;
+    const uint32_t *commands = (const uint32_t *)(ctx->vgm_buffer + header->commands_offset);
+
+    while (1) {
+        uint32_t cmd = commands[ctx->current_offset++];
+        uint32_t wait = (cmd >> 16) & 0x3fff;
+
+        switch (cmd >> 30) {
+            case VGC_OP_WAIT:
+                return cmd & 0x3fffffff;
+
+            case VGC_OP_YM2151:
+#ifdef CSR_JT51_CMD_ADDR
+                // command FIFO full: retry on the next sample, off the song clock (see advance)
+                if (ym2151_cmd_space(ctx->chip) == 0) {
+                    ctx->current_offset--;
+                    ctx->late++;
+                    return 1;
+                }
+#endif
+                ym2151_chip_write_cmd(ctx->chip, (cmd >> 8) & 0xff, cmd & 0xff);
+                if (wait) return wait;
+                break;
+
+            case VGC_OP_OKIM6295:
+                msm6295_chip_write_cmd(ctx->chip, (cmd >> 8) & 0xff, cmd & 0xff);
+                if (wait) return wait;
+                break;
+
+            default:
+                if (((cmd >> 24) & 0x3f) == VGC_CONTROL_ROM) {
+                    const struct vgc_block *block =
+                        (const struct vgc_block *)(ctx->vgm_buffer + header->blocks_offset) +
+                        (cmd & 0xffffff);
+                    msm6295_chip_write_rom(ctx->chip, block->rom_start_address,
+                                           ctx->vgm_buffer + block->offset, block->size);
+                    break;
+                }
+
+                // end of sound data
+                if (header->loop_index == VGC_NO_LOOP || ctx->no_loop) {
+                    ctx->current_offset--;
+                    ctx->finished = true;
+                    return 0;
+                }
+                ctx->current_offset = header->loop_index;
+                break;
+        }
+    }
+}
@@ -0,0 +1,44 @@
+#pragma once
+#include <stdint.h>
+#include <stddef.h>
+#include <stdbool.h>
+
+// Pre-compiled VGM command stream, see vgmtools/vgc.py for the format
+
+#define VGC_NO_LOOP 0xffffffff
+
+#define VGC_OP_WAIT 0
+#define VGC_OP_YM2151 1
+#define VGC_OP_OKIM6295 2
+#define VGC_OP_CONTROL 3
+
+#define VGC_CONTROL_END 0
+#define VGC_CONTROL_ROM 1
+
+struct vgc_header {
+    uint32_t magic;
+    uint32_t version;
+    uint32_t n_samples;
+    uint32_t loop_n_samples;
+    uint32_t loop_index;
+    uint32_t commands_offset;
+    uint32_t n_commands;
+    uint32_t blocks_offset;
+    uint32_t n_blocks;
+    uint32_t ym2151_clock;
+    uint32_t okim6295_clock;
+    uint32_t reserved;
+};
+
+struct vgc_block {
+    uint32_t rom_start_address;
+    uint32_t size;
+    uint32_t offset;
+};
+
+struct timer_ctx;
+
+bool is_vgc(const uint8_t *data, const size_t data_size);
+bool parse_vgc_header(const uint8_t *data, const size_t data_size, struct vgc_header *vgc_header);
+uint32_t vgc_play(struct timer_ctx *ctx);
+void vgc_load_rom_blocks(const uint8_t *data, const struct vgc_header *vgc_header);
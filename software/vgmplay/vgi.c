@@ -0,0 +1,69 @@
+#include "vgi.h"
+#include <stdio.h>
+
+static size_t entry_size(const struct vgi_header *vgi_header) {
+    return sizeof(struct vgi_entry) + vgi_header->n_chips * sizeof(struct vgi_chip);
+}
+
+static const struct vgi_entry *entry(const uint8_t *data, const struct vgi_header *vgi_header, uint32_t i) {
+    return (const struct vgi_entry *)(data + vgi_header->entries_offset + i * entry_size(vgi_header));
+}
+
+static bool is_vgi(const uint8_t *data, const size_t data_size) {
+    return data_size >= sizeof(struct vgi_header) && data[0] == 'V' && data[1] == 'g' &&
+           data[2] == 'i' && data[3] == ' ';
+}
+
+// eof_offset: the song's, an index built for another song is rejected
+bool parse_vgi_header(const uint8_t *data, const size_t data_size, uint32_t eof_offset, struct vgi_header *vgi_header) {
+    if (!is_vgi(data, data_size) || ((uintptr_t)data & 3)) {
+        fprintf(stderr, "Invalid VGI file\n");
+        return false;
+    }
+
+    *vgi_header = *(const struct vgi_header *)data;
+    if (vgi_header->version != VGI_VERSION || vgi_header->n_chips < 1 || vgi_header->n_chips > 2) {
+        fprintf(stderr, "Unsupported VGI version, build the index again\n");
+        return false;
+    }
+
+    uint32_t n_entries = vgi_header->n_entries + (vgi_header->loop_entry != VGI_NO_LOOP);
+    if (vgi_header->n_entries == 0 || vgi_header->interval == 0 ||
+        vgi_header->blocks_offset + 4 * vgi_header->n_blocks > data_size ||
+        vgi_header->entries_offset + entry_size(vgi_header) * n_entries > data_size) {
+        fprintf(stderr, "Total size for file is too small; file may be truncated\n");
+        return false;
+    }
+    for (uint32_t i = 0; i < n_entries; i++) {
+        const struct vgi_entry *e = entry(data, vgi_header, i);
+        if (e->rom_blocks > vgi_header->n_blocks || e->n_rom_blocks > vgi_header->n_blocks - e->rom_blocks) {
+            fprintf(stderr, "Invalid VGI file\n");
+            return false;
+        }
+    }
+    if (vgi_header->eof_offset != eof_offset) {
+        fprintf(stderr, "Seek index built for another song\n");
+        return false;
+    }
+
+    return true;
+}
+
+// Entry of the interval sample falls in, the last one past the end of the song
+const struct vgi_entry *vgi_find(const uint8_t *data, const struct vgi_header *vgi_header, uint32_t sample) {
+    uint32_t i = sample / vgi_header->interval;
+
+    if (i >= vgi_header->n_entries) i = vgi_header->n_entries - 1;
+    return entry(data, vgi_header, i);
+}
+
+// Snapshot taken at the loop point, 0 if the song doesn't loop
+const struct vgi_entry *vgi_loop_entry(const uint8_t *data, const struct vgi_header *vgi_header) {
+    if (vgi_header->loop_entry == VGI_NO_LOOP) return 0;
+    return entry(data, vgi_header, vgi_header->loop_entry);
+}
+
+// VGM offset of the OKIM6295 ROM data block command at index i of the ROM block table
+uint32_t vgi_rom_block(const uint8_t *data, const struct vgi_header *vgi_header, uint32_t i) {
+    return ((const uint32_t *)(data + vgi_header->blocks_offset))[i];
+}
@@ -0,0 +1,47 @@
+#pragma once
+#include <stdint.h>
+#include <stddef.h>
+#include <stdbool.h>
+
+// Seek index of a VGM song, see vgmtools/vgi.py for the format
+
+#define VGI_VERSION 0x300
+#define VGI_NO_LOOP 0xffffffff
+
+struct vgi_header {
+    uint32_t magic;
+    uint32_t version;
+    uint32_t interval;
+    uint32_t n_entries;
+    uint32_t loop_entry;
+    uint32_t blocks_offset;
+    uint32_t n_blocks;
+    uint32_t entries_offset;
+    uint32_t eof_offset;
+    uint32_t n_chips;
+    uint32_t reserved[2];
+};
+
+// state of a chip pair
+struct vgi_chip {
+    uint8_t msm6295_latch;
+    uint8_t msm6295_phrase[4];
+    uint8_t msm6295_attenuation[4];
+    uint8_t ym2151_pmd;
+    uint8_t ym2151_key[8];
+    uint8_t reserved[2];
+    uint8_t ym2151_regs[256];
+};
+
+struct vgi_entry {
+    uint32_t sample;
+    uint32_t offset;
+    uint32_t rom_blocks; // first ROM block table index of the ROM data blocks live at the entry
+    uint32_t n_rom_blocks;
+    struct vgi_chip chips[]; // n_chips
+};
+
+bool parse_vgi_header(const uint8_t *data, const size_t data_size, uint32_t eof_offset, struct vgi_header *vgi_header);
+const struct vgi_entry *vgi_find(const uint8_t *data, const struct vgi_header *vgi_header, uint32_t sample);
+const struct vgi_entry *vgi_loop_entry(const uint8_t *data, const struct vgi_header *vgi_header);
+uint32_t vgi_rom_block(const uint8_t *data, const struct vgi_header *vgi_header, uint32_t i);
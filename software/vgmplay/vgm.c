@@ -39,21 +39,21 @@ bool parse_header(const uint8_t *vgm_data, const size_t vgm_data_size, struct vg
     // uint32_t gd3_offset = parse_uint32(vgm_data, vgm_data_size, 0x14) + 0x14;
     
     // 0x18: Total # samples (32 bits)
-    vgm_header->loop_n_samples = parse_uint32(vgm_data, vgm_data_size, 0x18);
+    vgm_header->n_samples = parse_uint32(vgm_data, vgm_data_size, 0x18);
 
     // 0x1C: Loop offset (32 bits)
     vgm_header->loop_offset = parse_uint32(vgm_data, vgm_data_size, 0x1C) + 0x1C;
 
-    // 0x30: YM2151/YM2164 clock (32 bits)
-    if (version >= 0x110 && parse_uint32(vgm_data, vgm_data_size, 0x30) == 0) {
+    // 0x20: Loop # samples (32 bits)
+    vgm_header->loop_n_samples = parse_uint32(vgm_data, vgm_data_size, 0x20);
+
+    // 0x30: YM2151/YM2164 clock (32 bits), bit 30 set for a dual chip song
+    uint32_t ym2151_clock = parse_uint32(vgm_data, vgm_data_size, 0x30);
+    if (version >= 0x110 && ym2151_clock == 0) {
         fprintf(stderr, "Warning: vgm file doesn't have YM2151. Nothing to play here...\n");
         return false;
     }
-
-    //TODO: parse 0x98: OKIM6295 clock (32 bits)
-        // Input clock rate in Hz for the OKIM6295 chip. A typical value is
-        // 8000000. It should be 0 if there is no OKIM6295 chip used.
-        // Set bit 31 (0x80000000) to denote the status of pin 7.
+    vgm_header->dual_chip = version >= 0x110 && (ym2151_clock & 0x40000000);
 
     // 0x34: VGM data offset (32 bits)
     vgm_header->vgm_data_offset = parse_uint32(vgm_data, vgm_data_size, 0x34) + 0x34;
@@ -61,5 +61,13 @@ bool parse_header(const uint8_t *vgm_data, const size_t vgm_data_size, struct vg
         vgm_header->vgm_data_offset = 0x40;
     }
 
+    // 0x98: OKIM6295 clock (32 bits)
+        // Input clock rate in Hz for the OKIM6295 chip. A typical value is
+        // 8000000. It should be 0 if there is no OKIM6295 chip used.
+        // Set bit 31 (0x80000000) to denote the status of pin 7, bit 30 for a dual chip song.
+    if (version >= 0x161 && vgm_header->vgm_data_offset >= 0x9c &&
+        (parse_uint32(vgm_data, vgm_data_size, 0x98) & 0x40000000))
+        vgm_header->dual_chip = true;
+
     return true;
 }
\ No newline at end of file
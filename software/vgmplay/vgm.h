@@ -4,6 +4,8 @@
 #include <stdbool.h>
 
 #define VGM_SAMPLE_RATE 44100
+// longest command timer0_isr decodes: data block header and OKIM6295 ROM block header
+#define VGM_CMD_MAX_SIZE 16
 
 
 struct vgm_header {
@@ -12,6 +14,7 @@ struct vgm_header {
     uint32_t loop_n_samples;
     uint32_t loop_offset;
     uint32_t vgm_data_offset;
+    bool dual_chip; // second YM2151/OKIM6295 commands (0xa4, 0xb8 with aa bit 7 set) are used
 };
 
 uint32_t parse_uint32(const uint8_t *buffer, const size_t buffer_size, const size_t offset);
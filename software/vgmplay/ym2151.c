@@ -1,11 +1,145 @@
 #include "ym2151.h"
+#include "chips.h"
 #include <generated/csr.h>
+#include <generated/soc.h>
+
+#if CPS1_N_CHIPS > 1
+// CSR banks of the other chips, written through their register write FIFO
+static const unsigned long jt51_base[CPS1_N_CHIPS] = {
+    CSR_JT51_BASE,
+    CSR_JT51_1_BASE,
+#if CPS1_N_CHIPS > 2
+    CSR_JT51_2_BASE,
+#endif
+#if CPS1_N_CHIPS > 3
+    CSR_JT51_3_BASE,
+#endif
+};
+
+#define JT51_CSR(chip, csr_addr) CHIP_CSR_ADDR(jt51_base[chip], CSR_JT51_BASE, csr_addr)
+#endif
+
+// register shadow of each chip for ym2151_restore: 0x19 holds AMD, PMD (bit 7 set) is kept
+// apart, key holds the last key on/off write of each channel
+static uint8_t regs[CPS1_N_CHIPS][256];
+static uint8_t pmd[CPS1_N_CHIPS];
+static uint8_t key[CPS1_N_CHIPS][8];
+
+static inline void shadow(uint8_t chip, uint8_t addr, uint8_t data) {
+    if (addr == 0x08)
+        key[chip][data & 7] = data;
+    else if (addr == 0x19 && (data & 0x80))
+        pmd[chip] = data;
+    else
+        regs[chip][addr] = data;
+}
 
 void ym2151_init(void) {
+    for (int chip = 0; chip < CPS1_N_CHIPS; chip++) {
+        for (int ch = 0; ch < 8; ch++) key[chip][ch] = ch;
+    }
     jt51_control_reset_write(0);
+#if CPS1_N_CHIPS > 1
+    for (int chip = 1; chip < CPS1_N_CHIPS; chip++) {
+        unsigned long control = JT51_CSR(chip, CSR_JT51_CONTROL_ADDR);
+        csr_write_simple(csr_read_simple(control) & ~(1 << CSR_JT51_CONTROL_RESET_OFFSET), control);
+    }
+#endif
+}
+
+void ym2151_chip_write_cmd(uint8_t chip, uint8_t addr, uint8_t data) {
+    if (chip == 0) {
+        ym2151_write_cmd(addr, data);
+        return;
+    }
+#if CPS1_N_CHIPS > 1
+    if (chip >= CPS1_N_CHIPS) return;
+    shadow(chip, addr, data);
+
+    csr_write_simple((addr << 8) | data, JT51_CSR(chip, CSR_JT51_CMD_ADDR));
+#endif
+}
+
+// Restores write bursts longer than the command FIFO: wait for room
+static void write_cmd_wait(uint8_t chip, uint8_t addr, uint8_t data) {
+#ifdef CSR_JT51_CMD_ADDR
+    while (ym2151_cmd_space(chip) == 0) {
+    }
+#endif
+    ym2151_chip_write_cmd(chip, addr, data);
+}
+
+// Writes the registers of a chip that differ from a snapshot taken with the same layout:
+// channels changing key state are keyed off first and keyed on once their registers are set.
+// Test, timers and the other write-only controls aren't restored
+void ym2151_restore(uint8_t chip, const uint8_t *snapshot_regs, const uint8_t *snapshot_key, uint8_t snapshot_pmd) {
+    if (chip >= CPS1_N_CHIPS) return;
+
+    for (int ch = 0; ch < 8; ch++) {
+        if (key[chip][ch] != snapshot_key[ch] && (key[chip][ch] & 0x78)) write_cmd_wait(chip, 0x08, ch);
+    }
+
+    for (int addr = 0x0f; addr < 256; addr++) {
+        if ((addr >= 0x10 && addr <= 0x14) || addr == 0x08 || regs[chip][addr] == snapshot_regs[addr]) continue;
+        write_cmd_wait(chip, addr, snapshot_regs[addr]);
+    }
+    if (pmd[chip] != snapshot_pmd) write_cmd_wait(chip, 0x19, snapshot_pmd);
+
+    for (int ch = 0; ch < 8; ch++) {
+        if (key[chip][ch] != snapshot_key[ch]) write_cmd_wait(chip, 0x08, snapshot_key[ch]);
+    }
 }
 
+#ifdef CSR_JT51_CMD_ADDR
+
+// Queued write: the gateware sequences cs_n/a0/wr_n and waits for the busy flag itself. Never
+// stalls, the player checks ym2151_cmd_space first (a write to a full FIFO is dropped)
 void ym2151_write_cmd(uint8_t addr, uint8_t data) {
+    shadow(0, addr, data);
+    jt51_cmd_write((addr << 8) | data);
+}
+
+uint32_t ym2151_cmd_space(uint8_t chip) {
+    if (chip == 0) return JT51_CMD_FIFO_DEPTH - jt51_cmd_status_level_read();
+#if CPS1_N_CHIPS > 1
+    if (chip < CPS1_N_CHIPS)
+        return JT51_CMD_FIFO_DEPTH - CHIP_CSR_FIELD(csr_read_simple(JT51_CSR(chip, CSR_JT51_CMD_STATUS_ADDR)),
+                                                    CSR_JT51_CMD_STATUS_LEVEL_OFFSET, CSR_JT51_CMD_STATUS_LEVEL_SIZE);
+#endif
+    // writes to missing chips are dropped anyway
+    return JT51_CMD_FIFO_DEPTH;
+}
+
+// clear_overflow is a pulse kept in the control storage next to the pin fields: it's set and
+// cleared again in whole register writes, so a later control write doesn't pulse it again
+static void clear_overflow(unsigned long control) {
+    uint32_t value = csr_read_simple(control) & ~(1 << CSR_JT51_CONTROL_CLEAR_OVERFLOW_OFFSET);
+    csr_write_simple(value | (1 << CSR_JT51_CONTROL_CLEAR_OVERFLOW_OFFSET), control);
+    csr_write_simple(value, control);
+}
+
+bool ym2151_cmd_overflow(uint8_t chip) {
+    if (chip == 0) {
+        bool overflow = jt51_cmd_status_overflow_read();
+        if (overflow) clear_overflow(CSR_JT51_CONTROL_ADDR);
+        return overflow;
+    }
+#if CPS1_N_CHIPS > 1
+    if (chip < CPS1_N_CHIPS) {
+        bool overflow = CHIP_CSR_FIELD(csr_read_simple(JT51_CSR(chip, CSR_JT51_CMD_STATUS_ADDR)),
+                                       CSR_JT51_CMD_STATUS_OVERFLOW_OFFSET, CSR_JT51_CMD_STATUS_OVERFLOW_SIZE);
+        if (overflow) clear_overflow(JT51_CSR(chip, CSR_JT51_CONTROL_ADDR));
+        return overflow;
+    }
+#endif
+    return false;
+}
+
+#else
+
+void ym2151_write_cmd(uint8_t addr, uint8_t data) {
+    shadow(0, addr, data);
+
     // wait ready
     while (jt51_dout_read() & 0x80) {
     }
@@ -23,4 +157,6 @@ void ym2151_write_cmd(uint8_t addr, uint8_t data) {
     jt51_control_cs_n_write(0);  // toogle CS
     jt51_control_cs_n_write(1);
     jt51_control_wr_n_write(1);
-}
\ No newline at end of file
+}
+
+#endif
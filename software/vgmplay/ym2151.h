@@ -1,5 +1,18 @@
 #pragma once
 #include <stdint.h>
+#include <stdbool.h>
+#include <generated/csr.h>
 
 void ym2151_init(void);
-void ym2151_write_cmd(uint8_t addr, uint8_t data);
\ No newline at end of file
+void ym2151_write_cmd(uint8_t addr, uint8_t data);
+void ym2151_restore(uint8_t chip, const uint8_t *snapshot_regs, const uint8_t *snapshot_key, uint8_t snapshot_pmd);
+// Register write to the JT51 of a chip pair (see chips.h), chip 0 is the one above. Writes to
+// chips the SoC doesn't have are dropped
+void ym2151_chip_write_cmd(uint8_t chip, uint8_t addr, uint8_t data);
+
+#ifdef CSR_JT51_CMD_ADDR
+// free entries in the register write FIFO of a chip
+uint32_t ym2151_cmd_space(uint8_t chip);
+// true if a queued write to a chip was dropped since the last call
+bool ym2151_cmd_overflow(uint8_t chip);
+#endif
@@ -0,0 +1,30 @@
+import os
+import sys
+
+# the tests import vgmtools and gateware from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import struct
+
+import pytest
+
+
+def build_vgm(commands, loop_offset=None, dual_chip=False):
+    """VGM 1.61 file with a YM2151 and an OKIM6295, commands are the bytes of the sound data
+    (0x66 appended), loop_offset is relative to them"""
+    data = bytes(commands) + b"\x66"
+    header = bytearray(0x100)
+    header[0:4] = b"Vgm "
+    struct.pack_into("<I", header, 0x04, len(header) + len(data) - 0x04)
+    struct.pack_into("<I", header, 0x08, 0x161)
+    if loop_offset is not None:
+        struct.pack_into("<I", header, 0x1c, len(header) + loop_offset - 0x1c)
+    struct.pack_into("<I", header, 0x30, 3579545 | (0x40000000 if dual_chip else 0))
+    struct.pack_into("<I", header, 0x34, len(header) - 0x34)
+    struct.pack_into("<I", header, 0x98, 1000000)
+    return bytes(header) + data
+
+
+@pytest.fixture
+def make_vgm():
+    return build_vgm
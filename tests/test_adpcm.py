@@ -0,0 +1,75 @@
+"""vgmtools.adpcm: the NumPy scan decoder against a scalar OKIM6295 ADPCM decoder"""
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vgmtools.adpcm import clamp_add_scan, clamp_add_states, decode_nibbles, decode_phrases
+
+# MSM6295 step sizes
+STEPS = [16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118,
+         130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658,
+         724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552]
+INDEX_SHIFT = [-1, -1, -1, -1, 2, 4, 6, 8]
+
+
+def decode_scalar(nibbles):
+    signal, step = -2, 0
+    out = []
+    for nibble in nibbles:
+        size = STEPS[step]
+        diff = size // 8
+        if nibble & 4:
+            diff += size
+        if nibble & 2:
+            diff += size // 2
+        if nibble & 1:
+            diff += size // 4
+        signal = min(max(signal + (-diff if nibble & 8 else diff), -2048), 2047)
+        step = min(max(step + INDEX_SHIFT[nibble & 7], 0), 48)
+        out.append(signal)
+    return out
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_decode_nibbles(seed):
+    rng = random.Random(seed)
+    # loud runs to hit both clamps, then random nibbles
+    nibbles = [7] * 200 + [15] * 400 + [rng.randrange(16) for _ in range(5000)]
+    assert decode_nibbles(nibbles).tolist() == decode_scalar(nibbles)
+
+
+def test_decode_empty():
+    assert decode_nibbles([]).tolist() == []
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_clamp_add_scan(seed):
+    rng = random.Random(seed)
+    a = [rng.randrange(-50, 50) for _ in range(1000)]
+    lo = [rng.randrange(-100, 0) for _ in range(1000)]
+    hi = [rng.randrange(0, 100) for _ in range(1000)]
+    x, states = 7, []
+    for i in range(1000):
+        x = min(max(x + a[i], lo[i]), hi[i])
+        states.append(x)
+    assert clamp_add_states(7, a, lo, hi).tolist() == states
+    assert len(clamp_add_scan(a, lo, hi)[0]) == 1000
+
+
+def test_decode_phrases():
+    rng = random.Random(0)
+    rom = bytearray(0x1000)
+    bounds = {1: (0x400, 0x4ff), 2: (0x500, 0x9ff), 5: (0xa00, 0xa00)}
+    for phrase, (start, end) in bounds.items():
+        rom[8 * phrase:8 * phrase + 6] = start.to_bytes(3, "big") + end.to_bytes(3, "big")
+    rom[0x400:] = bytes(rng.randrange(256) for _ in range(len(rom) - 0x400))
+    phrases = decode_phrases(rom)
+    # a phrase starting where it ends is empty
+    assert sorted(phrases) == [1, 2]
+    for phrase in phrases:
+        start, end = bounds[phrase]
+        nibbles = [n for byte in rom[start:end + 1] for n in (byte >> 4, byte & 15)]
+        assert phrases[phrase].tolist() == decode_scalar(nibbles)
@@ -0,0 +1,36 @@
+"""vgmtools.gatebench checks: clock enables, ROM reader data and the JT51/JT6295 CSR glue"""
+
+import pytest
+
+pytest.importorskip("migen")
+pytest.importorskip("litex")
+
+from vgmtools.gatebench import PATTERNS, bench_cens, bench_jt51_glue, bench_jt6295_glue, bench_rom_reader
+
+
+@pytest.mark.parametrize("clk_freq", [24e6, 25e6])
+def test_cens(clk_freq):
+    cycles = 20000
+    for name, target, long_term, measured in bench_cens(clk_freq, cycles):
+        # the tuning words are within 1ppm, the count over the cycles within a pulse
+        assert abs(long_term / target - 1) < 1e-6, name
+        assert abs(measured - long_term) <= clk_freq / cycles, name
+
+
+@pytest.mark.parametrize("n_lines", [0, 4])
+@pytest.mark.parametrize("wait_states", [0, 4])
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_rom_reader(n_lines, wait_states, pattern):
+    r = bench_rom_reader(pattern, n_lines, 4, wait_states, 1, 4096, 150, 0)
+    assert r["errors"] == []
+    assert r["fetches"] > 0
+
+
+def test_jt51_glue():
+    r = bench_jt51_glue(24e6, 40, 64, 0)
+    assert r["errors"] == []
+
+
+def test_jt6295_glue():
+    r = bench_jt6295_glue(24e6, 40, 0)
+    assert r["errors"] == []
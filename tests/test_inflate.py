@@ -0,0 +1,107 @@
+"""software/vgmplay/inflate.c built for the host, against Python's gzip and zlib"""
+
+import gzip
+import os
+import random
+import shutil
+import struct
+import subprocess
+import zlib
+
+import pytest
+
+VGMPLAY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "software", "vgmplay")
+
+# inflates argv[1] reading argv[2] bytes at a time, the output goes to stdout
+DRIVER = r"""
+#include <stdio.h>
+#include <stdlib.h>
+#include "inflate.h"
+
+static struct inflate z;
+static uint8_t data[1 << 22];
+static uint8_t buffer[1 << 16];
+
+int main(int argc, char **argv) {
+    FILE *f = fopen(argv[1], "rb");
+    size_t size = fread(data, 1, sizeof(data), f);
+    uint32_t chunk = atoi(argv[2]), out_size, n;
+    fclose(f);
+
+    if (!inflate_gzip_init(&z, data, size, &out_size)) return 2;
+    do {
+        n = inflate_read(&z, buffer, chunk);
+        fwrite(buffer, 1, n, stdout);
+    } while (n == chunk);
+    return z.state == INFLATE_DONE && z.out_pos == out_size ? 0 : 1;
+}
+"""
+
+
+@pytest.fixture(scope="module")
+def inflate_bin(tmp_path_factory):
+    cc = shutil.which("cc") or shutil.which("gcc")
+    if cc is None:
+        pytest.skip("no C compiler")
+    path = tmp_path_factory.mktemp("inflate")
+    (path / "driver.c").write_text(DRIVER)
+    binary = path / "inflate"
+    subprocess.run([cc, "-O2", "-I", VGMPLAY_DIR, "-o", str(binary), str(path / "driver.c"),
+                    os.path.join(VGMPLAY_DIR, "inflate.c")], check=True)
+    return binary
+
+
+def inflate(inflate_bin, tmp_path, gz, chunk):
+    path = tmp_path / "data.gz"
+    path.write_bytes(gz)
+    result = subprocess.run([str(inflate_bin), str(path), str(chunk)], capture_output=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def gzip_raw(data, level=6, strategy=zlib.Z_DEFAULT_STRATEGY):
+    """gzip member around a raw DEFLATE stream, for the block types gzip.compress doesn't pick"""
+    z = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy)
+    body = z.compress(data) + z.flush()
+    return (b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff" + body +
+            struct.pack("<II", zlib.crc32(data), len(data) & 0xffffffff))
+
+
+def samples():
+    rng = random.Random(0)
+    text = b" ".join(rng.choice([b"ym2151", b"okim6295", b"wait", b"\x61\x00\x01", b"\x54\x08\x00"])
+                     for _ in range(20000))
+    return {
+        "empty": b"",
+        "short": b"vgm",
+        "text": text,
+        "random": bytes(rng.randrange(256) for _ in range(70000)),
+        "runs": b"\x00" * 100000 + text[:1000] * 40,
+    }
+
+
+@pytest.mark.parametrize("name", sorted(samples()))
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_gzip_levels(inflate_bin, tmp_path, name, level):
+    data = samples()[name]
+    assert inflate(inflate_bin, tmp_path, gzip.compress(data, level), 4096) == data
+
+
+@pytest.mark.parametrize("name", sorted(samples()))
+@pytest.mark.parametrize("strategy", [zlib.Z_FIXED, zlib.Z_HUFFMAN_ONLY, zlib.Z_RLE])
+def test_block_types(inflate_bin, tmp_path, name, strategy):
+    data = samples()[name]
+    assert inflate(inflate_bin, tmp_path, gzip_raw(data, 9, strategy), 4096) == data
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 4096])
+def test_read_sizes(inflate_bin, tmp_path, chunk):
+    data = samples()["text"]
+    assert inflate(inflate_bin, tmp_path, gzip.compress(data, 9), chunk) == data
+
+
+@pytest.mark.parametrize("song", ["stf2_ryu.vgz", "stf2_title.vgz"])
+def test_songs(inflate_bin, tmp_path, song):
+    with open(os.path.join(VGMPLAY_DIR, song), "rb") as f:
+        gz = f.read()
+    assert inflate(inflate_bin, tmp_path, gz, 4096) == gzip.decompress(gz)
@@ -0,0 +1,70 @@
+"""SerialMixer against a Python mix with the jtframe_mixer arithmetic"""
+
+import random
+
+import pytest
+
+pytest.importorskip("migen")
+pytest.importorskip("litex")
+
+from migen import run_simulation
+
+from gateware.jtframe.sound.mixer import SerialMixer
+
+
+def reference_mix(channels, gains, w, wout):
+    total = sum((x << (16 - w)) * g for x, g in zip(channels, gains)) >> 4
+    clip = not -0x8000 <= total <= 0x7fff
+    return min(max(total, -0x8000), 0x7fff) >> (16 - wout), clip
+
+
+@pytest.mark.parametrize("n_channels,n_outputs,w,wout", [(2, 2, 16, 16), (4, 1, 12, 16), (3, 2, 16, 12)])
+def test_serial_mixer(n_channels, n_outputs, w, wout):
+    rng = random.Random(n_channels * 100 + n_outputs * 10 + w)
+    dut = SerialMixer(n_channels=n_channels, n_outputs=n_outputs, w=w, wout=wout)
+    period = n_channels * n_outputs
+    mismatches = []
+
+    def generator():
+        for i in range(60):
+            # full scale inputs and high gains now and then, to saturate
+            loud = i % 4 == 0
+            channels = [[rng.choice([-(1 << (w - 1)), (1 << (w - 1)) - 1]) if loud else
+                         rng.randrange(-(1 << (w - 1)), 1 << (w - 1)) for c in range(n_channels)]
+                        for o in range(n_outputs)]
+            gains = [[rng.randrange(0x20, 0x100) if loud else rng.randrange(0x30) for c in range(n_channels)]
+                     for o in range(n_outputs)]
+            for o in range(n_outputs):
+                for c in range(n_channels):
+                    yield dut.i_ch[o][c].eq(channels[o][c])
+                    yield dut.i_gain[o][c].eq(gains[o][c])
+            # a full round after the inputs settle, plus the pipeline latency
+            for _ in range(2 * period + 3):
+                yield
+            expected = [reference_mix(channels[o], gains[o], w, wout) for o in range(n_outputs)]
+            mixed = []
+            for o in range(n_outputs):
+                mixed.append((yield dut.o_mixed[o]))
+            peak = yield dut.o_peak
+            if mixed != [m for m, _ in expected] or peak != any(clip for _, clip in expected):
+                mismatches.append((channels, gains, mixed, peak, expected))
+
+    run_simulation(dut, generator())
+    assert mismatches == []
+
+
+def test_constant_gains():
+    dut = SerialMixer(n_channels=2, n_outputs=2, gains=[0x10, 0x08])
+    outputs = []
+
+    def generator():
+        for o in range(2):
+            yield dut.i_ch[o][0].eq(1000 * (o + 1))
+            yield dut.i_ch[o][1].eq(-2000)
+        for _ in range(12):
+            yield
+        for o in range(2):
+            outputs.append((yield dut.o_mixed[o]))
+
+    run_simulation(dut, generator())
+    assert outputs == [0, 1000]
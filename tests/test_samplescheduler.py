@@ -0,0 +1,138 @@
+"""SampleScheduler driven through its CSR bank with the register writes of timer.c"""
+
+import pytest
+
+pytest.importorskip("migen")
+pytest.importorskip("litex")
+
+from migen import Module, run_simulation
+from litex.soc.interconnect import csr_bus
+
+from gateware.samplescheduler import SampleScheduler, VGM_SAMPLE_RATE
+
+ENABLE = 1 << 0
+RESET = 1 << 1
+
+
+class Bench(Module):
+    def __init__(self):
+        # 8 clock cycles per sample
+        self.submodules.scheduler = SampleScheduler(8 * VGM_SAMPLE_RATE)
+        self.submodules.csrbanks = csr_bus.CSRBankArray(self, lambda name, memory: 0, data_width=32)
+        (_, _, self.bank), = [(n, m, b) for n, m, _, b in self.csrbanks.banks]
+        self.bus = self.bank.bus
+
+
+class Firmware:
+    """CSR accesses of the LiteX generated helpers: <csr>_write, <csr>_read and the field
+    writes, which read the register and write it back with the field changed"""
+    def __init__(self, dut):
+        self.dut = dut
+
+    def address(self, csr):
+        return self.dut.bank.simple_csrs.index(csr.simple_csrs[0])
+
+    def write(self, csr, value):
+        bus = self.dut.bus
+        yield bus.adr.eq(self.address(csr))
+        yield bus.dat_w.eq(value)
+        yield bus.we.eq(1)
+        yield
+        yield bus.we.eq(0)
+        yield
+
+    def read(self, csr):
+        yield self.dut.bus.adr.eq(self.address(csr))
+        yield
+        yield
+        return (yield self.dut.bus.dat_r)
+
+    def field_write(self, csr, offset, value):
+        word = yield from self.read(csr)
+        yield from self.write(csr, (word & ~(1 << offset)) | (value << offset))
+
+
+def wait_irq(dut, cycles):
+    """Sample count when the interrupt goes up, None if it doesn't within cycles"""
+    for _ in range(cycles):
+        if (yield dut.scheduler.ev.irq):
+            return (yield dut.scheduler._sample.status)
+        yield
+    return None
+
+
+def enable(fw, s, wait):
+    # timer0_enable with reprogram set
+    yield from fw.write(s._control, RESET)
+    yield from fw.write(s._wait, wait)
+    pending = yield from fw.read(s.ev.pending)
+    yield from fw.write(s.ev.pending, pending)
+    yield from fw.write(s.ev.enable, 1)
+    yield from fw.write(s._control, ENABLE)
+
+
+def test_first_deadline():
+    dut = Bench()
+    fw = Firmware(dut)
+    s = dut.scheduler
+    fired = []
+
+    def generator():
+        yield from fw.write(s._control, 0)  # timer0_init
+        yield from enable(fw, s, 10)
+        fired.append((yield from wait_irq(dut, 400)))
+        # the interrupt handler: acknowledge, next wait from the deadline
+        pending = yield from fw.read(s.ev.pending)
+        yield from fw.write(s.ev.pending, pending)
+        yield from fw.write(s._wait, 5)
+        fired.append((yield from wait_irq(dut, 400)))
+
+    run_simulation(dut, generator())
+    assert fired == [10, 15]
+
+
+def test_pause_holds_deadline():
+    dut = Bench()
+    fw = Firmware(dut)
+    s = dut.scheduler
+    held = []
+
+    def generator():
+        yield from enable(fw, s, 20)
+        for _ in range(8 * 5):
+            yield
+        # timer0_disable, a while paused, timer0_enable without reprogramming
+        yield from fw.write(s._control, 0)
+        yield from fw.write(s.ev.enable, 0)
+        sample = yield from fw.read(s._sample)
+        for _ in range(8 * 30):
+            yield
+        held.append((sample, (yield from fw.read(s._sample)), (yield from fw.read(s._deadline))))
+        pending = yield from fw.read(s.ev.pending)
+        yield from fw.write(s.ev.pending, pending)
+        yield from fw.write(s.ev.enable, 1)
+        yield from fw.write(s._control, ENABLE)
+        held.append((yield from wait_irq(dut, 400)))
+
+    run_simulation(dut, generator())
+    (before, after, deadline), fired = held
+    assert before == after and deadline == 20
+    assert fired == 20
+
+
+def test_field_writes_repeat_reset():
+    # why timer.c writes control whole: a field write after the reset pulse pulses it again
+    dut = Bench()
+    fw = Firmware(dut)
+    s = dut.scheduler
+    fired = []
+
+    def generator():
+        yield from fw.field_write(s._control, 1, 1)
+        yield from fw.write(s._wait, 10)
+        yield from fw.write(s.ev.enable, 1)
+        yield from fw.field_write(s._control, 0, 1)
+        fired.append((yield from wait_irq(dut, 400)))
+
+    run_simulation(dut, generator())
+    assert fired == [None]
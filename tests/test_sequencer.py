@@ -0,0 +1,54 @@
+"""VGCSequencer: writes stay on the samples the waits add up to, whatever the write port stalls"""
+
+import pytest
+
+pytest.importorskip("migen")
+pytest.importorskip("litex")
+
+from migen import Module, run_simulation
+from litex.soc.interconnect import wishbone
+
+from gateware.sequencer.sequencer import VGC_NO_LOOP, VGC_OP_WAIT, VGC_OP_YM2151, VGCSequencer
+
+END = 0xc0000000
+
+
+def ym2151(addr, data, wait):
+    return (VGC_OP_YM2151 << 30) | (wait << 16) | (addr << 8) | data
+
+
+def due_samples(commands):
+    t, samples = 0, []
+    for word in commands:
+        if word >> 30 == VGC_OP_YM2151:
+            samples.append(t)
+            t += (word >> 16) & 0x3fff
+        elif word >> 30 == VGC_OP_WAIT:
+            t += word & 0x3fffffff
+    return samples
+
+
+@pytest.mark.parametrize("ready_period", [1, 7])
+def test_no_drift(ready_period):
+    commands = [ym2151(i, i, 3 + i % 5) for i in range(20)] + [VGC_OP_WAIT << 30 | 7, ym2151(0x30, 1, 2), END]
+    bus = wishbone.Interface()
+    dut = Module()
+    dut.submodules.memory = wishbone.SRAM(1024, bus=bus, init=commands)
+    # 4 clock cycles per sample: fetches and stalls are a good part of a sample
+    dut.submodules.sequencer = sequencer = VGCSequencer(bus, clk_freq=44100 * 4)
+    written = []
+
+    def generator():
+        yield sequencer._loop.storage.eq(VGC_NO_LOOP)
+        yield sequencer._control.fields.enable.eq(1)
+        for cycle in range(2000):
+            yield sequencer.ym2151.ready.eq(cycle % ready_period == 0)
+            yield
+            if (yield sequencer.ym2151.valid) and (yield sequencer.ym2151.ready):
+                written.append((yield sequencer._sample.status))
+
+    run_simulation(dut, generator())
+    due = due_samples(commands)
+    assert len(written) == len(due)
+    # a write is late by its own fetch and stall only
+    assert all(0 <= w - d <= 2 for w, d in zip(written, due)), list(zip(written, due))
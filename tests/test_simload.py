@@ -0,0 +1,49 @@
+"""vgmtools.simload splits images in SDRAM model banks like litedram's SDRAMPHYModel"""
+
+import random
+import types
+
+import pytest
+
+pytest.importorskip("migen")
+pytest.importorskip("litedram")
+
+from litedram.phy.model import SDRAMPHYModel
+
+from vgmtools.simload import image_words, sdram_bank_words
+
+
+def litedram_banks(config, words):
+    # the private init preparation of SDRAMPHYModel only reads settings.databits from the model
+    model = types.SimpleNamespace(settings=types.SimpleNamespace(databits=config["databits"]))
+    prepare = SDRAMPHYModel._SDRAMPHYModel__prepare_bank_init_data
+    return prepare(model, list(words), config["nbanks"], config["nrows"], config["ncols"],
+                   config["data_width"], config["address_mapping"])
+
+
+def memories(config, banks):
+    """Bank memory contents: litedram pads the image with a few zero words more"""
+    depth = config["nrows"] * config["ncols"] * config["databits"] // config["data_width"]
+    return [list(bank) + [0] * (depth - len(bank)) for bank in banks]
+
+
+@pytest.mark.parametrize("address_mapping", ["ROW_BANK_COL", "BANK_ROW_COL"])
+@pytest.mark.parametrize("data_width", [8, 16, 32, 64, 128])
+@pytest.mark.parametrize("n_bytes", [4, 1000, 6000, 16384])
+def test_bank_split(address_mapping, data_width, n_bytes):
+    config = dict(nbanks=4, nrows=32, ncols=64, databits=16, data_width=data_width,
+                  address_mapping=address_mapping)
+    rng = random.Random(n_bytes)
+    words = image_words(bytes(rng.randrange(256) for _ in range(n_bytes)))
+    assert memories(config, sdram_bank_words(config, words)) == memories(config, litedram_banks(config, words))
+
+
+def test_image_too_large():
+    config = dict(nbanks=2, nrows=4, ncols=8, databits=16, data_width=32, address_mapping="ROW_BANK_COL")
+    with pytest.raises(ValueError):
+        sdram_bank_words(config, [0] * 65)
+
+
+def test_image_words():
+    assert image_words(b"\x01\x02\x03\x04\x05") == [0x04030201, 0x05]
+    assert image_words(b"\x01\x02\x03\x04", "big") == [0x01020304]
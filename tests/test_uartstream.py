@@ -0,0 +1,108 @@
+"""vgmtools.uartstream against a device model losing frames on the way"""
+
+import random
+
+import pytest
+
+pytest.importorskip("serial")
+
+from vgmtools.uartstream import (FRAME_DATA, FRAME_HELLO, FRAME_PLAY, FRAME_ROM, FRAME_STATUS,
+                                 STATUS_FINISHED, STATUS_PLAYING, FrameReader, Link, frame, stream)
+
+
+class FakeDevice:
+    """vgmplay on the other end of the UART: applies the frames it receives like uartstream.c,
+    corrupting some of them on the way"""
+
+    def __init__(self, lose, ring_size=4096, seed=0):
+        self.random = random.Random(seed)
+        self.lose = lose
+        self.ring_size = ring_size
+        self.reader = FrameReader(console=None)
+        self.output = bytearray()
+        self.in_waiting = 0
+        self.rom = [bytearray(0x40000), bytearray(0x40000)]
+        self.ring = bytearray()
+        self.position = 0
+        self.errors = 0
+        self.rom_frames = 0
+        self.playing = False
+
+    def write(self, data):
+        data = bytearray(data)
+        # a corrupted frame is dropped and counted, as bad checksums are (a corrupted sync isn't
+        # on the device, the host then resends on its timeout)
+        if data and self.random.random() < self.lose:
+            data[self.random.randrange(len(data))] ^= 0xff
+            self.errors += 1
+        for frame_type, payload in self.reader.feed(bytes(data)):
+            self.apply(frame_type, payload)
+            self.send_status()
+
+    def apply(self, frame_type, payload):
+        if frame_type == FRAME_HELLO:
+            self.ring.clear()
+            self.position = 0
+            self.playing = False
+        elif frame_type == FRAME_ROM:
+            address = int.from_bytes(payload[:4], "little")
+            chip, address = address >> 31, address & 0x7fffffff
+            self.rom[chip][address:address + len(payload) - 4] = payload[4:]
+            self.rom_frames += 1
+        elif frame_type == FRAME_DATA and len(payload) >= 4:
+            data = payload[4:]
+            space = self.position + self.ring_size - len(self.ring)
+            if int.from_bytes(payload[:4], "little") == len(self.ring) and len(data) <= space:
+                self.ring += data
+        elif frame_type == FRAME_PLAY:
+            self.playing = True
+
+    def send_status(self):
+        if self.playing:
+            self.position = len(self.ring)
+        finished = self.playing and self.ring.endswith(b"\x66")
+        flags = (STATUS_PLAYING if self.playing else 0) | (STATUS_FINISHED if finished else 0)
+        values = (self.position, len(self.ring), self.ring_size, 0, self.position, self.errors, flags,
+                  self.rom_frames)
+        self.output += frame(FRAME_STATUS, b"".join(v.to_bytes(4, "little") for v in values))
+        self.in_waiting = len(self.output)
+
+    def read(self, size):
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        self.in_waiting = len(self.output)
+        return data
+
+
+def make_link(device):
+    link = Link.__new__(Link)
+    link.serial = device
+    link.reader = FrameReader(console=None)
+    link.timeout = 0.01
+    link.status = None
+    return link
+
+
+def make_items(seed=1):
+    rng = random.Random(seed)
+    rom = [bytes(rng.randrange(256) for _ in range(5000)), bytes(rng.randrange(256) for _ in range(3000))]
+    items = [("rom", 0, 0x100, rom[0], 0), ("rom", 0, 0x80000000 | 0x200, rom[1], 0)]
+    offset = 0
+    for i in range(40):
+        data = bytes(rng.choice((0x61, 0x62, 0x63)) for _ in range(200))
+        if i == 39:
+            data += b"\x66"
+        items.append(("data", offset, data, i))
+        offset += len(data)
+    return rom, items
+
+
+@pytest.mark.parametrize("lose", [0.0, 0.1, 0.3])
+def test_stream_resends_lost_frames(lose):
+    rom, items = make_items()
+    device = FakeDevice(lose)
+    status = stream(make_link(device), items, lead=0.0, verbose=False)
+    assert status["flags"] & STATUS_FINISHED
+    assert device.rom[0][0x100:0x100 + len(rom[0])] == rom[0]
+    assert device.rom[1][0x200:0x200 + len(rom[1])] == rom[1]
+    assert device.ring == b"".join(item[2] for item in items if item[0] == "data")
@@ -0,0 +1,74 @@
+"""vgmtools.vgc: the compiled command words play the same writes at the same samples"""
+
+import glob
+import os
+
+import pytest
+
+from vgmtools.vgc import (CONTROL_ROM, OP_CONTROL, OP_OKIM6295, OP_WAIT, OP_YM2151, VGC_NO_LOOP,
+                          compile_vgm, parse_vgc, word_wait)
+from vgmtools.vgm import (CMD_DATA_BLOCK, CMD_END, CMD_OKIM6295_WRITE, CMD_YM2151_WRITE,
+                          DATA_BLOCK_OKIM6295_ROM, OKIM6295_SECOND_CHIP, data_block_chip,
+                          iter_commands, load_vgm, parse_header, parse_okim6295_rom_block,
+                          wait_samples)
+
+SONGS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "software", "vgmplay", "*.vg[mz]")))
+
+
+def vgm_events(vgm_data):
+    """(sample, event) of the chip 0 writes and ROM blocks, samples at the loop and at the end"""
+    header = parse_header(vgm_data)
+    events = []
+    t = 0
+    loop_sample = None
+    for offset, cmd, operands in iter_commands(vgm_data, header):
+        if offset == header.loop_offset:
+            loop_sample = t
+        if cmd == CMD_END:
+            break
+        if cmd == CMD_YM2151_WRITE:
+            events.append((t, ("ym2151", operands[0], operands[1])))
+        elif cmd == CMD_OKIM6295_WRITE and not operands[0] & OKIM6295_SECOND_CHIP:
+            events.append((t, ("okim6295", operands[0], operands[1])))
+        elif cmd == CMD_DATA_BLOCK and operands[0] == DATA_BLOCK_OKIM6295_ROM and \
+                data_block_chip(vgm_data, offset) == 0:
+            events.append((t, ("rom",) + parse_okim6295_rom_block(operands[1])))
+        t += wait_samples(vgm_data, offset)
+    return events, loop_sample, t
+
+
+def vgc_events(vgc_data):
+    header, words, blocks = parse_vgc(vgc_data)
+    events = []
+    t = 0
+    loop_sample = None
+    for i, word in enumerate(words):
+        if i == header["loop_index"]:
+            loop_sample = t
+        op = word >> 30
+        if op == OP_YM2151:
+            events.append((t, ("ym2151", (word >> 8) & 0xff, word & 0xff)))
+        elif op == OP_OKIM6295:
+            events.append((t, ("okim6295", (word >> 8) & 0xff, word & 0xff)))
+        elif op == OP_CONTROL and (word >> 24) & 0x3f == CONTROL_ROM:
+            events.append((t, ("rom",) + blocks[word & 0xffffff]))
+        t += word_wait(word)
+    return events, loop_sample, t
+
+
+@pytest.mark.parametrize("song", SONGS, ids=os.path.basename)
+def test_songs(song):
+    vgm_data = load_vgm(song)
+    assert vgc_events(compile_vgm(vgm_data)) == vgm_events(vgm_data)
+
+
+def test_long_waits(make_vgm):
+    # waits past the 14 bit write wait field and the 16 bit VGM wait, merged across commands
+    commands = [0x54, 0x08, 0x00] + [0x61, 0xff, 0xff] * 3 + [0x62, 0x7f, 0x54, 0x20, 0xc7, 0x63]
+    vgm_data = make_vgm(commands, loop_offset=len(commands) - 4)
+    vgc_data = compile_vgm(vgm_data)
+    header, words, blocks = parse_vgc(vgc_data)
+    assert any(word >> 30 == OP_WAIT for word in words)
+    assert vgc_events(vgc_data) == vgm_events(vgm_data)
+    assert header["loop_index"] != VGC_NO_LOOP
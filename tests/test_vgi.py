@@ -0,0 +1,82 @@
+"""vgmtools.vgi: entries snapshot every chip of the song"""
+
+import struct
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from vgmtools.vgi import CHIP_SIZE, ENTRY_SIZE, VGI_HEADER_SIZE, VGI_VERSION, build_vgi, index_vgm
+
+# offsets in a chip snapshot
+LATCH = 0x00
+PHRASE = 0x01
+ATTENUATION = 0x05
+KEY = 0x0A
+REGS = 0x14
+
+
+def rom_block(address, data, chip=0):
+    payload = struct.pack("<II", 0x40000, address) + data
+    return [0x67, 0x66, 0x8b] + list(struct.pack("<I", len(payload) | (chip << 31))) + list(payload)
+
+
+def phrase_rom(phrase, start, end):
+    return bytes(8 * phrase) + start.to_bytes(3, "big") + end.to_bytes(3, "big")
+
+
+def song():
+    # both chips: a register, a key on, a phrase playing on channel 2 and a ROM block each
+    return (rom_block(0, phrase_rom(3, 0x400, 0x4ff)) + rom_block(0, phrase_rom(5, 0x400, 0x4ff), chip=1) +
+            [0x54, 0x20, 0x11, 0x54, 0x08, 0x78,
+             0xa4, 0x20, 0x22, 0xa4, 0x08, 0x79,
+             0xb8, 0x00, 0x83, 0xb8, 0x00, 0x41,
+             0xb8, 0x80, 0x85, 0xb8, 0x80, 0x42] + [0x62] * 10)
+
+
+def chip(entry, i):
+    return entry[ENTRY_SIZE + i * CHIP_SIZE:ENTRY_SIZE + (i + 1) * CHIP_SIZE]
+
+
+def test_dual_chip(make_vgm):
+    entries, loop_entry, rom_blocks = index_vgm(make_vgm(song(), dual_chip=True), 735)
+    assert len(rom_blocks) == 2
+    entry = entries[1]
+    assert len(entry) == ENTRY_SIZE + 2 * CHIP_SIZE
+    for i, (reg, key, phrase, attenuation) in enumerate([(0x11, 0x78, 3, 1), (0x22, 0x79, 5, 2)]):
+        snapshot = chip(entry, i)
+        assert snapshot[REGS + 0x20] == reg
+        assert snapshot[KEY + (key & 7)] == key
+        assert snapshot[PHRASE + 2] == phrase
+        assert snapshot[ATTENUATION + 2] == attenuation
+        assert snapshot[LATCH] == 0
+
+
+def test_single_chip(make_vgm):
+    # second chip writes of a song without the dual chip bit aren't played
+    vgm_data = make_vgm(song())
+    entries, loop_entry, rom_blocks = index_vgm(vgm_data, 735)
+    assert len(rom_blocks) == 1
+    assert len(entries[1]) == ENTRY_SIZE + CHIP_SIZE
+    assert chip(entries[1], 0)[REGS + 0x20] == 0x11
+
+    vgi_data = build_vgi(vgm_data, 735)
+    version, n_entries, n_chips = struct.unpack_from("<4xI4xI20xI", vgi_data, 0)
+    assert (version, n_chips) == (VGI_VERSION, 1)
+    assert len(vgi_data) == VGI_HEADER_SIZE + 4 + n_entries * (ENTRY_SIZE + CHIP_SIZE)
+
+
+def test_live_rom_blocks(make_vgm):
+    # the first block is overwritten whole by the second, the third only covers part of it
+    blocks = [rom_block(0, bytes(0x100)), rom_block(0, bytes(0x200)), rom_block(0x100, bytes(0x10))]
+    vgm_data = make_vgm(sum(([*block, 0x62] for block in blocks), []) + [0x62] * 4)
+    entries, loop_entry, rom_blocks = index_vgm(vgm_data, 735)
+    offsets = [o for o in range(0x40, len(vgm_data)) if vgm_data[o:o + 3] == b"\x67\x66\x8b"]
+    live = []
+    for entry in entries:
+        first, n = struct.unpack_from("<2I", entry, 8)
+        live.append(rom_blocks[first:first + n])
+    assert live[:4] == [[], offsets[:1], offsets[1:2], offsets[1:3]]
+    # entries after the last block share its run
+    assert all(blocks == offsets[1:3] for blocks in live[3:])
+    assert len(rom_blocks) == 1 + 1 + 2
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+"""OKIM6295 reference decoder
+
+Renders the PCM part of a VGM file: 0x8B data blocks are copied into a 256KiB sample ROM (what
+timer0_isr does with msm6295_write_rom) and 0xB8 writes are replayed as MSM6295 commands. The
+output is the sum of the 4 voices, each one the 12 bit ADPCM signal times the channel volume.
+That 19 bit sum is scaled by 1/8, the 16 bit range of the jt6295 sound output once the SoC pads
+it for Uprate2Fir, so unlike MAME's okim6295 (1/2 and clipping) it never saturates.
+
+Decoding is vectorized. Both ADPCM recurrences, the step index and the signal, have the form
+x[n + 1] = clamp(x[n] + a[n], lo, hi). Functions of that form are closed under composition:
+
+    clamp(clamp(x + a1, l1, h1) + a2, l2, h2) = clamp(x + a1 + a2, clamp(l1 + a2, l2, h2),
+                                                                   clamp(h1 + a2, l2, h2))
+
+so every state of a phrase comes out of a log2(n) steps prefix scan over (a, lo, hi) arrays.
+"""
+
+import argparse
+import wave
+
+import numpy as np
+
+from vgmtools.vgm import *
+
+MSM6295_FREQ = 1e6  # gateware/jt6295/jt6295.py
+ROM_SIZE = 256 * 1024
+N_VOICES = 4
+
+STEPS = np.floor(16 * 1.1 ** np.arange(49)).astype(np.int64)
+INDEX_SHIFT = np.array([-1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int64)
+VOLUME = np.array([0x20, 0x16, 0x10, 0x0b, 0x08, 0x06, 0x04, 0x03, 0x02, 0, 0, 0, 0, 0, 0, 0],
+                  dtype=np.int64)
+
+
+def _diff_table():
+    """diff[step, nibble], the signal increment of every nibble at every step size"""
+    nibbles = np.arange(16)
+    sign = np.where(nibbles & 8, -1, 1)
+    step = STEPS[:, None]
+    magnitude = (step * ((nibbles >> 2) & 1) + step // 2 * ((nibbles >> 1) & 1) +
+                 step // 4 * (nibbles & 1) + step // 8)
+    return sign * magnitude
+
+
+DIFF = _diff_table()
+
+
+def sample_rate(ss=0, clock=MSM6295_FREQ):
+    """Output rate for the ss pin (the ss field of the jt6295 control CSR)"""
+    return clock / (132 if ss else 165)
+
+
+def clamp_add_scan(a, lo, hi):
+    """Prefix composition of x -> clamp(x + a[i], lo[i], hi[i])
+
+    Returns (a, lo, hi) arrays where entry i is the composition of functions 0..i.
+    """
+    a = np.array(a, dtype=np.int64)
+    lo = np.broadcast_to(np.asarray(lo, dtype=np.int64), a.shape).copy()
+    hi = np.broadcast_to(np.asarray(hi, dtype=np.int64), a.shape).copy()
+    d = 1
+    while d < len(a):
+        a_later = a[d:]
+        lo_later, hi_later = lo[d:], hi[d:]
+        new_lo = np.clip(lo[:-d] + a_later, lo_later, hi_later)
+        new_hi = np.clip(hi[:-d] + a_later, lo_later, hi_later)
+        a[d:] = a[:-d] + a_later
+        lo[d:] = new_lo
+        hi[d:] = new_hi
+        d *= 2
+    return a, lo, hi
+
+
+def clamp_add_states(x0, a, lo, hi):
+    """States after each step of x[n + 1] = clamp(x[n] + a[n], lo, hi), starting at x0"""
+    a, lo, hi = clamp_add_scan(a, lo, hi)
+    return np.clip(x0 + a, lo, hi)
+
+
+def decode_nibbles(nibbles):
+    """ADPCM nibbles to 12 bit signal, decoder starting from reset (signal -2, step 0)"""
+    nibbles = np.asarray(nibbles, dtype=np.int64)
+    if len(nibbles) == 0:
+        return np.zeros(0, dtype=np.int64)
+    steps = clamp_add_states(0, INDEX_SHIFT[nibbles & 7], 0, 48)
+    # the step used by nibble n is the one left by nibble n - 1
+    steps = np.concatenate(([0], steps[:-1]))
+    return clamp_add_states(-2, DIFF[steps, nibbles], -2048, 2047)
+
+
+def phrase_bounds(rom, phrase):
+    """(start, end) byte addresses of a phrase, end included"""
+    entry = rom[8 * phrase:8 * phrase + 6]
+    start = ((entry[0] << 16) | (entry[1] << 8) | entry[2]) & 0x3ffff
+    end = ((entry[3] << 16) | (entry[4] << 8) | entry[5]) & 0x3ffff
+    return start, end
+
+
+def rom_nibbles(rom, start, end):
+    """Nibbles of rom[start:end + 1], high nibble first"""
+    data = np.frombuffer(bytes(rom[start:end + 1]), dtype=np.uint8)
+    return np.stack((data >> 4, data & 15), axis=1).reshape(-1)
+
+
+def decode_phrases(rom):
+    """Decode every phrase of a sample ROM, returns {phrase: 12 bit signal}"""
+    phrases = {}
+    for phrase in range(1, 128):
+        start, end = phrase_bounds(rom, phrase)
+        if start < end:
+            phrases[phrase] = decode_nibbles(rom_nibbles(rom, start, end))
+    return phrases
+
+
+class Voice:
+    def __init__(self):
+        self.signal = None
+        self.volume = 0
+        self.start = 0
+        self.stop = None
+
+    def playing(self, t):
+        return self.signal is not None and t < self.start + len(self.signal) and \
+            (self.stop is None or t < self.stop)
+
+
+class OkiReplay:
+    """Replays MSM6295 writes, t is the OKI sample number of every write"""
+    def __init__(self):
+        self.rom = bytearray(ROM_SIZE)
+        self.voices = [Voice() for i in range(N_VOICES)]
+        self.played = []
+        self.phrase = None
+        self.cache = {}
+        self.ignored = 0
+
+    def write_rom(self, rom_start_address, data):
+        self.rom[rom_start_address:rom_start_address + len(data)] = data
+        self.rom = self.rom[:ROM_SIZE]
+        self.cache = {}
+
+    def write(self, t, data):
+        if self.phrase is not None:
+            phrase, self.phrase = self.phrase, None
+            for i in range(N_VOICES):
+                if data & (0x10 << i):
+                    self.start(t, i, phrase, data & 15)
+        elif data & 0x80:
+            self.phrase = data & 0x7f
+        else:
+            for i in range(N_VOICES):
+                if data & (0x08 << i):
+                    self.stop(t, i)
+
+    def start(self, t, i, phrase, attenuation):
+        voice = self.voices[i]
+        if voice.playing(t):
+            # the chip ignores starts on busy channels
+            self.ignored += 1
+            return
+        key = phrase_bounds(self.rom, phrase)
+        if key not in self.cache:
+            start, end = key
+            self.cache[key] = decode_nibbles(rom_nibbles(self.rom, start, end)) \
+                if start < end else np.zeros(0, dtype=np.int64)
+        voice = Voice()
+        voice.signal = self.cache[key]
+        voice.volume = VOLUME[attenuation]
+        voice.start = t
+        self.voices[i] = voice
+        self.played.append(voice)
+
+    def stop(self, t, i):
+        voice = self.voices[i]
+        if voice.playing(t):
+            voice.stop = t
+
+    def mix(self, n_samples):
+        out = np.zeros(n_samples, dtype=np.int64)
+        for voice in self.played:
+            end = voice.start + len(voice.signal)
+            if voice.stop is not None:
+                end = min(end, voice.stop)
+            end = min(end, n_samples)
+            if end > voice.start:
+                out[voice.start:end] += voice.signal[:end - voice.start] * voice.volume
+        return (out >> 3).astype(np.int16)
+
+
+def render(vgm_data, ss=0, clock=MSM6295_FREQ):
+    """Render the OKIM6295 part of a VGM stream, returns (int16 samples, sample rate)
+
+    Only register 0 writes are MSM6295 commands, writes to the other VGM OKIM6295 registers
+    (clock, pin 7, banking) are ignored. The song is played once, without looping.
+    """
+    header = parse_header(vgm_data)
+    rate = sample_rate(ss, clock)
+    replay = OkiReplay()
+    t_vgm = 0
+    for offset, cmd, operands in iter_commands(vgm_data, header):
+        t_vgm += wait_samples(vgm_data, offset)
+        t = int(t_vgm * rate // VGM_SAMPLE_RATE)
+        if cmd == CMD_OKIM6295_WRITE:
+            if operands[0] == 0:
+                replay.write(t, operands[1])
+        elif cmd == CMD_DATA_BLOCK and operands[0] == DATA_BLOCK_OKIM6295_ROM and \
+                data_block_chip(vgm_data, offset) == 0:
+            replay.write_rom(*parse_okim6295_rom_block(operands[1]))
+    return replay.mix(int(t_vgm * rate // VGM_SAMPLE_RATE)), rate
+
+
+def resample(samples, rate_in, rate_out):
+    """Linear interpolation resampler, to line up a render with cps1.raw"""
+    n_out = int(len(samples) * rate_out / rate_in)
+    t_out = np.arange(n_out) * (rate_in / rate_out)
+    return np.interp(t_out, np.arange(len(samples)), samples).astype(samples.dtype)
+
+
+def write_wav(path, samples, rate, channels=1):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(int(round(rate)))
+        f.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the OKIM6295 part of a VGM file")
+    parser.add_argument("input",                                help="Input .vgm or .vgz file.")
+    parser.add_argument("-o", "--output",   default=None,       help="Output .wav file.")
+    parser.add_argument("--ss",             default=0, type=int, help="ss pin (jt6295 control ss CSR field).")
+    parser.add_argument("--rate",           default=None, type=float, help="Resample to this rate (e.g. the JT51 rate).")
+    args = parser.parse_args()
+
+    samples, rate = render(load_vgm(args.input), ss=args.ss)
+    if args.rate:
+        samples, rate = resample(samples, rate, args.rate), args.rate
+
+    output = args.output
+    if output is None:
+        output = args.input.rsplit(".", 1)[0] + ".oki.wav"
+    write_wav(output, samples, rate)
+    print(f"{output}: {len(samples)} samples at {rate:.1f}Hz")
+
+if __name__ == "__main__":
+    main()
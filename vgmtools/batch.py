@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""Parallel batch renderer: many songs through one Verilator build
+
+The simulation is built once with a song slot (sim.py --song-slot-size), a read-only memory
+the Verilog model loads from its .init file when it starts. vgmplay plays a valid slot right away
+instead of its built-in song and ends the simulation through the sim_finish CSR at the end of sound
+data (0x66, the loop is not followed) or after --samples samples.
+
+Each song then runs obj_dir/Vsim in its own work directory: the gateware directory files are
+symlinked there except the song slot .init file, written with the song, and sim_config.js,
+pointing the wavsink module to the song's WAV file. Runs are spread over a process pool.
+
+Run from the repository root:
+
+    $> python3 -m vgmtools.batch -j 4 -o build/batch/wav software/vgmplay/*.vgm software/vgmplay/*.vgz
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from vgmtools.bench import WAVSINK_RE, run, track_name
+from vgmtools.vgc import compile_vgm
+from vgmtools.vgm import load_vgm
+
+FIRMWARE_DIR = os.path.join("software", "vgmplay")
+
+SONG_SLOT_MAGIC = b"VGMS"
+SONG_SLOT_HEADER_SIZE = 16
+
+
+def song_slot_words(data, max_samples=0):
+    """Song slot memory contents (little endian 32 bit words) for a .vgm or .vgc stream"""
+    slot = bytearray(SONG_SLOT_MAGIC)
+    slot += max_samples.to_bytes(4, "little")
+    slot += len(data).to_bytes(4, "little")
+    slot += bytes(4)
+    slot += data
+    slot += bytes(-len(slot) % 4)
+    return [int.from_bytes(slot[i:i + 4], "little") for i in range(0, len(slot), 4)]
+
+
+def load_song(path, vgc=False):
+    """Song data as vgmplay expects it: uncompressed VGM or, with vgc, a compiled VGC stream"""
+    if path.endswith(".vgc"):
+        with open(path, "rb") as f:
+            return f.read()
+    data = load_vgm(path)
+    return compile_vgm(data) if vgc else data
+
+# Build --------------------------------------------------------------------------------------------
+
+def build(build_dir, song_slot_size, sim_args):
+    """Build the firmware and the simulation once, returns the gateware directory"""
+    soc_dir = os.path.join(build_dir, "soc")
+    os.makedirs(soc_dir, exist_ok=True)
+    common = [sys.executable, "sim.py", "--with-sdram", "--sim-debug", "--no-compile-gateware",
+              "--song-slot-size", str(song_slot_size), "--output-dir", soc_dir] + sim_args
+
+    # SoC headers/libraries for the firmware
+    run(common, os.path.join(build_dir, "soc.log"))
+
+    # vgmplay built-in song is never played, any track does
+    log = os.path.join(build_dir, "firmware.log")
+    make = ["make", "-C", FIRMWARE_DIR, f"BUILD_DIR={os.path.abspath(soc_dir)}"]
+    run(make + ["clean"], log)
+    run(make, log)
+    firmware = os.path.join(build_dir, "vgmplay.bin")
+    shutil.copy(os.path.join(FIRMWARE_DIR, "vgmplay.bin"), firmware)
+
+    # simulation with the firmware preloaded in SDRAM
+    run(common + ["--sdram-init", firmware, "--audio-mode", "wav"],
+        os.path.join(build_dir, "sim.log"))
+    gateware_dir = os.path.join(soc_dir, "gateware")
+    run(["bash", "build_sim.sh"], os.path.join(build_dir, "verilator.log"), cwd=gateware_dir)
+    return os.path.abspath(gateware_dir)
+
+
+def song_slot_init(gateware_dir):
+    paths = glob.glob(os.path.join(gateware_dir, "*song*.init"))
+    if len(paths) != 1:
+        raise RuntimeError(f"no song slot in {gateware_dir}, was sim.py run with --song-slot-size?")
+    return os.path.basename(paths[0])
+
+# Run ----------------------------------------------------------------------------------------------
+
+def render(gateware_dir, slot_init, song, wav, work_dir, max_samples=0, vgc=False, timeout=None):
+    """Render one song to wav in work_dir, returns the wavsink summary and timings"""
+    os.makedirs(work_dir, exist_ok=True)
+    for name in os.listdir(gateware_dir):
+        if name in (slot_init, "sim_config.js", "obj_dir") or \
+           not (name == "modules" or name.endswith((".init", ".hex"))):
+            continue
+        link = os.path.join(work_dir, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(gateware_dir, name), link)
+
+    with open(os.path.join(gateware_dir, "sim_config.js")) as f:
+        sim_config = json.load(f)
+    for module in sim_config:
+        if module.get("module") == "wavsink":
+            module["args"]["filename"] = os.path.abspath(wav)
+    with open(os.path.join(work_dir, "sim_config.js"), "w") as f:
+        json.dump(sim_config, f, indent=4)
+
+    data = load_song(song, vgc)
+    words = song_slot_words(data, max_samples)
+    with open(os.path.join(work_dir, slot_init), "w") as f:
+        f.write("".join(f"{w:08x}\n" for w in words))
+
+    log_path = os.path.join(work_dir, "sim.log")
+    start = time.time()
+    with open(log_path, "w") as log:
+        # serial2console reads stdin: keep it open, it spins on end of file
+        p = subprocess.Popen([os.path.join(gateware_dir, "obj_dir", "Vsim")], cwd=work_dir,
+                             stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            p.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+        p.stdin.close()
+    result = dict(song=song, wav=wav, total_time=time.time() - start)
+
+    with open(log_path, errors="replace") as log:
+        m = WAVSINK_RE.search(log.read())
+    if p.returncode != 0 or m is None:
+        result["error"] = f"simulation failed, see {log_path}"
+        return result
+    result["samples"] = int(m.group(1))
+    result["audio_time"] = float(m.group(2))
+    result["sim_time"] = float(m.group(3))
+    return result
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Render many songs through one simulation build")
+    parser.add_argument("songs",            nargs="+",                   help=".vgm, .vgz or .vgc files.")
+    parser.add_argument("-o", "--output",   default="build/batch/wav",  help="WAV output directory.")
+    parser.add_argument("-j", "--jobs",     default=os.cpu_count(), type=int, help="Parallel simulations.")
+    parser.add_argument("--build-dir",      default="build/batch",      help="Work directory.")
+    parser.add_argument("--no-build",       action="store_true",       help="Reuse the simulation already built in --build-dir.")
+    parser.add_argument("--song-slot-size", default=0x100000, type=lambda x: int(x, 0), help="Song slot size (bytes), must fit the largest song.")
+    parser.add_argument("--samples",        default=0, type=int,        help="Stop after this many samples (44.1kHz), 0 for the whole song.")
+    parser.add_argument("--timeout",        default=None, type=float,   help="Kill a simulation after this many seconds.")
+    parser.add_argument("--vgc",            action="store_true",       help="Compile the songs to VGC (needed with --sim-args=--with-sequencer).")
+    parser.add_argument("--json",           default=None,               help="Write results to this file.")
+    parser.add_argument("--sim-args",       default="",                 help="Extra sim.py arguments.")
+    args = parser.parse_args()
+
+    build_dir = os.path.abspath(args.build_dir)
+    os.makedirs(args.output, exist_ok=True)
+    if args.no_build:
+        gateware_dir = os.path.join(build_dir, "soc", "gateware")
+    else:
+        gateware_dir = build(build_dir, args.song_slot_size, args.sim_args.split())
+    slot_init = song_slot_init(gateware_dir)
+
+    for song in args.songs:
+        size = SONG_SLOT_HEADER_SIZE + len(load_song(song, args.vgc))
+        if size > args.song_slot_size:
+            parser.error(f"{song} needs a {size} bytes song slot, use --song-slot-size")
+
+    failed = False
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = []
+        for i, song in enumerate(args.songs):
+            name = track_name(song)
+            wav = os.path.abspath(os.path.join(args.output, name + ".wav"))
+            work_dir = os.path.join(build_dir, "runs", f"{i:03d}_{name}")
+            futures.append(pool.submit(render, gateware_dir, slot_init, song, wav, work_dir,
+                                       args.samples, args.vgc, args.timeout))
+
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            if "error" in r:
+                failed = True
+                print(f"{r['song']}: {r['error']}")
+            else:
+                print(f"{r['song']}: {r['audio_time']:.2f} s of audio in {r['total_time']:.1f} s -> {r['wav']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(sorted(results, key=lambda r: r["song"]), f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
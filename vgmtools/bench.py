@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""Audio regression and throughput benchmark
+
+Builds the simulation once (sim.py --sdram-runtime-init) and runs it on the firmware of every
+track, loaded in the SDRAM model by vgmtools/simload.py: vgmplay is built with AUTOPLAY so it
+starts playing right away and ends the simulation through the sim_finish CSR (--sim-debug) when
+the song is over, the mixer output is captured by the wavsink sim module (--audio-mode wav).
+
+For each track it reports:
+- throughput: simulated audio seconds per wall clock second, measured by wavsink between the
+  first and the last sample (boot and build time not included),
+- signal metrics against a stored reference render: correlation lag, RMS and peak error. WAV
+  files are read in chunks so multi-minute renders are never fully loaded in memory.
+
+References are the renders of a known good tree, store them with --update-references.
+
+Run from the repository root:
+
+    $> python3 -m vgmtools.bench --json bench.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+
+from vgmtools.simload import set_audio_file, write_sdram_image
+
+TRACKS = ["stf2_title.vgm", "blanka.vgm", "stf2_ryu.vgz"]
+FIRMWARE_DIR = os.path.join("software", "vgmplay")
+
+WAVSINK_RE = re.compile(r"\[wavsink\] (\d+) samples, ([\d.]+) s of audio in ([\d.]+) s")
+
+
+def run(cmd, log_path, cwd=None, timeout=None):
+    """Run cmd, output goes to log_path, raises on failure or after timeout seconds"""
+    with open(log_path, "w") as log:
+        # serial2console reads stdin: keep it open, it spins on end of file
+        ret = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT,
+                               stdin=subprocess.PIPE)
+        try:
+            ret.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            ret.kill()
+            ret.wait()
+            raise RuntimeError(f"{' '.join(cmd)} timed out after {timeout} s, see {log_path}")
+        finally:
+            ret.stdin.close()
+    if ret.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed, see {log_path}")
+    with open(log_path, errors="replace") as log:
+        return log.read()
+
+
+def track_name(track):
+    return os.path.basename(track).rsplit(".", 1)[0]
+
+# Build/Run ----------------------------------------------------------------------------------------
+
+def build_soc(build_dir, sim_args):
+    """Generate the SoC headers/libraries vgmplay is built against and compile the simulation"""
+    soc_dir = os.path.join(build_dir, "soc")
+    os.makedirs(soc_dir, exist_ok=True)
+    run([sys.executable, "sim.py", "--with-sdram", "--sdram-runtime-init", "--sim-debug",
+         "--audio-mode", "wav", "--no-compile-gateware", "--output-dir", soc_dir] + sim_args,
+        os.path.join(soc_dir, "build.log"))
+    run(["bash", "build_sim.sh"], os.path.join(soc_dir, "verilator.log"),
+        cwd=os.path.join(soc_dir, "gateware"))
+    return soc_dir
+
+
+def build_firmware(soc_dir, track, autoplay, out_dir):
+    log = os.path.join(out_dir, "firmware.log")
+    make = ["make", "-C", FIRMWARE_DIR, f"BUILD_DIR={os.path.abspath(soc_dir)}"]
+    # vgm_data.o only depends on the file name it was built with
+    run(make + ["clean"], log)
+    run(make + [f"VGM_DATA_FILE={track}", f"AUTOPLAY={autoplay}"], log)
+    firmware = os.path.join(out_dir, "vgmplay.bin")
+    shutil.copy(os.path.join(FIRMWARE_DIR, "vgmplay.bin"), firmware)
+    return firmware
+
+
+def run_sim(soc_dir, firmware, wav, out_dir, timeout=None):
+    log = os.path.join(out_dir, "sim.log")
+    gateware_dir = os.path.join(soc_dir, "gateware")
+    with open(firmware, "rb") as f:
+        write_sdram_image(gateware_dir, f.read())
+    set_audio_file(gateware_dir, wav)
+    start = time.time()
+    output = run([os.path.join("obj_dir", "Vsim")], log, cwd=gateware_dir, timeout=timeout)
+    result = dict(total_time=time.time() - start)
+    m = WAVSINK_RE.search(output)
+    if m is None:
+        raise RuntimeError(f"no wavsink summary in {log}")
+    result["samples"] = int(m.group(1))
+    result["audio_time"] = float(m.group(2))
+    result["sim_time"] = float(m.group(3))
+    result["realtime"] = result["audio_time"] / result["sim_time"] if result["sim_time"] else 0.0
+    return result
+
+# Metrics ------------------------------------------------------------------------------------------
+
+def read_frames(f, n):
+    """Next n frames of a 16 bit WAV as a float (frames, channels) array"""
+    data = np.frombuffer(f.readframes(n), dtype="<i2")
+    return data.reshape(-1, f.getnchannels()).astype(np.float64)
+
+
+def correlation_lag(render, reference, max_lag):
+    """Lag of render with respect to reference maximizing the cross correlation"""
+    a = render.mean(axis=1)
+    b = reference.mean(axis=1)
+    n = len(a) + len(b)
+    size = 1 << (n - 1).bit_length()
+    xcorr = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    lags = np.concatenate((np.arange(0, max_lag + 1), np.arange(-max_lag, 0)))
+    return int(lags[np.argmax(xcorr[lags])])
+
+
+def compare(render_path, reference_path, chunk=1 << 16, max_lag=4096):
+    """Chunked RMS/peak error between two WAV files, after lining them up"""
+    with wave.open(render_path, "rb") as render, wave.open(reference_path, "rb") as reference:
+        if (render.getframerate(), render.getnchannels()) != \
+           (reference.getframerate(), reference.getnchannels()):
+            raise ValueError(f"{render_path} and {reference_path} formats differ")
+
+        window = max(chunk, 4 * max_lag)
+        lag = correlation_lag(read_frames(render, window), read_frames(reference, window), max_lag)
+        render.rewind()
+        reference.rewind()
+        if lag > 0:
+            render.readframes(lag)
+        elif lag < 0:
+            reference.readframes(-lag)
+
+        frames = 0
+        sum_sq = 0.0
+        peak = 0.0
+        while True:
+            a = read_frames(render, chunk)
+            b = read_frames(reference, chunk)
+            n = min(len(a), len(b))
+            if n == 0:
+                break
+            err = a[:n] - b[:n]
+            sum_sq += np.sum(err ** 2)
+            peak = max(peak, np.max(np.abs(err)))
+            frames += n
+
+        return dict(
+            lag=lag,
+            rms_error=float(np.sqrt(sum_sq / (frames * render.getnchannels()))) if frames else 0.0,
+            peak_error=float(peak),
+            compared_frames=frames,
+            render_frames=render.getnframes(),
+            reference_frames=reference.getnframes(),
+        )
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio regression and throughput benchmark")
+    parser.add_argument("tracks",               nargs="*", default=TRACKS, help="Tracks in software/vgmplay.")
+    parser.add_argument("--build-dir",          default="build/bench",    help="Work directory.")
+    parser.add_argument("--references",         default=None,             help="Reference renders directory (default: <build-dir>/references).")
+    parser.add_argument("--update-references",  action="store_true",     help="Store the renders as the new references.")
+    parser.add_argument("--samples",            default=0, type=int,      help="Samples (44.1kHz) to play per track, 0 for the whole song.")
+    parser.add_argument("--chunk",              default=1 << 16, type=int, help="Frames per comparison chunk.")
+    parser.add_argument("--max-lag",            default=4096, type=int,   help="Max correlation lag (frames).")
+    parser.add_argument("--timeout",            default=3600, type=float, help="Fail a track whose simulation runs longer than this (seconds).")
+    parser.add_argument("--max-rms-error",      default=None, type=float, help="Fail if a track's RMS error is above this.")
+    parser.add_argument("--json",               default=None,             help="Write results to this file.")
+    parser.add_argument("--sim-args",           default="",               help="Extra sim.py arguments (e.g. \"--with-sequencer\").")
+    args = parser.parse_args()
+
+    sim_args = args.sim_args.split()
+    references = args.references or os.path.join(args.build_dir, "references")
+    os.makedirs(references, exist_ok=True)
+
+    soc_dir = build_soc(args.build_dir, sim_args)
+
+    results = {}
+    failed = False
+    for track in args.tracks:
+        name = track_name(track)
+        out_dir = os.path.abspath(os.path.join(args.build_dir, name))
+        os.makedirs(out_dir, exist_ok=True)
+        wav = os.path.join(out_dir, name + ".wav")
+
+        firmware = build_firmware(soc_dir, track, args.samples, out_dir)
+        try:
+            result = run_sim(soc_dir, firmware, wav, out_dir, args.timeout)
+        except RuntimeError as e:
+            # a song that never ends the simulation (or a crash) fails the track, not the bench
+            print(f"{name}: {e}")
+            results[name] = dict(error=str(e))
+            failed = True
+            continue
+
+        reference = os.path.join(references, name + ".wav")
+        if args.update_references:
+            shutil.copy(wav, reference)
+        if os.path.exists(reference):
+            result.update(compare(wav, reference, args.chunk, args.max_lag))
+            if args.max_rms_error is not None and result["rms_error"] > args.max_rms_error:
+                failed = True
+        results[name] = result
+
+    print(f"{'track':16}{'audio s':>10}{'sim s':>10}{'x realtime':>12}{'lag':>8}{'rms err':>10}{'peak err':>10}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:16}{'failed':>10}")
+            continue
+        metrics = f"{r['lag']:>8}{r['rms_error']:>10.2f}{r['peak_error']:>10.0f}" if "lag" in r else \
+                  f"{'-':>8}{'-':>10}{'-':>10}"
+        print(f"{name:16}{r['audio_time']:>10.2f}{r['sim_time']:>10.1f}{r['realtime']:>12.4f}" + metrics)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
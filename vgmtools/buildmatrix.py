@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""ULX3S build matrix: resources, fmax and build time per configuration
+
+Builds radiona_ulx3s.py for every combination of --device, --sys-clk-freq and --sdram-rate, in
+parallel processes, each in its own directory of --build-dir. From every build it reads:
+- the yosys report (gateware/radiona_ulx3s.rpt, last statistics block): LUT4 cells after
+  synthesis,
+- the nextpnr output (captured in <name>.log): used/available TRELLIS_COMB (LUTs), TRELLIS_FF,
+  MULT18X18D (DSPs) and DP16KD (BRAMs) from the device utilisation, and the achieved frequency
+  of every clock after routing,
+- the build wall time.
+
+Results go to matrix.json and matrix.csv in --build-dir and are compared against a baseline
+(store one from a known tree with --update-baseline), so the cost of a new gateware block on the
+LFE5U-12F/25F headroom shows up per configuration.
+
+Run from the repository root:
+
+    $> python3 -m vgmtools.buildmatrix --update-baseline
+    $> python3 -m vgmtools.buildmatrix --soc-args="--serial-mixer"
+    $> python3 -m vgmtools.buildmatrix --device LFE5U-25F --sys-clk-freq 25e6 50e6 --sdram-rate 1:1 1:2
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+from vgmtools.bench import run
+
+DEVICES = ["LFE5U-12F", "LFE5U-25F", "LFE5U-45F"]
+SYS_CLK_FREQS = ["25e6", "50e6"]
+SDRAM_RATES = ["1:1"]
+
+BUILD_NAME = "radiona_ulx3s"
+
+# nextpnr cell name -> result field
+RESOURCES = {
+    "TRELLIS_COMB" : "luts",
+    "TRELLIS_FF"   : "ffs",
+    "MULT18X18D"   : "dsps",
+    "DP16KD"       : "brams",
+}
+FIELDS = ["name", "device", "sys_clk_freq", "sdram_rate", "build_time", "yosys_luts"] + \
+         [f for field in RESOURCES.values() for f in (field, field + "_total")] + ["fmax", "error"]
+# fields compared against the baseline
+DIFF_FIELDS = ["yosys_luts", "luts", "ffs", "dsps", "brams", "fmax", "build_time"]
+
+UTILISATION_RE = re.compile(r"^Info:\s+(\w+):\s+(\d+)/\s*(\d+)\s+\d+%", re.M)
+FMAX_RE = re.compile(r"Max frequency for clock\s+'([^']+)': ([\d.]+) MHz \((?:PASS|FAIL) at ([\d.]+) MHz\)")
+YOSYS_CELLS_RE = re.compile(r"Number of cells:\s+(\d+)")
+YOSYS_CELL_RE = re.compile(r"^\s+(\S+)\s+(\d+)$")
+
+
+def config_name(device, sys_clk_freq, sdram_rate):
+    return f"{device}_{float(sys_clk_freq) / 1e6:g}MHz_{sdram_rate.replace(':', 'to')}"
+
+# Reports ------------------------------------------------------------------------------------------
+
+def parse_yosys(report):
+    """Cell counts of the last yosys statistics block"""
+    matches = list(YOSYS_CELLS_RE.finditer(report))
+    if not matches:
+        return {}
+    cells = {}
+    for line in report[matches[-1].end():].splitlines()[1:]:
+        m = YOSYS_CELL_RE.match(line)
+        if m is None:
+            break
+        cells[m.group(1)] = int(m.group(2))
+    return cells
+
+
+def parse_nextpnr(log):
+    """({cell: (used, available)}, {clock: (fmax, target) MHz}) from the nextpnr output
+
+    nextpnr reports the clocks after placement and after routing, the last values are kept."""
+    utilisation = {m.group(1): (int(m.group(2)), int(m.group(3))) for m in UTILISATION_RE.finditer(log)}
+    clocks = {m.group(1): (float(m.group(2)), float(m.group(3))) for m in FMAX_RE.finditer(log)}
+    return utilisation, clocks
+
+
+def parse_build(result, gateware_dir, log):
+    rpt = os.path.join(gateware_dir, BUILD_NAME + ".rpt")
+    if os.path.exists(rpt):
+        with open(rpt, errors="replace") as f:
+            result["yosys_luts"] = parse_yosys(f.read()).get("LUT4")
+    utilisation, clocks = parse_nextpnr(log)
+    for cell, field in RESOURCES.items():
+        result[field], result[field + "_total"] = utilisation.get(cell, (None, None))
+    result["clocks"] = {clock: fmax for clock, (fmax, target) in clocks.items()}
+    # system clock: the one constrained to --sys-clk-freq, else the slowest
+    target = float(result["sys_clk_freq"]) / 1e6
+    sys_clocks = [fmax for fmax, t in clocks.values() if abs(t - target) < 0.01] or \
+                 [fmax for fmax, t in clocks.values()]
+    result["fmax"] = min(sys_clocks) if sys_clocks else None
+    return result
+
+# Build --------------------------------------------------------------------------------------------
+
+def build(build_dir, device, sys_clk_freq, sdram_rate, soc_args, no_build=False):
+    name = config_name(device, sys_clk_freq, sdram_rate)
+    out_dir = os.path.join(build_dir, name)
+    log_path = os.path.join(build_dir, name + ".log")
+    result = {"name": name, "device": device, "sys_clk_freq": sys_clk_freq, "sdram_rate": sdram_rate}
+
+    start = time.time()
+    try:
+        if no_build:
+            with open(log_path, errors="replace") as f:
+                log = f.read()
+        else:
+            log = run([sys.executable, "radiona_ulx3s.py", "--build",
+                       "--device", device,
+                       "--sys-clk-freq", sys_clk_freq,
+                       "--sdram-rate", sdram_rate,
+                       "--output-dir", out_dir] + soc_args, log_path)
+            result["build_time"] = time.time() - start
+    except (OSError, RuntimeError) as e:
+        result["error"] = str(e)
+        return result
+    return parse_build(result, os.path.join(out_dir, "gateware"), log)
+
+
+def diff(results, baseline):
+    """Lines of the changes against the baseline"""
+    lines = []
+    baseline = {r["name"]: r for r in baseline}
+    for r in results:
+        b = baseline.get(r["name"])
+        if b is None:
+            lines.append(f"{r['name']}: not in the baseline")
+            continue
+        changes = []
+        for field in DIFF_FIELDS:
+            new, old = r.get(field), b.get(field)
+            if new is None or old is None or new == old:
+                continue
+            change = f"{field} {old:g} -> {new:g} ({new - old:+g}"
+            changes.append(change + (f", {100 * (new - old) / old:+.1f}%)" if old else ")"))
+        lines.append(f"{r['name']}: " + (", ".join(changes) if changes else "unchanged"))
+    return lines
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a matrix of ULX3S configurations and report resources/fmax")
+    parser.add_argument("--device",          nargs="+", default=DEVICES,       help="FPGA devices.")
+    parser.add_argument("--sys-clk-freq",    nargs="+", default=SYS_CLK_FREQS, help="System clock frequencies.")
+    parser.add_argument("--sdram-rate",      nargs="+", default=SDRAM_RATES,   help="SDRAM rates (1:1 or 1:2).")
+    parser.add_argument("-j", "--jobs",      default=os.cpu_count(), type=int, help="Parallel builds.")
+    parser.add_argument("--build-dir",       default="build/matrix",          help="Work directory.")
+    parser.add_argument("--no-build",        action="store_true",            help="Only parse the logs and reports of the last builds.")
+    parser.add_argument("--baseline",        default=None,                    help="Baseline results (default: <build-dir>/baseline.json).")
+    parser.add_argument("--update-baseline", action="store_true",            help="Store the results as the new baseline.")
+    parser.add_argument("--soc-args",        default="",                      help="Extra radiona_ulx3s.py arguments (e.g. \"--serial-mixer\").")
+    args = parser.parse_args()
+
+    build_dir = os.path.abspath(args.build_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    baseline_path = args.baseline or os.path.join(build_dir, "baseline.json")
+    configs = list(itertools.product(args.device, args.sys_clk_freq, args.sdram_rate))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(build, build_dir, *config, args.soc_args.split(), args.no_build)
+                   for config in configs]
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(f"{r['name']}: {r['error'] if 'error' in r else 'done'}")
+    order = [config_name(*config) for config in configs]
+    results.sort(key=lambda r: order.index(r["name"]))
+
+    with open(os.path.join(build_dir, "matrix.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.join(build_dir, "matrix.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+    def usage(r, field):
+        return f"{r[field]}/{r[field + '_total']}" if r.get(field) is not None else "-"
+
+    def number(r, field, fmt):
+        return f"{r[field]:{fmt}}" if r.get(field) is not None else "-"
+
+    print(f"{'configuration':28}{'LUTs':>14}{'FFs':>14}{'DSPs':>8}{'BRAMs':>8}{'fmax MHz':>10}{'build s':>9}")
+    for r in results:
+        print(f"{r['name']:28}{usage(r, 'luts'):>14}{usage(r, 'ffs'):>14}{usage(r, 'dsps'):>8}"
+              f"{usage(r, 'brams'):>8}{number(r, 'fmax', '.2f'):>10}{number(r, 'build_time', '.0f'):>9}")
+
+    if args.update_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print(f"\nchanges against {baseline_path}:")
+        for line in diff(results, baseline):
+            print(line)
+
+    sys.exit(1 if any("error" in r for r in results) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Capture the audio the board plays to a WAV file, over the UART bridge
+
+A SoC built with --with-audio-capture writes the 16-bit mixer output (and with
+--audio-capture-sources the FM/PCM mixer inputs of every pair) at every JT51 sample to an SDRAM
+ring buffer, without the CPU (gateware/capture.py). This tool drives it through litex_server:
+start arms the capture, stop ends it and reads the ring buffer back to a WAV file, record does
+both around a number of seconds. Channels and rate come from the csr.csv constants.
+
+Build with a UART bridge, run litex_server, play the song (vgmplay on the crossover UART):
+
+    $> ./radiona_ulx3s.py --build --with-audio-capture --uart-name crossover+uartbone --csr-csv csr.csv
+    $> litex_server --uart --uart-port /dev/ttyUSB0
+    $> python3 -m vgmtools.capture start
+    $> python3 -m vgmtools.capture stop -o board.wav
+
+Reading back is bound by the UART: about 10 KB/s at 115200 baud, 22 s per second of stereo.
+"""
+
+import argparse
+import struct
+import sys
+import time
+import wave
+
+from litex.tools.litex_client import RemoteClient
+
+# Etherbone records carry up to 255 reads
+READ_BURST = 255
+
+
+def start(bus, base, length, loop):
+    regs = bus.regs
+    regs.audio_capture_dma_enable.write(0)
+    if base is not None:
+        regs.audio_capture_dma_base.write(base)
+    if length is not None:
+        regs.audio_capture_dma_length.write(length)
+    regs.audio_capture_dma_loop.write(int(loop))
+    regs.audio_capture_dma_enable.write(1)
+
+
+def stop(bus, out, max_seconds=None):
+    """Stops the capture and writes what the ring buffer holds to out, returns (frames, dropped)"""
+    regs = bus.regs
+    regs.audio_capture_dma_enable.write(0)
+    count = regs.audio_capture_count.read()
+    dropped = regs.audio_capture_dropped.read()
+    base = regs.audio_capture_dma_base.read()
+    length = regs.audio_capture_dma_length.read() // 4
+
+    channels = bus.constants.audio_capture_channels
+    rate = bus.constants.audio_capture_rate
+    n_words = channels // 2
+
+    # only read the part of the ring holding the capture (or the last max_seconds of it)
+    wanted = min(count, length)
+    if max_seconds is not None:
+        wanted = min(wanted, int(max_seconds * rate) * n_words)
+    first = (count - wanted) % length
+    addresses = [(first + i) % length for i in range(wanted)]
+
+    # in bursts, split where the ring wraps
+    runs = []
+    for a in addresses:
+        if runs and a == runs[-1][0] + runs[-1][1] and runs[-1][1] < READ_BURST:
+            runs[-1][1] += 1
+        else:
+            runs.append([a, 1])
+    words = []
+    for a, n in runs:
+        words += bus.read(base + 4 * a, n)
+        print(f"\r{4 * len(words)} / {4 * wanted} bytes", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+    # words from the oldest one read: drop the partial frame it may start with
+    skip = -(count - wanted) % n_words
+    words = words[skip:]
+    words = words[:len(words) - len(words) % n_words]
+
+    with wave.open(out, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(struct.pack(f"<{len(words)}I", *words))
+    return len(words) // n_words, dropped
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture the audio the board plays to a WAV file, over the UART bridge")
+    parser.add_argument("command",       choices=["start", "stop", "record"], help="start the capture, stop it and read it back, or both around --seconds.")
+    parser.add_argument("-o", "--output", default="capture.wav",          help="WAV file (stop, record).")
+    parser.add_argument("--csr-csv",     default="csr.csv",              help="CSR map of the SoC.")
+    parser.add_argument("--host",        default="localhost",            help="litex_server host.")
+    parser.add_argument("--port",        default=1234, type=int,         help="litex_server port.")
+    parser.add_argument("--base",        default=None, type=lambda x: int(x, 0), help="Ring buffer address (default: the SoC's).")
+    parser.add_argument("--length",      default=None, type=lambda x: int(x, 0), help="Ring buffer size in bytes (default: the SoC's).")
+    parser.add_argument("--no-loop",     action="store_true",            help="Stop when the buffer is full instead of overwriting the oldest samples.")
+    parser.add_argument("--seconds",     default=None, type=float,       help="record: capture length. stop: only read back the last seconds.")
+    args = parser.parse_args()
+
+    if args.command == "record" and args.seconds is None:
+        parser.error("record needs --seconds")
+
+    bus = RemoteClient(host=args.host, port=args.port, csr_csv=args.csr_csv)
+    bus.open()
+    try:
+        if args.command in ("start", "record"):
+            start(bus, args.base, args.length, not args.no_loop)
+        if args.command == "record":
+            time.sleep(args.seconds)
+        if args.command in ("stop", "record"):
+            frames, dropped = stop(bus, args.output, args.seconds)
+            rate = bus.constants.audio_capture_rate
+            print(f"{args.output}: {frames} frames ({frames / rate:.2f} s), {dropped} samples dropped")
+    finally:
+        bus.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+"""Migen simulation checks and microbenchmarks of the Python gateware blocks
+
+Runs the pure Migen parts with migen.sim (run_simulation), no Verilator build, the JT51/JT6295
+Verilog instances left out:
+- clock enables: CenJT51 (cen and cen_p1), CenJT6295 and the sample scheduler CenFraction, their
+  frequency over the simulated cycles and the long term one (tuning word or exact fraction)
+  against YM2151_FREQ, MSM6295_FREQ and the VGM sample rate,
+- JT6295RomWishboneDMAReader, byte reader and line buffer, on a Wishbone memory model with wait
+  states (first beat) and burst wait states (next beats of an incrementing burst): cycles per
+  fetch and fetches per second under address patterns of 4-voice ADPCM playback, every byte
+  checked against the ROM,
+- the CSR glue of JT51 (register write FIFO and cs_n/a0/wr_n sequencing against a busy flag
+  model) and JT6295 (command write port): cycles per write, every write checked on the pins.
+
+Fails (exit code 1) when a check fails. Run from the repository root:
+
+    $> python3 -m vgmtools.gatebench
+    $> python3 -m vgmtools.gatebench --wait-states 0 4 12 --burst-wait-states 1 --json gatebench.json
+"""
+
+import argparse
+import json
+import random
+import sys
+
+from migen import *
+from migen.sim import passive
+from litex.soc.interconnect import wishbone
+
+from gateware.jt51.jt51 import JT51, CenJT51, YM2151_FREQ
+from gateware.jt6295.jt6295 import JT6295, CenJT6295, JT6295RomWishboneDMAReader, MSM6295_FREQ
+from gateware.samplescheduler import CenFraction, VGM_SAMPLE_RATE
+
+PATTERNS = ["adpcm4", "adpcm4_keyon", "sequential", "random"]
+
+
+class NoSourcesPlatform:
+    """Platform stand-in: the Verilog sources aren't simulated"""
+    def add_source(self, *args, **kwargs):
+        pass
+
+    def add_source_dir(self, *args, **kwargs):
+        pass
+
+    def add_verilog_include_path(self, *args, **kwargs):
+        pass
+
+
+# Clock enables ------------------------------------------------------------------------------------
+
+def measure_cen(module, signals, cycles):
+    """Pulses of each signal over cycles"""
+    counts = [0] * len(signals)
+
+    def generator():
+        for i in range(cycles):
+            for j, s in enumerate(signals):
+                counts[j] += (yield s)
+            yield
+
+    run_simulation(module, generator())
+    return counts
+
+
+def bench_cens(clk_freq, cycles):
+    """[(name, target Hz, long term Hz, measured Hz)] of the clock enables at clk_freq"""
+    jt51_word = int((YM2151_FREQ / clk_freq) * 2 ** 32)
+    jt6295_word = int((MSM6295_FREQ / clk_freq) * 2 ** 32)
+    results = []
+
+    cen = CenJT51(jt51_word)
+    n_cen, n_cen_p1 = measure_cen(cen, [cen.cen, cen.cen_p1], cycles)
+    long_term = jt51_word * clk_freq / 2 ** 32
+    results.append(("CenJT51.cen", YM2151_FREQ, long_term, n_cen * clk_freq / cycles))
+    results.append(("CenJT51.cen_p1", YM2151_FREQ / 2, long_term / 2, n_cen_p1 * clk_freq / cycles))
+
+    cen = CenJT6295(jt6295_word)
+    n_cen, = measure_cen(cen, [cen.cen], cycles)
+    results.append(("CenJT6295.cen", MSM6295_FREQ, jt6295_word * clk_freq / 2 ** 32, n_cen * clk_freq / cycles))
+
+    cen = CenFraction(clk_freq, VGM_SAMPLE_RATE)
+    n_cen, = measure_cen(cen, [cen.ce], cycles)
+    results.append(("CenFraction.ce", VGM_SAMPLE_RATE, VGM_SAMPLE_RATE, n_cen * clk_freq / cycles))
+    return results
+
+# ROM reader ---------------------------------------------------------------------------------------
+
+class WishboneMemoryModel(Module):
+    """Wishbone ROM with wait states
+
+    The first beat of a cycle is acked wait_states + 1 cycles after stb, the next beats of an
+    incrementing burst (cti 0b010) every burst_wait_states + 1 cycles.
+    """
+    def __init__(self, bus, init, wait_states=0, burst_wait_states=0):
+        mem = Memory(bus.data_width, len(init), init=init)
+        port = mem.get_port(async_read=True)
+        self.specials += mem, port
+
+        burst = Signal()
+        count = Signal(max=max(wait_states, burst_wait_states) + 2)
+        wait = Signal.like(count)
+        in_burst = Signal()
+        self.comb += [
+            port.adr.eq(bus.adr),
+            bus.dat_r.eq(port.dat_r),
+            in_burst.eq(bus.cti == 0b010),
+            wait.eq(Mux(burst, burst_wait_states, wait_states)),
+        ]
+
+        # next beat of a burst: acked right away without burst wait states
+        next_beat = [bus.ack.eq(1)] if burst_wait_states == 0 else []
+        self.sync += [
+            bus.ack.eq(0),
+            If(~(bus.cyc & bus.stb),
+                count.eq(0),
+                burst.eq(0)
+            ).Elif(bus.ack,
+                burst.eq(in_burst),
+                count.eq(in_burst),
+                If(in_burst, *next_beat)
+            ).Elif(count == wait,
+                bus.ack.eq(1)
+            ).Else(
+                count.eq(count + 1)
+            )
+        ]
+
+
+def rom_words(rom, data_width):
+    """Little endian memory words of a ROM image"""
+    step = data_width // 8
+    return [int.from_bytes(rom[i:i + step], "little") for i in range(0, len(rom), step)]
+
+
+def adpcm_pattern(pattern, rom_size, n_fetches, rng):
+    """ROM byte addresses read by the JT6295 for a playback pattern
+
+    adpcm4: the 4 voices play from their own ROM area, round robin, one byte (two nibbles) every
+    other round. adpcm4_keyon: the same, a voice reading the 8 byte phrase header of the phrase
+    table (first 1KB) and jumping to a new start now and then. sequential: one voice. random:
+    no locality at all.
+    """
+    addresses = []
+    data_start = min(0x400, rom_size // 2)
+    data_size = rom_size - data_start
+    if pattern == "random":
+        while len(addresses) < n_fetches:
+            addresses.append(rng.randrange(rom_size))
+    elif pattern == "sequential":
+        start = rng.randrange(data_start, rom_size)
+        addresses = [data_start + (start - data_start + i // 2) % data_size for i in range(n_fetches)]
+    else:
+        voices = [data_start + k * data_size // 4 + rng.randrange(data_size // 8) for k in range(4)]
+        step = 0
+        while len(addresses) < n_fetches:
+            for k in range(4):
+                if pattern == "adpcm4_keyon" and rng.randrange(256) == 0:
+                    phrase = rng.randrange(min(128, data_start // 8))
+                    addresses.extend(8 * phrase + i for i in range(8))
+                    voices[k] = data_start + rng.randrange(data_size)
+                addresses.append(voices[k])
+                if step & 1:
+                    voices[k] = data_start + (voices[k] - data_start + 1) % data_size
+            step += 1
+    # a repeated address isn't a fetch (the reader starts at address 0)
+    fetches = [a for a, prev in zip(addresses, [0] + addresses) if a != prev]
+    return fetches[:n_fetches]
+
+
+def bench_rom_reader(pattern, n_lines, line_words, wait_states, burst_wait_states, rom_size,
+                     n_fetches, seed):
+    """Cycles of each fetch of an address pattern, data checked"""
+    rng = random.Random(seed)
+    rom = bytes(rng.randrange(256) for i in range(rom_size))
+    bus_width = 32 if n_lines else 8
+    address_width = (rom_size - 1).bit_length()
+    bus = wishbone.Interface(data_width=bus_width, adr_width=address_width - log2_int(bus_width // 8))
+
+    class Bench(Module):
+        def __init__(self):
+            self.submodules.reader = JT6295RomWishboneDMAReader(bus, n_lines=n_lines, line_words=line_words)
+            self.submodules.memory = WishboneMemoryModel(bus, rom_words(rom, bus_width),
+                                                         wait_states, burst_wait_states)
+    dut = Bench()
+    reader = dut.reader
+    addresses = adpcm_pattern(pattern, rom_size, n_fetches, rng)
+    latencies = []
+    errors = []
+    hits = []
+
+    def generator():
+        for address in addresses:
+            # cycles after the one the address changes in, like the perf latency histogram
+            yield reader.i_rom_addr.eq(address)
+            yield
+            cycles = 0
+            while not (yield reader.o_rom_ok):
+                yield
+                cycles += 1
+                if cycles > 10000:
+                    errors.append(f"no o_rom_ok for {address:#x}")
+                    return
+            data = yield reader.o_rom_data
+            if data != rom[address]:
+                errors.append(f"{address:#x}: read {data:#04x}, ROM {rom[address]:#04x}")
+            latencies.append(cycles)
+        if n_lines:
+            hits.append((yield reader.hits))
+
+    run_simulation(dut, generator())
+
+    result = dict(
+        fetches=len(latencies),
+        cycles=sum(latencies),
+        cycles_per_fetch=sum(latencies) / len(latencies) if latencies else 0.0,
+        max_cycles=max(latencies, default=0),
+        errors=errors,
+    )
+    if hits:
+        result["hit_rate"] = hits[0] / len(latencies)
+    return result
+
+# CSR glue -----------------------------------------------------------------------------------------
+
+class JT51Glue(JT51):
+    """JT51 without the jt51 instance: dout (busy flag) is driven by the bench"""
+    def do_finalize(self):
+        pass
+
+
+class JT6295Glue(JT6295):
+    """JT6295 without the jt6295 and jtframe_pole instances"""
+    def __init__(self, *args, **kwargs):
+        JT6295.__init__(self, *args, **kwargs)
+        self.low_pass_filter.do_finalize = lambda: None
+
+    def do_finalize(self):
+        pass
+
+
+def bench_jt51_glue(clk_freq, n_writes, busy_cen, seed):
+    """Register writes through the cmd CSR FIFO, seen on the chip pins with a busy flag model"""
+    rng = random.Random(seed)
+    dut = JT51Glue(NoSourcesPlatform(), clk_freq)
+    pins = dut.jt51_params
+    cen = dut.clock_enable.cen
+    writes = [(rng.randrange(256), rng.randrange(256)) for i in range(n_writes)]
+    seen = []
+    stats = dict(cycles=0, stall_cycles=0, overflow=0)
+
+    @passive
+    def chip():
+        addr = None
+        busy = 0
+        while True:
+            if (yield cen):
+                if busy:
+                    busy -= 1
+                if not (yield pins["i_cs_n"]) and not (yield pins["i_wr_n"]):
+                    if (yield pins["i_a0"]):
+                        if busy:
+                            seen.append(("write while busy", addr))
+                        seen.append((addr, (yield pins["i_din"])))
+                        busy = busy_cen
+                    else:
+                        addr = yield pins["i_din"]
+            yield pins["o_dout"].eq(0x80 if busy else 0)
+            yield
+
+    # checks the FIFO level like the player (ym2151_cmd_space), then waits for the last write on
+    # the pins
+    def cpu():
+        cycles = 0
+        for addr, data in writes:
+            while (yield dut._cmd_status.fields.level) >= dut.cmd_fifo_depth:
+                stats["stall_cycles"] += 1
+                cycles += 1
+                yield
+            yield dut._cmd.fields.addr.eq(addr)
+            yield dut._cmd.fields.data.eq(data)
+            yield dut._cmd.re.eq(1)
+            yield
+            yield dut._cmd.re.eq(0)
+            cycles += 1
+        while len(seen) < n_writes and cycles < 1000 * n_writes * busy_cen:
+            yield
+            cycles += 1
+        stats["cycles"] = cycles
+        stats["overflow"] = (yield dut._cmd_status.fields.overflow)
+
+    run_simulation(dut, [cpu(), chip()])
+
+    errors = [] if seen == writes else [f"{len(seen)} writes seen, first difference at " +
+                                        str(next((i for i, (a, b) in enumerate(zip(seen, writes)) if a != b), len(seen)))]
+    if stats["overflow"]:
+        errors.append("cmd FIFO overflow")
+    return dict(writes=n_writes, cycles=stats["cycles"], cycles_per_write=stats["cycles"] / n_writes,
+                cpu_stall_cycles=stats["stall_cycles"], errors=errors)
+
+
+def bench_jt6295_glue(clk_freq, n_writes, seed):
+    """Commands through the hardware write port, seen on wr_n/din"""
+    rng = random.Random(seed)
+    dut = JT6295Glue(NoSourcesPlatform(), clk_freq)
+    pins = dut.jt6295_params
+    cen = dut.clock_enable.cen
+    commands = [rng.randrange(256) for i in range(n_writes)]
+    seen = []
+    stats = dict(cycles=0)
+
+    @passive
+    def chip():
+        while True:
+            if (yield cen) and not (yield pins["i_wrn"]):
+                seen.append((yield pins["i_din"]))
+            yield
+
+    def writer():
+        cycles = 0
+        for data in commands:
+            yield dut.sink.valid.eq(1)
+            yield dut.sink.data.eq(data)
+            yield
+            cycles += 1
+            while not (yield dut.sink.ready):
+                yield
+                cycles += 1
+        yield dut.sink.valid.eq(0)
+        stats["cycles"] = cycles
+
+    run_simulation(dut, [writer(), chip()])
+
+    errors = [] if seen == commands else [f"{len(seen)} commands seen, {n_writes} written"]
+    return dict(writes=n_writes, cycles=stats["cycles"], cycles_per_write=stats["cycles"] / n_writes,
+                errors=errors)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Migen simulation checks and microbenchmarks of the Python gateware blocks")
+    parser.add_argument("--clk-freq",           default=[24e6], type=float, nargs="+", help="System clock frequencies (24MHz: sim.py, 25MHz: radiona_ulx3s.py default), the first one for the throughputs.")
+    parser.add_argument("--cen-cycles",         default=20000, type=int,  help="Cycles simulated per clock enable.")
+    parser.add_argument("--patterns",           default=PATTERNS, nargs="+", choices=PATTERNS, help="ROM address patterns.")
+    parser.add_argument("--fetches",            default=400, type=int,    help="ROM fetches per pattern.")
+    parser.add_argument("--rom-size",           default=16384, type=int,  help="Simulated ROM size (bytes).")
+    parser.add_argument("--rom-lines",          default=[0, 4], type=int, nargs="+", help="ROM reader line buffer lines (0: byte reader).")
+    parser.add_argument("--rom-line-words",     default=4, type=int,      help="ROM reader words per line.")
+    parser.add_argument("--wait-states",        default=[0, 4], type=int, nargs="+", help="Memory model wait states (first beat).")
+    parser.add_argument("--burst-wait-states",  default=0, type=int,      help="Memory model wait states of the next burst beats.")
+    parser.add_argument("--glue-writes",        default=40, type=int,     help="Register writes of the JT51/JT6295 CSR glue benchmarks.")
+    parser.add_argument("--jt51-busy-cen",      default=64, type=int,     help="JT51 busy flag model: cen periods busy after a write.")
+    parser.add_argument("--seed",               default=0, type=int,      help="Random seed (ROM contents, patterns).")
+    parser.add_argument("--json",               default=None,             help="Write results to this file.")
+    args = parser.parse_args()
+
+    results = dict(cens={}, rom_reader={}, glue={})
+    failed = False
+
+    # measured over --cen-cycles, to within one pulse (res ppm)
+    print(f"{'clock enable':20}{'clk MHz':>9}{'target Hz':>13}{'long term Hz':>15}{'ppm':>10}{'measured Hz':>15}{'ppm':>10}{'res ppm':>10}")
+    for clk_freq in args.clk_freq:
+        for name, target, long_term, measured in bench_cens(clk_freq, args.cen_cycles):
+            results["cens"][f"{name}@{clk_freq:g}"] = dict(target=target, long_term=long_term, measured=measured)
+            print(f"{name:20}{clk_freq / 1e6:>9.3f}{target:>13.1f}{long_term:>15.3f}"
+                  f"{(long_term / target - 1) * 1e6:>10.1f}{measured:>15.1f}{(measured / target - 1) * 1e6:>10.1f}"
+                  f"{clk_freq / args.cen_cycles / target * 1e6:>10.1f}")
+
+    clk_freq = args.clk_freq[0]
+    print(f"\n{'rom reader':20}{'pattern':>14}{'wait':>6}{'cycles/fetch':>14}{'max':>6}{'Mfetch/s':>10}{'hit rate':>10}")
+    for n_lines in args.rom_lines:
+        reader = f"lines={n_lines}" if n_lines else "byte"
+        for wait_states in args.wait_states:
+            for pattern in args.patterns:
+                r = bench_rom_reader(pattern, n_lines, args.rom_line_words, wait_states,
+                                     args.burst_wait_states, args.rom_size, args.fetches, args.seed)
+                results["rom_reader"][f"{reader}/{pattern}/wait={wait_states}"] = r
+                failed |= bool(r["errors"])
+                hit_rate = f"{r['hit_rate']:>10.3f}" if "hit_rate" in r else f"{'-':>10}"
+                mfetch = clk_freq / r["cycles_per_fetch"] / 1e6 if r["cycles_per_fetch"] else 0.0
+                print(f"{reader:20}{pattern:>14}{wait_states:>6}{r['cycles_per_fetch']:>14.2f}{r['max_cycles']:>6}"
+                      f"{mfetch:>10.3f}" + hit_rate)
+                for e in r["errors"][:4]:
+                    print(f"  error: {e}")
+
+    print(f"\n{'csr glue':20}{'writes':>8}{'cycles/write':>14}{'cpu stall':>11}")
+    for name, r in [("jt51", bench_jt51_glue(clk_freq, args.glue_writes, args.jt51_busy_cen, args.seed)),
+                    ("jt6295", bench_jt6295_glue(clk_freq, args.glue_writes, args.seed))]:
+        results["glue"][name] = r
+        failed |= bool(r["errors"])
+        print(f"{name:20}{r['writes']:>8}{r['cycles_per_write']:>14.1f}{str(r.get('cpu_stall_cycles', '-')):>11}")
+        for e in r["errors"]:
+            print(f"  error: {e}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
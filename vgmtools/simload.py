@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""Load a firmware image in the SDRAM model of a built simulation and run it
+
+sim.py --sdram-runtime-init gives every bank memory of the SDRAM model an .init file: the
+Verilator model reads them with $readmemh when it starts, so they can be rewritten for each
+firmware build (or song) without compiling the simulation again. sim.py describes the model in
+sdram_image.json of the gateware directory (geometry and bank files), this tool splits the image
+in banks the way SDRAMPHYModel does for --sdram-init, writes the files and runs obj_dir/Vsim.
+
+Build once, then load each new firmware:
+
+    $> ./sim.py --with-sdram --sdram-runtime-init
+    $> python3 -m vgmtools.simload software/vgmplay/vgmplay.bin
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_GATEWARE_DIR = os.path.join("build", "sim", "gateware")
+
+
+def image_words(data, endianness="little"):
+    """32-bit words of a binary image"""
+    data = data + bytes(-len(data) % 4)
+    return [int.from_bytes(data[i:i + 4], endianness) for i in range(0, len(data), 4)]
+
+
+def sdram_bank_words(config, words):
+    """Contents of each bank memory for the image 32-bit words (litedram SDRAMPHYModel layout)"""
+    nbanks, nrows, ncols = config["nbanks"], config["nrows"], config["ncols"]
+    data_width = config["data_width"]
+    bank_size = (config["databits"] // 8) * nrows * ncols
+    model_bank_size = bank_size // (data_width // 8)
+    model_column_size = model_bank_size // nrows
+    if len(words) * 4 > bank_size * nbanks:
+        raise ValueError(f"{4 * len(words)} bytes image, the SDRAM holds {bank_size * nbanks}")
+
+    # 32-bit words to model words
+    if data_width > 32:
+        ratio = data_width // 32
+        words = words + [0] * (-len(words) % ratio)
+        words = [sum(w << (32 * j) for j, w in enumerate(words[i:i + ratio]))
+                 for i in range(0, len(words), ratio)]
+    elif data_width < 32:
+        ratio = 32 // data_width
+        mask = (1 << data_width) - 1
+        words = [(w >> (data_width * j)) & mask for w in words for j in range(ratio)]
+
+    banks = [[] for i in range(nbanks)]
+    if config["address_mapping"] == "ROW_BANK_COL":
+        for row in range(nrows):
+            for bank in range(nbanks):
+                start = (row * nbanks + bank) * model_column_size
+                if start >= len(words):
+                    return banks
+                banks[bank].extend(words[start:start + model_column_size])
+    elif config["address_mapping"] == "BANK_ROW_COL":
+        for bank in range(nbanks):
+            banks[bank] = words[bank * model_bank_size:(bank + 1) * model_bank_size]
+    else:
+        raise ValueError(f"unknown address mapping {config['address_mapping']}")
+    return banks
+
+
+def write_sdram_image(gateware_dir, image, out_dir=None):
+    """Writes the bank .init files of the image (bytes) to out_dir (default: gateware_dir)"""
+    config_path = os.path.join(gateware_dir, "sdram_image.json")
+    if not os.path.exists(config_path):
+        raise RuntimeError(f"no {config_path}, was sim.py run with --sdram-runtime-init?")
+    with open(config_path) as f:
+        config = json.load(f)
+
+    banks = sdram_bank_words(config, image_words(image, config["endianness"]))
+    digits = config["data_width"] // 4
+    for name, words in zip(config["files"], banks):
+        with open(os.path.join(out_dir or gateware_dir, name), "w") as f:
+            f.write("".join(f"{w:0{digits}x}\n" for w in words))
+
+
+def set_audio_file(gateware_dir, audio_file):
+    """Points the wavsink module of sim_config.js to audio_file"""
+    path = os.path.join(gateware_dir, "sim_config.js")
+    with open(path) as f:
+        sim_config = json.load(f)
+    for module in sim_config:
+        if module.get("module") == "wavsink":
+            module["args"]["filename"] = os.path.abspath(audio_file)
+    with open(path, "w") as f:
+        json.dump(sim_config, f, indent=4)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a firmware image in the SDRAM model of a built simulation and run it")
+    parser.add_argument("image",                                           help="Firmware image (.bin) loaded at the start of the SDRAM.")
+    parser.add_argument("--gateware-dir", default=DEFAULT_GATEWARE_DIR,    help="Gateware directory of the sim.py --sdram-runtime-init build.")
+    parser.add_argument("--audio-file",   default=None,                    help="WAV output file (--audio-mode wav builds).")
+    parser.add_argument("--no-run",       action="store_true",            help="Only write the SDRAM .init files.")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        write_sdram_image(args.gateware_dir, f.read())
+    if args.audio_file:
+        set_audio_file(args.gateware_dir, args.audio_file)
+    if args.no_run:
+        return
+
+    vsim = os.path.join("obj_dir", "Vsim")
+    if not os.path.exists(os.path.join(args.gateware_dir, vsim)):
+        parser.error(f"no {vsim} in {args.gateware_dir}, run sim.py once to compile the simulation")
+    sys.exit(subprocess.call([vsim], cwd=args.gateware_dir))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""Stream a song to vgmplay over the UART while it plays
+
+vgmplay built with UART_STREAM=1 plays the sound data it receives from this tool, framed as
+described in software/vgmplay/uartstream.h:
+- OKIM6295 ROM data blocks are written to the ROM with 'R' frames before playing (data blocks
+  found later in the song are sent in line, ahead of their time),
+- the rest of the sound data is split on command boundaries into 'D' frames appended to the
+  device ring buffer. The device reports its read position and ring head in status frames: the
+  host never sends past position + ring size (its credit), so the ring is kept as full as possible
+  and the lead time is what it holds. Playback starts once the ring is full or --lead seconds are
+  buffered,
+- frames lost on the way (bad checksum) show up in the device error count: data is sent again
+  from the ring head. ROM frames are sent one at a time, again until the device count of applied
+  ROM frames goes up.
+
+The loop is unrolled --loops times, the song then ends (0x66) and the device stops.
+
+    $> python3 -m vgmtools.uartstream /dev/ttyUSB0 software/vgmplay/stf2_ryu.vgz
+    $> python3 -m vgmtools.uartstream socket://localhost:2000 software/vgmplay/blanka.vgm
+"""
+
+import argparse
+import struct
+import sys
+import time
+
+import serial
+
+from vgmtools.vgm import (CMD_DATA_BLOCK, CMD_END, DATA_BLOCK_OKIM6295_ROM, VGM_SAMPLE_RATE,
+                          data_block_chip, iter_commands, load_vgm, parse_header,
+                          parse_okim6295_rom_block, wait_samples)
+
+SYNC = b"\xa5\x5a"
+MAX_DATA_SIZE = 1024
+
+FRAME_HELLO = ord("H")
+FRAME_ROM = ord("R")
+FRAME_DATA = ord("D")
+FRAME_PLAY = ord("P")
+FRAME_STOP = ord("S")
+FRAME_STATUS = ord("I")
+
+STATUS_FIELDS = ("position", "head", "ring_size", "underruns", "sample", "errors", "flags", "rom_frames")
+STATUS_PLAYING = 0x1
+STATUS_FINISHED = 0x2
+
+
+def fletcher16(data):
+    sum1 = sum2 = 0
+    for value in data:
+        sum1 = (sum1 + value) % 255
+        sum2 = (sum2 + sum1) % 255
+    return bytes([sum1, sum2])
+
+
+def frame(frame_type, payload=b""):
+    body = bytes([frame_type]) + len(payload).to_bytes(2, "little") + payload
+    return SYNC + body + fletcher16(body)
+
+
+class FrameReader:
+    """Splits received bytes into frames, bytes outside frames are the device console output"""
+
+    def __init__(self, console=sys.stderr):
+        self.buffer = bytearray()
+        self.console = console
+
+    def feed(self, data):
+        """Returns the (type, payload) frames completed by data"""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # keep a trailing sync byte
+                keep = 1 if self.buffer.endswith(SYNC[:1]) else 0
+                self.write_console(self.buffer[:len(self.buffer) - keep])
+                del self.buffer[:len(self.buffer) - keep]
+                return frames
+            self.write_console(self.buffer[:start])
+            del self.buffer[:start]
+            if len(self.buffer) < 5:
+                return frames
+            length = int.from_bytes(self.buffer[3:5], "little")
+            if len(self.buffer) < 7 + length:
+                return frames
+            body = bytes(self.buffer[2:5 + length])
+            if fletcher16(body) == self.buffer[5 + length:7 + length]:
+                frames.append((body[0], body[3:]))
+                del self.buffer[:7 + length]
+            else:
+                # not a frame, the sync bytes were console output
+                self.write_console(self.buffer[:1])
+                del self.buffer[:1]
+
+    def write_console(self, data):
+        if data and self.console:
+            self.console.write(data.decode(errors="replace"))
+            self.console.flush()
+
+
+def parse_status(payload):
+    return dict(zip(STATUS_FIELDS, struct.unpack_from(f"<{len(STATUS_FIELDS)}I", payload)))
+
+# Song ---------------------------------------------------------------------------------------------
+
+def prepare(vgm_data, loops=0):
+    """Split the song in the items to send, in order:
+    - ("rom", offset, rom_start_address, data, sample) for OKIM6295 ROM data blocks,
+    - ("data", offset, commands, sample) for up to MAX_DATA_SIZE bytes of whole commands,
+    offset is the stream offset the item is sent at, sample the song sample after it"""
+    header = parse_header(vgm_data)
+    commands = []
+    loop_index = None
+    for offset, cmd, operands in iter_commands(vgm_data, header):
+        if cmd == CMD_END:
+            break
+        if header.loop_offset is not None and loop_index is None and offset >= header.loop_offset:
+            loop_index = len(commands)
+        commands.append((offset, cmd, operands))
+    if loop_index is not None:
+        commands += commands[loop_index:] * loops
+
+    items = []
+    pending = bytearray()
+    offset = 0
+    sample = 0
+
+    def flush():
+        nonlocal offset
+        if pending:
+            items.append(("data", offset, bytes(pending), sample))
+            offset += len(pending)
+            pending.clear()
+
+    for command_offset, cmd, operands in commands:
+        if cmd == CMD_DATA_BLOCK:
+            block_type, payload = operands
+            if block_type == DATA_BLOCK_OKIM6295_ROM:
+                flush()
+                rom_start_address, data = parse_okim6295_rom_block(payload)
+                # vgmplay reads bit 31 of the address as the chip
+                rom_start_address |= data_block_chip(vgm_data, command_offset) << 31
+                items.append(("rom", offset, rom_start_address, data, sample))
+            continue
+        length = 1 + len(operands)
+        if len(pending) + length > MAX_DATA_SIZE:
+            flush()
+        pending += vgm_data[command_offset:command_offset + length]
+        # timer0_isr spends a sample on each command, then waits
+        sample += 1 + wait_samples(vgm_data, command_offset)
+    pending.append(CMD_END)
+    flush()
+    return items
+
+
+def rom_frames(rom_start_address, data):
+    """ROM data split in frames"""
+    for i in range(0, len(data), MAX_DATA_SIZE):
+        payload = (rom_start_address + i).to_bytes(4, "little") + data[i:i + MAX_DATA_SIZE]
+        yield frame(FRAME_ROM, payload)
+
+# Link ---------------------------------------------------------------------------------------------
+
+class Link:
+    def __init__(self, port, baudrate, timeout):
+        self.serial = serial.serial_for_url(port, baudrate=baudrate, timeout=0.01)
+        self.reader = FrameReader()
+        self.timeout = timeout
+        self.status = None
+
+    def poll(self, timeout=None):
+        """Waits up to timeout for status frames, returns the last one or None"""
+        deadline = time.time() + (self.timeout if timeout is None else timeout)
+        while True:
+            status = None
+            data = self.serial.read(max(1, self.serial.in_waiting))
+            for frame_type, payload in self.reader.feed(data):
+                if frame_type == FRAME_STATUS:
+                    status = self.status = parse_status(payload)
+            if status is not None or time.time() >= deadline:
+                return status
+
+    def request(self, data, done, retries=5):
+        """Sends data until a status frame satisfying done comes back"""
+        for _ in range(retries):
+            self.serial.write(data)
+            deadline = time.time() + self.timeout
+            while time.time() < deadline:
+                status = self.poll(deadline - time.time())
+                if status is not None and done(status):
+                    return status
+        raise RuntimeError("no answer from vgmplay, is it built with UART_STREAM=1?")
+
+# Main ---------------------------------------------------------------------------------------------
+
+def stream(link, items, lead, verbose):
+    """Sends items while the device plays them, returns the last status"""
+    # reset the player
+    status = link.request(frame(FRAME_HELLO), lambda s: s["head"] == 0 and s["flags"] == 0)
+    ring_size = status["ring_size"]
+    errors = status["errors"]
+    first = {}
+    for i, item in enumerate(items):
+        first.setdefault(item[1], i)
+    index = 0
+    playing = False
+    last_status = time.time()
+
+    while True:
+        status = link.poll(0.01)
+        now = time.time()
+        if status is not None:
+            last_status = now
+            if status["flags"] & STATUS_FINISHED:
+                return status
+            if status["errors"] != errors:
+                # frames lost: send again from the ring head
+                if verbose:
+                    print(f"\n{status['errors'] - errors} frame(s) lost, resending from {status['head']}",
+                          file=sys.stderr)
+                errors = status["errors"]
+                index = first.get(status["head"], index)
+        elif now - last_status > link.timeout:
+            # nothing heard: the last frames may be lost, send again from the last known head and
+            # ask for the status (empty data frame)
+            last_status = now
+            index = first.get(link.status["head"], index)
+            link.serial.write(frame(FRAME_DATA))
+
+        # send what fits in the ring
+        ring_full = False
+        while index < len(items):
+            item = items[index]
+            if item[0] == "rom":
+                if playing:
+                    print(f"\nwarning: OKIM6295 ROM data block at {item[4] / VGM_SAMPLE_RATE:.2f} s "
+                          "sent ahead of time", file=sys.stderr)
+                for data in rom_frames(item[2], item[3]):
+                    applied = link.status["rom_frames"]
+                    link.request(data, lambda s: s["rom_frames"] > applied)
+            else:
+                ring_full = item[1] + len(item[2]) > link.status["position"] + ring_size
+                if ring_full:
+                    break
+                link.serial.write(frame(FRAME_DATA, item[1].to_bytes(4, "little") + item[2]))
+            index += 1
+
+        s = link.status
+        buffered = ((items[index - 1][-1] if index else 0) - s["sample"]) / VGM_SAMPLE_RATE
+        if not playing and (index == len(items) or ring_full or buffered >= lead):
+            link.request(frame(FRAME_PLAY), lambda s: s["flags"] & (STATUS_PLAYING | STATUS_FINISHED))
+            playing = True
+
+        print(f"\r{s['sample'] / VGM_SAMPLE_RATE:7.2f} s  lead {buffered:5.2f} s  "
+              f"ring {s['head'] - s['position']:5d}/{ring_size}  underruns {s['underruns']}  "
+              f"errors {s['errors']}", end="", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a song to vgmplay (UART_STREAM=1) while it plays")
+    parser.add_argument("port",                                              help="Serial port or pyserial URL (socket://localhost:2000 for sim.py --uart-tcp-port 2000).")
+    parser.add_argument("song",                                              help=".vgm or .vgz file.")
+    parser.add_argument("--baudrate",  default=115200, type=int,             help="UART baudrate.")
+    parser.add_argument("--loops",     default=0,      type=int,             help="Play the loop this many times.")
+    parser.add_argument("--lead",      default=2.0,    type=float,           help="Seconds of audio buffered before playing (less if the ring is full first).")
+    parser.add_argument("--timeout",   default=1.0,    type=float,           help="Seconds without answer before sending again.")
+    parser.add_argument("--verbose",   action="store_true",                 help="Report lost frames.")
+    args = parser.parse_args()
+
+    vgm_data = load_vgm(args.song)
+    items = prepare(vgm_data, args.loops)
+
+    # 10 bits per byte on the wire, the data has to go faster than it's played
+    data_size = sum(len(item[2]) + 9 for item in items if item[0] == "data")
+    duration = items[-1][-1] / VGM_SAMPLE_RATE
+    if duration and data_size / duration > args.baudrate / 10:
+        print(f"warning: {data_size / duration:.0f} bytes/s of sound data, more than the "
+              f"{args.baudrate // 10} bytes/s the UART carries: expect underruns", file=sys.stderr)
+
+    link = Link(args.port, args.baudrate, args.timeout)
+    try:
+        status = stream(link, items, args.lead, args.verbose)
+    except KeyboardInterrupt:
+        link.serial.write(frame(FRAME_STOP))
+        status = link.status
+    print(file=sys.stderr)
+    if status is not None:
+        print(f"{status['sample'] / VGM_SAMPLE_RATE:.2f} s played, {status['underruns']} underruns, "
+              f"{status['errors']} frames lost")
+    sys.exit(1 if status is None or status["underruns"] else 0)
+
+if __name__ == "__main__":
+    main()
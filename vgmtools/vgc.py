@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""VGC: pre-compiled VGM command stream for vgmplay
+
+A .vgc file is the VGM stream of a CPS1 song with all the decoding work timer0_isr would do
+moved to the host. Layout (all fields little endian):
+
+    0x00  "Vgc " magic
+    0x04  version
+    0x08  total # samples
+    0x0C  loop # samples
+    0x10  loop command index (0xffffffff if the song doesn't loop)
+    0x14  commands offset (bytes)
+    0x18  # commands
+    0x1C  blocks offset (bytes)
+    0x20  # blocks
+    0x24  YM2151 clock
+    0x28  OKIM6295 clock
+    0x2C  reserved
+
+Commands are 32 bit words, bits 31:30 select the operation:
+
+    0 WAIT      bits 29:0 samples to wait
+    1 YM2151    bits 29:16 samples to wait after the write, 15:8 register, 7:0 value
+    2 OKIM6295  bits 29:16 samples to wait after the write, 15:8 register, 7:0 value
+    3 CONTROL   bits 29:24 sub operation: 0 end of sound data, 1 copy OKIM6295 ROM block
+                (bits 23:0 block index)
+
+The block table holds (rom start address, size, data offset) triplets, block data is 4 bytes
+aligned.
+
+A VGC stream drives one YM2151/OKIM6295 pair: the second chip commands and ROM blocks of dual
+chip songs are skipped.
+"""
+
+import argparse
+import struct
+
+from vgmtools.vgm import *
+
+VGC_MAGIC = b"Vgc "
+VGC_VERSION = 0x100
+VGC_HEADER_SIZE = 0x30
+VGC_NO_LOOP = 0xffffffff
+
+OP_WAIT = 0
+OP_YM2151 = 1
+OP_OKIM6295 = 2
+OP_CONTROL = 3
+
+CONTROL_END = 0
+CONTROL_ROM = 1
+
+MAX_WAIT = (1 << 30) - 1
+MAX_WRITE_WAIT = (1 << 14) - 1
+
+
+def align(value, alignment=4):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def wait_word(samples):
+    return (OP_WAIT << 30) | samples
+
+
+def write_word(op, addr, data, wait=0):
+    return (op << 30) | (wait << 16) | (addr << 8) | data
+
+
+def control_word(sub_op, arg=0):
+    return (OP_CONTROL << 30) | (sub_op << 24) | arg
+
+
+class VgcCompiler:
+    """Turns a VGM stream into VGC command words
+
+    Consecutive waits are merged and folded into the preceding register write when they fit in
+    its 14 bit wait field. Waits are never merged across the loop point.
+    """
+    def __init__(self):
+        self.words = []
+        self.blocks = []
+        self.loop_index = VGC_NO_LOOP
+        self.pending_wait = 0
+        self.fold_barrier = 0
+        self.skipped = {}
+
+    def flush_wait(self):
+        wait = self.pending_wait
+        self.pending_wait = 0
+        if wait == 0:
+            return
+        last_op = self.words[-1] >> 30 if len(self.words) > self.fold_barrier else None
+        if last_op in (OP_YM2151, OP_OKIM6295):
+            folded = min(MAX_WRITE_WAIT - ((self.words[-1] >> 16) & MAX_WRITE_WAIT), wait)
+            self.words[-1] += folded << 16
+            wait -= folded
+        while wait > 0:
+            chunk = min(wait, MAX_WAIT)
+            self.words.append(wait_word(chunk))
+            wait -= chunk
+
+    def compile(self, vgm_data):
+        header = parse_header(vgm_data)
+
+        for offset, cmd, operands in iter_commands(vgm_data, header):
+            if offset == header.loop_offset:
+                self.flush_wait()
+                self.loop_index = len(self.words)
+                self.fold_barrier = self.loop_index
+
+            wait = wait_samples(vgm_data, offset)
+            if wait:
+                self.pending_wait += wait
+                continue
+
+            if cmd == CMD_YM2151_WRITE:
+                self.flush_wait()
+                self.words.append(write_word(OP_YM2151, operands[0], operands[1]))
+            elif cmd == CMD_OKIM6295_WRITE and not operands[0] & OKIM6295_SECOND_CHIP:
+                self.flush_wait()
+                self.words.append(write_word(OP_OKIM6295, operands[0], operands[1]))
+            elif cmd == CMD_DATA_BLOCK and operands[0] == DATA_BLOCK_OKIM6295_ROM and \
+                    data_block_chip(vgm_data, offset) == 0:
+                self.flush_wait()
+                self.words.append(control_word(CONTROL_ROM, len(self.blocks)))
+                self.blocks.append(parse_okim6295_rom_block(operands[1]))
+            elif cmd == CMD_END:
+                break
+            else:
+                self.skipped[cmd] = self.skipped.get(cmd, 0) + 1
+
+        self.flush_wait()
+        self.words.append(control_word(CONTROL_END))
+
+        # A loop without any wait would spin forever inside the ISR
+        if self.loop_index != VGC_NO_LOOP:
+            loop_words = self.words[self.loop_index:]
+            if not any(word_wait(w) for w in loop_words):
+                self.loop_index = VGC_NO_LOOP
+
+        return self.pack(header)
+
+    def pack(self, header):
+        commands_offset = VGC_HEADER_SIZE
+        blocks_offset = commands_offset + 4 * len(self.words)
+        data_offset = blocks_offset + 12 * len(self.blocks)
+
+        table = b""
+        data = b""
+        for rom_start_address, block in self.blocks:
+            table += struct.pack("<III", rom_start_address, len(block), data_offset + len(data))
+            data += block + bytes(align(len(block)) - len(block))
+
+        vgc = VGC_MAGIC + struct.pack("<11I",
+            VGC_VERSION,
+            header.n_samples,
+            header.loop_n_samples,
+            self.loop_index,
+            commands_offset,
+            len(self.words),
+            blocks_offset,
+            len(self.blocks),
+            header.ym2151_clock,
+            header.okim6295_clock,
+            0)
+        vgc += struct.pack(f"<{len(self.words)}I", *self.words)
+        return vgc + table + data
+
+
+def word_wait(word):
+    """Samples to wait after executing a command word"""
+    op = word >> 30
+    if op == OP_WAIT:
+        return word & MAX_WAIT
+    if op in (OP_YM2151, OP_OKIM6295):
+        return (word >> 16) & MAX_WRITE_WAIT
+    return 0
+
+
+def compile_vgm(vgm_data):
+    return VgcCompiler().compile(vgm_data)
+
+
+def parse_vgc(vgc_data):
+    """Returns (header fields dict, command words, blocks)"""
+    if vgc_data[0:4] != VGC_MAGIC:
+        raise ValueError("Invalid VGC file")
+    fields = struct.unpack_from("<11I", vgc_data, 4)
+    names = ("version", "n_samples", "loop_n_samples", "loop_index", "commands_offset",
+             "n_commands", "blocks_offset", "n_blocks", "ym2151_clock", "okim6295_clock",
+             "reserved")
+    header = dict(zip(names, fields))
+    words = struct.unpack_from(f"<{header['n_commands']}I", vgc_data, header["commands_offset"])
+    blocks = []
+    for i in range(header["n_blocks"]):
+        rom_start_address, size, offset = struct.unpack_from("<III", vgc_data,
+                                                             header["blocks_offset"] + 12 * i)
+        blocks.append((rom_start_address, vgc_data[offset:offset + size]))
+    return header, words, blocks
+
+
+# Report -------------------------------------------------------------------------------------------
+
+def vgm_decode_cost(vgm_data):
+    """Walk the stream the way timer0_isr does: one command per serviced tick, byte loads"""
+    header = parse_header(vgm_data)
+    cost = dict(bytes=0, commands=0, loads=0, busy_ticks=0)
+    for offset, cmd, operands in iter_commands(vgm_data, header):
+        length = command_length(vgm_data, offset)
+        cost["bytes"] += length
+        cost["commands"] += 1
+        cost["busy_ticks"] += 1
+        if cmd == CMD_DATA_BLOCK:
+            cost["loads"] += 14  # type, size and two parse_uint32 calls
+        else:
+            cost["loads"] += min(length, 3)
+    return cost
+
+
+def vgc_decode_cost(vgc_data):
+    """Walk the stream the way vgc_play does: all commands of a tick in one pass, word loads"""
+    header, words, blocks = parse_vgc(vgc_data)
+    cost = dict(bytes=len(vgc_data), commands=len(words), loads=0, busy_ticks=0, max_burst=0)
+    burst = 0
+    for word in words:
+        cost["loads"] += 1
+        burst += 1
+        if word_wait(word) or word == control_word(CONTROL_END):
+            cost["busy_ticks"] += 1
+            cost["max_burst"] = max(cost["max_burst"], burst)
+            burst = 0
+        elif word >> 30 == OP_CONTROL:
+            cost["loads"] += 3  # block table entry
+    return cost
+
+
+def report(vgm_data, vgc_data, skipped):
+    vgm = vgm_decode_cost(vgm_data)
+    vgc = vgc_decode_cost(vgc_data)
+    print(f"{'':24}{'VGM':>12}{'VGC':>12}")
+    print(f"{'stream bytes':24}{vgm['bytes']:>12}{vgc['bytes']:>12}")
+    print(f"{'commands':24}{vgm['commands']:>12}{vgc['commands']:>12}")
+    print(f"{'memory loads':24}{vgm['loads']:>12}{vgc['loads']:>12}")
+    print(f"{'ticks decoding':24}{vgm['busy_ticks']:>12}{vgc['busy_ticks']:>12}")
+    print(f"max commands in one tick: {vgc['max_burst']}")
+    if skipped:
+        print("skipped commands: " + ", ".join(f"0x{c:02x} x{n}" for c, n in sorted(skipped.items())))
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a VGM file into a VGC command stream")
+    parser.add_argument("input",                                help="Input .vgm or .vgz file.")
+    parser.add_argument("-o", "--output",   default=None,       help="Output .vgc file.")
+    parser.add_argument("--report",         action="store_true", help="Print size/decode cost report.")
+    args = parser.parse_args()
+
+    vgm_data = load_vgm(args.input)
+    compiler = VgcCompiler()
+    vgc_data = compiler.compile(vgm_data)
+
+    output = args.output
+    if output is None:
+        output = args.input.rsplit(".", 1)[0] + ".vgc"
+    with open(output, "wb") as f:
+        f.write(vgc_data)
+
+    if args.report:
+        report(vgm_data, vgc_data, compiler.skipped)
+
+if __name__ == "__main__":
+    main()
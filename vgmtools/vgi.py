@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""VGI: seek index of a VGM song for vgmplay
+
+The song is walked once the way timer0_isr plays it and, every interval samples, the offset of
+the next command is recorded with a snapshot of the chip state at that point. vgmplay jumps to
+any entry in O(1): it writes the snapshot registers that differ from the current ones and goes
+on from the offset, the ROM data blocks still live at the entry are copied again. The snapshot
+taken at the loop point is replayed at every loop, so each pass starts from the state the first one
+had. Layout (all fields little endian):
+
+    0x00  "Vgi " magic
+    0x04  version
+    0x08  interval (samples between entries)
+    0x0C  # entries
+    0x10  loop entry index (0xffffffff if the song doesn't loop), stored after the others
+    0x14  ROM blocks offset (bytes)
+    0x18  # ROM blocks
+    0x1C  entries offset (bytes)
+    0x20  VGM eof offset, to check the index belongs to the song
+    0x24  # chips (2 for dual chip songs, 1 otherwise)
+    0x28  reserved (2 words)
+
+The ROM block table holds the VGM offsets of OKIM6295 ROM data block (0x67 0x66 0x8B) commands,
+of both chips: for each entry, the blocks loaded before it that are still live, the last writer of
+some ROM byte, in VGM order. Copying them again in that order gives the ROM the entry had.
+Consecutive entries with the same live blocks share them. Entries are ENTRY_SIZE bytes followed by a CHIP_SIZE snapshot
+per chip:
+
+    0x00  sample (counted as timer0_isr does: one per command plus the waits)
+    0x04  VGM offset of the next command
+    0x08  index of its first live ROM block in the ROM block table
+    0x0C  # live ROM blocks
+
+    0x00  OKIM6295 phrase select waiting for its channel byte (0 if none)
+    0x01  OKIM6295 phrase playing on each channel (4 bytes, 0 if idle)
+    0x05  OKIM6295 attenuation of each channel (4 bytes)
+    0x09  YM2151 PMD (register 0x19 writes with bit 7 set)
+    0x0A  YM2151 last key on/off (register 0x08) write of each channel (8 bytes)
+    0x12  reserved (2 bytes)
+    0x14  YM2151 registers (256 bytes, 0x19 holds AMD)
+
+The jt6295 can't start a phrase midway: voices playing at an entry restart from the beginning.
+"""
+
+import argparse
+import struct
+
+from vgmtools.adpcm import N_VOICES, ROM_SIZE, phrase_bounds, sample_rate
+from vgmtools.vgm import *
+
+VGI_MAGIC = b"Vgi "
+VGI_VERSION = 0x300
+VGI_HEADER_SIZE = 0x30
+VGI_NO_LOOP = 0xffffffff
+ENTRY_SIZE = 0x10
+CHIP_SIZE = 0x114
+
+YM2151_KEY_ON = 0x08
+YM2151_PMD_AMD = 0x19
+
+
+class ChipState:
+    """YM2151 registers and OKIM6295 voices as the writes so far left them"""
+    def __init__(self, ss=0):
+        self.regs = bytearray(256)
+        self.key = bytearray(range(8))
+        self.pmd = 0
+        self.rom = bytearray(ROM_SIZE)
+        self.rom_writers = []  # (start, end, VGM offset of the ROM data block) of the ROM bytes
+        self.rate = sample_rate(ss)
+        self.latch = 0
+        self.voices = [(0, 0, 0)] * N_VOICES  # (phrase, attenuation, end sample)
+
+    def ym2151_write(self, addr, data):
+        if addr == YM2151_KEY_ON:
+            self.key[data & 7] = data
+        elif addr == YM2151_PMD_AMD and data & 0x80:
+            self.pmd = data
+        else:
+            self.regs[addr] = data
+
+    def rom_write(self, rom_start_address, data, offset):
+        end = min(rom_start_address + len(data), ROM_SIZE)
+        self.rom[rom_start_address:end] = data[:max(end - rom_start_address, 0)]
+        if rom_start_address >= end:
+            return
+        writers = []
+        for start, stop, writer in self.rom_writers:
+            if start < rom_start_address:
+                writers.append((start, min(stop, rom_start_address), writer))
+            if stop > end:
+                writers.append((max(start, end), stop, writer))
+        self.rom_writers = sorted(writers + [(rom_start_address, end, offset)])
+
+    def okim6295_write(self, t, data):
+        if self.latch:
+            phrase, self.latch = self.latch & 0x7f, 0
+            start, end = phrase_bounds(self.rom, phrase)
+            length = 2 * (end - start + 1) if start < end else 0
+            for i in range(N_VOICES):
+                # the chip ignores starts on busy channels
+                if data & (0x10 << i) and self.voices[i][2] <= t:
+                    self.voices[i] = (phrase, data & 15, t + length * VGM_SAMPLE_RATE / self.rate)
+        elif data & 0x80:
+            self.latch = data
+        else:
+            for i in range(N_VOICES):
+                if data & (0x08 << i):
+                    self.voices[i] = (0, 0, 0)
+
+    def snapshot(self, t):
+        voices = [v if v[2] > t else (0, 0, 0) for v in self.voices]
+        return struct.pack("<B4B4BB8s2x", self.latch, *[v[0] for v in voices],
+                           *[v[1] for v in voices], self.pmd, bytes(self.key)) + bytes(self.regs)
+
+
+def entry(states, t, offset, rom_blocks):
+    """Entry of the chip states at t, its live ROM blocks added to the rom_blocks table"""
+    live = sorted({writer for state in states for start, stop, writer in state.rom_writers})
+    # entries run in VGM order: the same blocks as the previous one are at the end of the table
+    first = len(rom_blocks) - len(live)
+    if not live or rom_blocks[first:] != live:
+        first = len(rom_blocks)
+        rom_blocks.extend(live)
+    return struct.pack("<4I", t, offset, first, len(live)) + b"".join(state.snapshot(t) for state in states)
+
+
+def index_vgm(vgm_data, interval=VGM_SAMPLE_RATE, ss=0):
+    """Returns (entries, loop entry or None, ROM block table) for a VGM stream, the entries
+    hold a snapshot of both chips of dual chip songs"""
+    header = parse_header(vgm_data)
+    states = [ChipState(ss) for _ in range(2 if header.dual_chip else 1)]
+    entries = []
+    loop_entry = None
+    rom_blocks = []
+    t = 0
+    for offset, cmd, operands in iter_commands(vgm_data, header):
+        if cmd == CMD_END:
+            break
+        while len(entries) * interval <= t:
+            entries.append(entry(states, t, offset, rom_blocks))
+        if offset == header.loop_offset:
+            loop_entry = entry(states, t, offset, rom_blocks)
+
+        # second chip writes of songs without the dual chip bit aren't played
+        if cmd in (CMD_YM2151_WRITE, CMD_YM2151_WRITE_2):
+            chip = int(cmd == CMD_YM2151_WRITE_2)
+            if chip < len(states):
+                states[chip].ym2151_write(operands[0], operands[1])
+        elif cmd == CMD_OKIM6295_WRITE:
+            chip = int(bool(operands[0] & OKIM6295_SECOND_CHIP))
+            if chip < len(states) and operands[0] & 0x7f == 0:
+                states[chip].okim6295_write(t, operands[1])
+        elif cmd == CMD_DATA_BLOCK and operands[0] == DATA_BLOCK_OKIM6295_ROM:
+            chip = data_block_chip(vgm_data, offset)
+            if chip < len(states):
+                rom_start_address, data = parse_okim6295_rom_block(operands[1])
+                states[chip].rom_write(rom_start_address, data, offset)
+        # timer0_isr spends a sample on each command, then waits
+        t += 1 + wait_samples(vgm_data, offset)
+
+    if header.loop_offset is not None and loop_entry is None:
+        raise ValueError("loop offset is not on a command")
+    return entries, loop_entry, rom_blocks
+
+
+def build_vgi(vgm_data, interval=VGM_SAMPLE_RATE, ss=0):
+    header = parse_header(vgm_data)
+    entries, loop_entry, rom_blocks = index_vgm(vgm_data, interval, ss)
+
+    blocks_offset = VGI_HEADER_SIZE
+    entries_offset = blocks_offset + 4 * len(rom_blocks)
+    out = bytearray(VGI_MAGIC)
+    out += struct.pack("<9I", VGI_VERSION, interval, len(entries),
+                       VGI_NO_LOOP if loop_entry is None else len(entries),
+                       blocks_offset, len(rom_blocks), entries_offset, header.eof_offset,
+                       2 if header.dual_chip else 1)
+    out += bytes(VGI_HEADER_SIZE - len(out))
+    out += struct.pack(f"<{len(rom_blocks)}I", *rom_blocks)
+    for entry in entries + ([loop_entry] if loop_entry is not None else []):
+        out += entry
+    return bytes(out)
+
+# Main ---------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the vgmplay seek index of a VGM file")
+    parser.add_argument("input",                                     help="Input .vgm or .vgz file.")
+    parser.add_argument("-o", "--output",   default=None,            help="Output .vgi file.")
+    parser.add_argument("--interval",       default=1.0, type=float, help="Seconds between entries.")
+    parser.add_argument("--ss",             default=0, type=int,     help="OKIM6295 ss pin, for the phrase lengths.")
+    args = parser.parse_args()
+
+    vgm_data = load_vgm(args.input)
+    vgi_data = build_vgi(vgm_data, int(args.interval * VGM_SAMPLE_RATE), args.ss)
+
+    output = args.output
+    if output is None:
+        output = args.input.rsplit(".", 1)[0] + ".vgi"
+    with open(output, "wb") as f:
+        f.write(vgi_data)
+    n_entries = struct.unpack_from("<I", vgi_data, 0x0C)[0]
+    print(f"{output}: {n_entries} entries, {len(vgi_data)} bytes ({len(vgm_data)} bytes of VGM)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import gzip
+import logging
+import struct
+
+VGM_SAMPLE_RATE = 44100
+
+# Commands understood by vgmplay (see timer0_isr in software/vgmplay/timer.c)
+CMD_YM2151_WRITE = 0x54
+CMD_YM2151_WRITE_2 = 0xa4  # second chip of a dual chip song
+CMD_WAIT = 0x61
+CMD_WAIT_735 = 0x62
+CMD_WAIT_882 = 0x63
+CMD_END = 0x66
+CMD_DATA_BLOCK = 0x67
+CMD_OKIM6295_WRITE = 0xb8
+
+DATA_BLOCK_OKIM6295_ROM = 0x8b
+# bit 31 of a ROM data block size: the data is for the second chip
+DATA_BLOCK_SECOND_CHIP = 0x80000000
+# bit 7 of the OKIM6295 write register: second chip
+OKIM6295_SECOND_CHIP = 0x80
+
+logger = logging.getLogger("vgm")
+
+
+class VgmHeader:
+    def __init__(self):
+        self.eof_offset = 0
+        self.version = 0
+        self.n_samples = 0
+        self.loop_n_samples = 0
+        self.loop_offset = None
+        self.vgm_data_offset = 0
+        self.ym2151_clock = 0
+        self.okim6295_clock = 0
+        self.dual_chip = False
+
+
+def parse_uint32(buffer, offset):
+    return struct.unpack_from("<I", buffer, offset)[0]
+
+
+def parse_header(vgm_data):
+    """Parse a VGM header following the same rules as vgm.c:parse_header
+
+    Differences with the firmware: a zero loop offset means the song doesn't loop (loop_offset is
+    None) and the OKIM6295 clock is parsed.
+    """
+    if len(vgm_data) < 64 or vgm_data[0:4] != b"Vgm ":
+        raise ValueError("Invalid VGM file")
+
+    header = VgmHeader()
+
+    # 0x04: Eof offset (32 bits)
+    header.eof_offset = parse_uint32(vgm_data, 0x04) + 0x04
+    if len(vgm_data) < header.eof_offset:
+        raise ValueError("Total size for file is too small; file may be truncated")
+
+    # 0x08: Version number (32 bits)
+    header.version = parse_uint32(vgm_data, 0x08)
+    if header.version > 0x171:
+        logger.warning("version > 1.71 detected, some things may not work")
+
+    # 0x18: Total # samples (32 bits)
+    header.n_samples = parse_uint32(vgm_data, 0x18)
+
+    # 0x1C: Loop offset (32 bits)
+    loop_offset = parse_uint32(vgm_data, 0x1c)
+    if loop_offset != 0:
+        header.loop_offset = loop_offset + 0x1c
+
+    # 0x20: Loop # samples (32 bits)
+    header.loop_n_samples = parse_uint32(vgm_data, 0x20)
+
+    # 0x30: YM2151/YM2164 clock (32 bits)
+    if header.version >= 0x110:
+        header.ym2151_clock = parse_uint32(vgm_data, 0x30)
+        if header.ym2151_clock == 0:
+            raise ValueError("vgm file doesn't have YM2151. Nothing to play here...")
+
+    # 0x34: VGM data offset (32 bits)
+    header.vgm_data_offset = parse_uint32(vgm_data, 0x34) + 0x34
+    if header.version < 0x150:
+        header.vgm_data_offset = 0x40
+
+    # 0x98: OKIM6295 clock (32 bits), bit 31 is the status of pin 7 (ss)
+    if header.version >= 0x161 and header.vgm_data_offset >= 0x9c:
+        header.okim6295_clock = parse_uint32(vgm_data, 0x98)
+
+    # bit 30 of either clock: dual chip song (0xa4, 0xb8 with aa bit 7 set)
+    header.dual_chip = bool((header.ym2151_clock | header.okim6295_clock) & 0x40000000)
+
+    return header
+
+
+def load_vgm(path):
+    """Read a .vgm or .vgz file, returns the uncompressed bytes"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[0:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return data
+
+
+def command_length(vgm_data, offset):
+    """Length in bytes of the command at offset, following the VGM 1.71 specification"""
+    cmd = vgm_data[offset]
+    if cmd == CMD_DATA_BLOCK:
+        return 7 + (parse_uint32(vgm_data, offset + 3) & ~DATA_BLOCK_SECOND_CHIP)
+    if 0x30 <= cmd <= 0x3f or cmd in (0x4f, 0x50, 0x94):
+        return 2
+    if 0x40 <= cmd <= 0x5f or 0xa0 <= cmd <= 0xbf or cmd == CMD_WAIT:
+        return 3
+    if 0xc0 <= cmd <= 0xdf:
+        return 4
+    if 0xe0 <= cmd <= 0xff or cmd in (0x90, 0x91, 0x95):
+        return 5
+    if cmd == 0x92:
+        return 6
+    if cmd == 0x93:
+        return 11
+    if cmd == 0x68:
+        return 12
+    return 1
+
+
+def wait_samples(vgm_data, offset):
+    """Number of samples the command at offset waits for, 0 if it's not a wait command"""
+    cmd = vgm_data[offset]
+    if cmd == CMD_WAIT:
+        return vgm_data[offset + 1] | (vgm_data[offset + 2] << 8)
+    if cmd == CMD_WAIT_735:
+        return 735
+    if cmd == CMD_WAIT_882:
+        return 882
+    if 0x70 <= cmd <= 0x7f:
+        return (cmd & 15) + 1
+    if 0x80 <= cmd <= 0x8f:
+        return cmd & 15
+    return 0
+
+
+def iter_commands(vgm_data, header):
+    """Yield (offset, command, operands) for every command up to and including the end of sound
+    data (0x66)
+
+    Data block operands are returned as (type, payload).
+    """
+    end = min(header.eof_offset, len(vgm_data))
+    offset = header.vgm_data_offset
+    while offset < end:
+        cmd = vgm_data[offset]
+        length = command_length(vgm_data, offset)
+        if cmd == CMD_DATA_BLOCK:
+            block_type = vgm_data[offset + 2]
+            operands = (block_type, vgm_data[offset + 7:offset + length])
+        else:
+            operands = vgm_data[offset + 1:offset + length]
+        yield offset, cmd, operands
+        if cmd == CMD_END:
+            return
+        offset += length
+
+
+def data_block_chip(vgm_data, offset):
+    """Chip (0 or 1) the data block command at offset is for"""
+    return parse_uint32(vgm_data, offset + 3) >> 31
+
+
+def parse_okim6295_rom_block(payload):
+    """Split a 0x8B data block into (rom_start_address, data)"""
+    rom_start_address = parse_uint32(payload, 4)
+    return rom_start_address, payload[8:]